@@ -0,0 +1,660 @@
+"""
+Сквозной бенчмарк конвейера на синтетическом корпусе сканов: документов в
+секунду, перцентили этапов и точность распознавания — для сравнения ревизий.
+
+    python bench_pipeline.py [--docs 200] [--corpus bench_corpus] [--regen]
+                             [--mode thread] [--qr-workers N] [--ocr-workers N]
+                             [--s3-latency 0] [--db-latency 0]
+                             [--out result.json] [--compare old.json]
+
+Корпус (создаётся при первом запуске или с --regen, лежит в --corpus
+с manifest.json — истинными типом, ID и телефоном каждого файла):
+  * бланки — настоящие init.py и blank.py из generate-pdf с известными
+    номерами и подписью QR из settings.ini; шрифт Arial из Windows
+    подменяется на --font;
+  * телефон в трафарете init-бланка — рукописные цифры тем же генератором
+    штрихов, на котором учится модель (number-recognition/create-dataset.py);
+  * скан: растр --dpi, поворот до ±--rotate°, шум, размытие, JPEG
+    качеством из --jpeg, каждая страница — картинка в PDF;
+  * доля --answers — бланки ответов, доля --batches — пачки из 2–3 писем.
+
+Прогон — как в воркере: полосы qr и ocr (create_engine в режиме --mode),
+скачивание через StorageService, проверка бланка, деление пачек, запись
+итога через handlers.process_document. S3 и PostgreSQL заменены заглушками
+в памяти (с задержкой --s3-latency / --db-latency мс); кэш результатов выключен.
+
+--out — результат JSON-файлом (ревизия, настройки, пропускная способность,
+этапы, точность); --compare — разница с прошлым результатом.
+Нужен settings.ini (как у воркера).
+"""
+import argparse
+import ast
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import cv2
+import fitz
+import numpy as np
+
+from src import batch, handlers, metrics, queries
+from src.config import (BATCH_SPLIT, OCR_BACKEND, OCR_MIN_PROB, OCR_TIERS, QR_PAGE_WORKERS, QR_SCAN_MODE,
+                        QR_SECRET, THREADS_CORES, THREADS_PIN, WORKER_MODE, WORKER_OCR_WORKERS,
+                        WORKER_QR_WORKERS)
+from src.engine import create_engine
+from src.services import StorageService
+from src.threads import ThreadBudget
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_DIR = os.path.join(ROOT, "generate-pdf")
+DATASET_SCRIPT = os.path.join(ROOT, "number-recognition", "create-dataset.py")
+
+FONTS = ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/Library/Fonts/Arial.ttf", "C:/Windows/Fonts/arial.ttf")
+
+# Трафарет телефона в init.py: картинка 1236x220 px кладётся в 90x16 мм с (37, 44) мм;
+# 11 клеток по 59 px шириной, первая с x = 127, шаг ~103 px, по высоте 63–197 px
+STENCIL_MM = (37.0, 44.0, 90.0, 16.0)
+STENCIL_PX = (1236, 220)
+CELL_X = (127, 230, 333, 437, 539, 643, 743, 847, 950, 1054, 1158)
+CELL_W, CELL_Y = 59, (63, 197)
+
+BUCKET = "bench"
+_STATEMENT = re.compile(r"\brec_\w+|\b(?:FROM|INTO|UPDATE) \w+")
+PERCENTILES = (50, 90, 99)
+
+
+# =========================================================
+# ГЕНЕРАТОРЫ
+# =========================================================
+def load_module(path: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_strokes(path: str = DATASET_SCRIPT) -> dict:
+    """
+    Пространство имён create-dataset.py (PATHS, штрихи, искажения) без вызовов
+    верхнего уровня — сам скрипт при импорте пересоздаёт датасет на диске.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    tree.body = [node for node in tree.body if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call))]
+    namespace = {"__name__": "create_dataset", "__file__": path}
+    exec(compile(tree, path, "exec"), namespace)
+    return namespace
+
+
+@contextlib.contextmanager
+def generator_env(font: str):
+    """
+    Условия, которых ждут скрипты generate-pdf: рабочая папка (туда пишется PDF)
+    и шрифты C:/Windows/Fonts — отсутствующий файл шрифта подменяется на font.
+    """
+    import fpdf
+
+    bold = font.replace(".ttf", "-Bold.ttf")
+    bold = bold if os.path.exists(bold) else font
+    original = fpdf.FPDF.add_font
+
+    def add_font(self, family=None, style="", fname=None, *args, **kwargs):
+        if fname and not os.path.exists(fname):
+            fname = bold if "B" in style.upper() else font
+        return original(self, family, style, fname, *args, **kwargs)
+
+    cwd = os.getcwd()
+    fpdf.FPDF.add_font = add_font
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+            fpdf.FPDF.add_font = original
+
+
+def blank_pdf(module, prefix: str, number: int) -> bytes:
+    """PDF бланка, как его печатает generate-pdf (внутри generator_env)."""
+    images = {name: os.path.join(GENERATOR_DIR, f"{name}.png") for name in ("logo_1", "logo_2", "stencil", "obraz")}
+    kwargs = {"logo_1_path": images["logo_1"], "logo_2_path": images["logo_2"]}
+    if prefix == "init":
+        kwargs.update(stencil_path=images["stencil"], obraz_path=images["obraz"])
+    module.create_blank(number, QR_SECRET, "ФКУ СИЗО-1", **kwargs)
+    path = f"{prefix}_{number:09d}.pdf"
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+# =========================================================
+# СКАН
+# =========================================================
+def render_digit(strokes: dict, digit: int) -> np.ndarray:
+    """Цифра 32x32 (светлые штрихи на тёмном) — тело цикла generate_dataset."""
+    size = strokes["IMG_SIZE"]
+    img = np.ones((size, size), dtype=np.uint8) * random.randint(0, 30)
+
+    padding = random.randint(4, 8)
+    w = h = size - 2 * padding
+    pts = [(padding + w * i // 2, padding + h * j // 2) for j in range(3) for i in range(3)]
+    jitter = random.randint(0, 4)
+    pts = [(x + random.randint(-jitter, jitter), y + random.randint(-jitter, jitter)) for x, y in pts]
+
+    for start, end in strokes["PATHS"][digit]:
+        line = strokes["curved_line"] if random.random() < 0.4 else strokes["variable_thickness_line"]
+        line(img, pts[start], pts[end])
+
+    if random.random() < 0.7:
+        M = cv2.getRotationMatrix2D((size // 2, size // 2), random.uniform(-25, 25), 1)
+        img = cv2.warpAffine(img, M, (size, size))
+    if random.random() < 0.6:
+        img = strokes["perspective_transform"](img)
+    if random.random() < 0.7:
+        img = strokes["elastic_distortion"](img)
+    return strokes["random_breaks"](img)
+
+
+def write_phone(page: np.ndarray, strokes: dict, phone: str, px_per_mm: float) -> None:
+    """Вписывает цифры телефона в клетки трафарета ручкой случайного нажима."""
+    x0, y0, w_mm, h_mm = STENCIL_MM
+    sx, sy = w_mm / STENCIL_PX[0] * px_per_mm, h_mm / STENCIL_PX[1] * px_per_mm
+    ink = random.randint(20, 90)
+    for cell_x, ch in zip(CELL_X, phone):
+        glyph = render_digit(strokes, int(ch))
+        left = int((x0 * px_per_mm) + (cell_x + random.uniform(-4, 4)) * sx)
+        top = int((y0 * px_per_mm) + (CELL_Y[0] + random.uniform(-6, 6)) * sy)
+        w, h = int(CELL_W * sx), int((CELL_Y[1] - CELL_Y[0]) * sy)
+        alpha = cv2.resize(glyph, (w, h), interpolation=cv2.INTER_CUBIC).astype(np.float32)
+        alpha = np.clip((alpha - 40) / 215, 0, 1)
+        region = page[top:top + h, left:left + w].astype(np.float32)
+        page[top:top + h, left:left + w] = (region * (1 - alpha) + ink * alpha).astype(np.uint8)
+
+
+def degrade(page: np.ndarray, rotate: float, noise: float, jpeg: tuple[int, int]) -> bytes:
+    """Поворот, тон бумаги, шум и размытие сканера; результат — JPEG."""
+    h, w = page.shape
+    paper = random.randint(225, 250)
+    page = np.minimum(page, paper).astype(np.uint8)
+    M = cv2.getRotationMatrix2D((w / 2 + random.uniform(-50, 50), h / 2), random.uniform(-rotate, rotate), 1.0)
+    M[:, 2] += (random.uniform(-15, 15), random.uniform(-15, 15))  # сдвиг листа в сканере
+    page = cv2.warpAffine(page, M, (w, h), flags=cv2.INTER_LINEAR, borderValue=paper)
+    if random.random() < 0.5:
+        page = cv2.GaussianBlur(page, (3, 3), 0)
+    page = np.clip(page + np.random.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, random.randint(*jpeg)])
+    return buf.tobytes()
+
+
+def scan(pages: list[bytes], dpi: int, args, strokes: dict, phones: list[str | None]) -> bytes:
+    """Растеризует страницы бланков, пишет телефоны, портит как сканер и собирает PDF из JPEG."""
+    out = fitz.open()
+    for pdf_bytes, phone in zip(pages, phones):
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as src:
+            rect = src[0].rect
+            pix = src[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        page = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width).copy()
+        if phone:
+            write_phone(page, strokes, phone, dpi / 25.4)
+        out.new_page(width=rect.width, height=rect.height).insert_image(
+            rect, stream=degrade(page, args.rotate, args.noise, args.jpeg))
+    data = out.tobytes(garbage=3, deflate=True)
+    out.close()
+    return data
+
+
+# =========================================================
+# КОРПУС
+# =========================================================
+def corpus_params(args) -> dict:
+    return {"docs": args.docs, "seed": args.seed, "dpi": args.dpi, "rotate": args.rotate, "noise": args.noise,
+            "jpeg": list(args.jpeg), "answers": args.answers, "batches": args.batches,
+            "font": os.path.basename(args.font)}
+
+
+def build_corpus(args) -> list[dict]:
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    init_gen = load_module(os.path.join(GENERATOR_DIR, "init.py"), "bench_init_blank")
+    answer_gen = load_module(os.path.join(GENERATOR_DIR, "blank.py"), "bench_answer_blank")
+    strokes = load_strokes()
+    os.makedirs(args.corpus, exist_ok=True)
+
+    def letter(n: int) -> dict:
+        if random.random() < args.answers:
+            return {"type": "answer", "id": n, "phone": None}
+        phone = random.choice("78") + "".join(random.choices("0123456789", k=10))
+        return {"type": "init", "id": n, "phone": phone}
+
+    items, number = [], 1000
+    with generator_env(args.font):
+        for i in range(args.docs):
+            size = random.randint(2, 3) if random.random() < args.batches else 1
+            letters = [letter(number + k) for k in range(size)]
+            number += size
+            pages = [blank_pdf(init_gen if t["type"] == "init" else answer_gen, t["type"].replace("answer", "blank"),
+                               t["id"]) for t in letters]
+            data = scan(pages, args.dpi, args, strokes, [t["phone"] for t in letters])
+
+            name = f"scan_{i:05d}.pdf"
+            with open(os.path.join(args.corpus, name), "wb") as f:
+                f.write(data)
+            item = {"file": name, **letters[0]} if size == 1 else {"file": name, "type": "batch", "letters": letters}
+            items.append(item)
+            if (i + 1) % 50 == 0:
+                print(f"корпус: {i + 1}/{args.docs}", file=sys.stderr)
+
+    with open(os.path.join(args.corpus, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"params": corpus_params(args), "items": items}, f, ensure_ascii=False, indent=1)
+    return items
+
+
+def load_corpus(args) -> list[dict]:
+    """Корпус из manifest.json, если он собран с теми же параметрами, иначе — заново."""
+    path = os.path.join(args.corpus, "manifest.json")
+    if not args.regen and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["params"] == corpus_params(args):
+            return manifest["items"]
+        print("корпус собран с другими параметрами — пересоздаём", file=sys.stderr)
+    start = time.perf_counter()
+    items = build_corpus(args)
+    print(f"корпус: {len(items)} файлов за {time.perf_counter() - start:.1f} с в {args.corpus}", file=sys.stderr)
+    return items
+
+
+# =========================================================
+# ЗАГЛУШКИ S3 И POSTGRESQL
+# =========================================================
+class MemoryS3:
+    """get_object/put_object клиента boto3 поверх словаря, с задержкой сети."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        time.sleep(self.latency)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        time.sleep(self.latency)
+        with self._lock:
+            self.objects[(Bucket, Key)] = Body
+        return {}
+
+
+class RecordingCursor:
+    """
+    Курсор psycopg2, который только считает запросы: каждый execute «стоит»
+    latency и затрагивает одну строку (аренда наша), fetchone отдаёт новый ID
+    во всех колонках (бланк свободен, письмо создано), fetchall — по ID на ключ
+    split_task.
+    """
+
+    rowcount = 1
+
+    _ids = iter(range(100, 10 ** 9))
+    _lock = threading.Lock()
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.statements: list[str] = []
+        self._params = None
+
+    def execute(self, sql: str, params=None) -> None:
+        time.sleep(self.latency)
+        match = _STATEMENT.search(sql)
+        self.statements.append(match.group(0) if match else sql.split()[0])
+        self._params = params
+
+    def _next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def fetchone(self):
+        new_id = self._next_id()
+        return new_id, new_id
+
+    def fetchall(self):
+        keys = self._params.get("keys", ()) if isinstance(self._params, dict) else ()
+        return [(self._next_id(),) for _ in keys]
+
+
+# =========================================================
+# ПРОГОН
+# =========================================================
+class Pipeline:
+    """
+    Путь задачи воркера (main._run_qr_stage / _run_ocr_stage) без аренды, повторов
+    и предохранителей: полоса qr — скачивание, QR, проверка бланка, деление пачки;
+    полоса ocr — распознавание телефона; затем запись итога.
+    """
+
+    def __init__(self, args, engine, s3: MemoryS3):
+        self.engine = engine
+        self.storage = StorageService(s3)
+        self.db_latency = args.db_latency
+        self.qr_lane = ThreadPoolExecutor(args.qr_workers, thread_name_prefix="bench-qr")
+        self.ocr_lane = ThreadPoolExecutor(args.ocr_workers, thread_name_prefix="bench-ocr")
+        self.queries = Counter()
+        self._lock = threading.Lock()
+
+    def submit(self, record_id: int, key: str) -> Future:
+        done = Future()
+        run = {"id": record_id, "key": key, "stages": {}, "queued": time.perf_counter()}
+        self.qr_lane.submit(self._stage, "qr", done, run, self._qr_stage, run)
+        return done
+
+    def _stage(self, name: str, done: Future, run: dict, fn, *args) -> None:
+        """
+        Этап в своей полосе. fn возвращает итог (dict — он сразу пишется в БД)
+        или Analysis для полосы ocr. Замеры этапа ложатся в run["stages"][name]
+        до передачи задачи дальше — этапы не пишут в общие поля одновременно.
+        """
+        start = time.perf_counter()
+        samples = []
+        try:
+            with metrics.collect() as samples:
+                result = fn(*args)
+                outcome = self._write(run, result) if isinstance(result, dict) else None
+        except Exception as e:
+            done.set_exception(e)
+            return
+        finally:
+            run["stages"][name] = (samples, time.perf_counter() - start)
+
+        if isinstance(result, dict):
+            self._save(run, result, outcome, done)
+        else:
+            self.ocr_lane.submit(self._stage, "ocr", done, run, self._ocr_stage, result)
+
+    def _qr_stage(self, run: dict):
+        pdf_bytes = self.storage.download(BUCKET, run["key"])
+        analysis = self.engine.decode(pdf_bytes)
+        if not analysis.final:
+            cur = RecordingCursor(self.db_latency)
+            if queries.is_blank_available(cur, analysis.doc["id"]):
+                return analysis
+            self.engine.skip(analysis, "BLANK_ALREADY_USED")
+
+        doc = analysis.doc
+        if doc.get("type") == "batch":
+            with metrics.stage("split"):
+                parts = batch.extract_pages(pdf_bytes, doc["pages"])
+            keys = [batch.part_key(run["key"], n) for n in range(1, len(parts) + 1)]
+            for key, data in zip(keys, parts):
+                self.storage.upload(BUCKET, key, data)
+            doc = {**doc, "keys": keys}
+        return doc
+
+    def _ocr_stage(self, analysis) -> dict:
+        return self.engine.recognize(analysis)
+
+    def _write(self, run: dict, doc: dict) -> str:
+        cur = RecordingCursor(self.db_latency)
+        with metrics.stage("db_write"):
+            outcome = handlers.process_document(cur, run["id"], run["key"], doc)
+        with self._lock:
+            self.queries.update(cur.statements)
+        return outcome
+
+    def _save(self, run: dict, doc: dict, outcome: str, done: Future) -> None:
+        """Итог задачи: замеры этапов сводятся только здесь, после последнего из них."""
+        stages = run.pop("stages").values()
+        run.update(doc=doc, outcome=outcome,
+                   samples=[sample for samples, _ in stages for sample in samples],
+                   service=sum(seconds for _, seconds in stages))
+        done.set_result(run)
+
+    def shutdown(self) -> None:
+        self.qr_lane.shutdown(wait=True)
+        self.ocr_lane.shutdown(wait=True)
+
+
+def run_corpus(pipeline: Pipeline, s3: MemoryS3, corpus: str, items: list[dict]) -> tuple[list[dict], float]:
+    """Все файлы разом в очередь, как накопившиеся задачи. Возвращает прогоны и время стены."""
+    for item in items:
+        with open(os.path.join(corpus, item["file"]), "rb") as f:
+            s3.objects[(BUCKET, item["file"])] = f.read()
+
+    start = time.perf_counter()
+    futures = [pipeline.submit(i, item["file"]) for i, item in enumerate(items, 1)]
+    runs = []
+    for item, future in zip(items, futures):
+        try:
+            run = future.result()
+        except Exception as e:
+            run = {"doc": None, "outcome": f"CRASH {type(e).__name__}: {e}", "samples": [], "service": 0.0}
+        runs.append({**run, "truth": item})
+    return runs, time.perf_counter() - start
+
+
+# =========================================================
+# ОТЧЁТ
+# =========================================================
+def summary(values) -> dict:
+    if not len(values):
+        return {"count": 0}
+    arr = np.asarray(values, dtype=float)
+    stats = {"count": len(arr), "mean": float(arr.mean()), "max": float(arr.max())}
+    stats.update({f"p{p}": float(np.percentile(arr, p)) for p in PERCENTILES})
+    return stats
+
+
+def score(run: dict) -> dict:
+    """Сверка итога с истиной: верно ли определён документ, телефон и его цифры."""
+    truth, doc = run["truth"], run["doc"] or {"status": "error"}
+    if doc.get("status") != "success":
+        return {"qr": False}
+    if truth["type"] == "batch":
+        return {"qr": doc["type"] == "batch" and len(doc["pages"]) == len(truth["letters"])}
+    result = {"qr": doc["type"] == truth["type"] and doc.get("id") == truth["id"]}
+    if truth["type"] == "init" and result["qr"]:
+        phone = doc.get("phone") or ""
+        result["phone"] = phone == truth["phone"]
+        result["digits"] = sum(a == b for a, b in zip(phone, truth["phone"])) if len(phone) == 11 else 0
+        result["found"] = bool(phone)
+    return result
+
+
+def report(runs: list[dict], wall: float, args, budget: ThreadBudget, queries_run: Counter) -> dict:
+    stages: dict[str, list[float]] = {}
+    per_doc: dict[str, list[float]] = {}
+    for run in runs:
+        totals: dict[str, float] = {}
+        for name, seconds in run["samples"]:
+            stages.setdefault(name, []).append(seconds)
+            totals[name] = totals.get(name, 0.0) + seconds
+        for name, seconds in totals.items():
+            per_doc.setdefault(name, []).append(seconds)
+
+    scores = [score(run) for run in runs]
+    inits = [s for s, run in zip(scores, runs) if run["truth"]["type"] == "init"]
+    phones = [s for s in inits if "phone" in s]
+    accuracy = {
+        "documents": sum(s["qr"] for s in scores) / len(scores),
+        "by_type": {
+            t: sum(s["qr"] for s, run in zip(scores, runs) if run["truth"]["type"] == t) / n
+            for t, n in Counter(run["truth"]["type"] for run in runs).items()
+        },
+        "phone_exact": sum(s["phone"] for s in phones) / len(inits) if inits else None,
+        "phone_found": sum(s["found"] for s in phones) / len(inits) if inits else None,
+        "digits": sum(s["digits"] for s in phones) / (11 * len(inits)) if inits else None,
+    }
+    tiers = Counter(",".join(run["doc"].get("ocr_tiers") or ()) for run in runs
+                    if run["doc"] and run["doc"].get("ocr_tiers"))
+
+    return {
+        "revision": git_revision(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            "mode": args.mode, "qr_workers": args.qr_workers, "ocr_workers": args.ocr_workers,
+            "budget": budget.describe(), "qr_scan_mode": QR_SCAN_MODE, "qr_page_workers": QR_PAGE_WORKERS,
+            "ocr_backend": OCR_BACKEND, "ocr_tiers": list(OCR_TIERS), "ocr_min_prob": OCR_MIN_PROB,
+            "batch_split": BATCH_SPLIT, "s3_latency_ms": args.s3_latency * 1e3, "db_latency_ms": args.db_latency * 1e3,
+            "python": sys.version.split()[0], "cpus": os.cpu_count(),
+        },
+        "corpus": {**corpus_params(args), "path": os.path.abspath(args.corpus),
+                   "types": dict(Counter(run["truth"]["type"] for run in runs))},
+        "throughput": {"documents": len(runs), "wall_seconds": wall, "docs_per_sec": len(runs) / wall},
+        "service_seconds": summary([run["service"] for run in runs]),
+        "stages": {name: summary(values) for name, values in sorted(stages.items())},
+        "stages_per_doc": {name: summary(values) for name, values in sorted(per_doc.items())},
+        "accuracy": accuracy,
+        "outcomes": dict(Counter(run["outcome"] for run in runs).most_common()),
+        "ocr_tiers": dict(tiers.most_common()),
+        "queries": dict(queries_run.most_common()),
+        "misses": [
+            {"file": run["truth"]["file"], "truth": run["truth"], "outcome": run["outcome"],
+             "phone": (run["doc"] or {}).get("phone")}
+            for run, s in zip(runs, scores) if not s["qr"] or s.get("phone") is False
+        ][:50],
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{rev}-dirty" if dirty else rev
+
+
+def fmt_pct(value) -> str:
+    return "—" if value is None else f"{value:.1%}"
+
+
+def print_report(result: dict) -> None:
+    tp = result["throughput"]
+    print(f"Ревизия {result['revision']}, режим {result['settings']['mode']} "
+          f"(qr {result['settings']['qr_workers']}, ocr {result['settings']['ocr_workers']}), "
+          f"корпус {tp['documents']} файлов {result['corpus']['types']}")
+    print(f"Пропускная способность: {tp['docs_per_sec']:.2f} док/с ({tp['wall_seconds']:.1f} с)")
+    svc = result["service_seconds"]
+    print(f"Обработка документа, мс: p50 {svc['p50'] * 1e3:.0f}  p90 {svc['p90'] * 1e3:.0f}  "
+          f"p99 {svc['p99'] * 1e3:.0f}")
+    print(f"\n{'этап':<18} {'вызовов':>8} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9} {'всего, с':>9}")
+    for name, s in sorted(result["stages"].items(), key=lambda kv: -kv[1]["mean"] * kv[1]["count"]):
+        print(f"{name:<18} {s['count']:>8} {s['p50'] * 1e3:>9.1f} {s['p90'] * 1e3:>9.1f} "
+              f"{s['p99'] * 1e3:>9.1f} {s['mean'] * s['count']:>9.2f}")
+
+    acc = result["accuracy"]
+    print(f"\nТочность: документ {fmt_pct(acc['documents'])} "
+          f"({', '.join(f'{t} {fmt_pct(v)}' for t, v in acc['by_type'].items())}), "
+          f"телефон целиком {fmt_pct(acc['phone_exact'])}, цифры {fmt_pct(acc['digits'])}, "
+          f"телефон найден {fmt_pct(acc['phone_found'])}")
+    print("Итоги: " + ", ".join(f"{k} {v}" for k, v in result["outcomes"].items()))
+    if result["ocr_tiers"]:
+        print("Каскад OCR: " + ", ".join(f"{k} {v}" for k, v in result["ocr_tiers"].items()))
+
+
+def compare(result: dict, old: dict) -> None:
+    """Разница с прошлым результатом по главным числам."""
+    rows = [("док/с", old["throughput"]["docs_per_sec"], result["throughput"]["docs_per_sec"], "", 1)]
+    for p in PERCENTILES:
+        rows.append((f"обработка p{p}", old["service_seconds"][f"p{p}"], result["service_seconds"][f"p{p}"], " мс", 1e3))
+    for name in sorted(set(old["stages"]) & set(result["stages"])):
+        rows.append((f"{name} p50", old["stages"][name]["p50"], result["stages"][name]["p50"], " мс", 1e3))
+    for key, label in (("documents", "документ"), ("phone_exact", "телефон"), ("digits", "цифры")):
+        if old["accuracy"][key] is not None and result["accuracy"][key] is not None:
+            rows.append((f"точность: {label}", old["accuracy"][key], result["accuracy"][key], " %", 100))
+
+    if old["corpus"] != result["corpus"]:
+        print("\nВнимание: корпуса различаются — сравнение приблизительное")
+    print(f"\nСравнение с {old['revision']} ({old['created']}):")
+    for name, a, b, unit, k in rows:
+        if unit == " %":  # для долей — разница в процентных пунктах
+            change = f"{(b - a) * 100:+.1f} п.п."
+        else:
+            change = f"{(b - a) / a:+.1%}" if a else ""
+        print(f"  {name:<24} {a * k:>9.2f} → {b * k:>9.2f}{unit:<3} {change}")
+
+
+# =========================================================
+# ТОЧКА ВХОДА
+# =========================================================
+def jpeg_range(value: str) -> tuple[int, int]:
+    low, _, high = value.partition(":")
+    return int(low), int(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus = parser.add_argument_group("корпус")
+    corpus.add_argument("--corpus", default="bench_corpus", help="папка корпуса")
+    corpus.add_argument("--regen", action="store_true", help="пересоздать корпус")
+    corpus.add_argument("--docs", type=int, default=200, help="число файлов")
+    corpus.add_argument("--answers", type=float, default=0.3, help="доля бланков ответа")
+    corpus.add_argument("--batches", type=float, default=0.05, help="доля пачек из нескольких писем")
+    corpus.add_argument("--dpi", type=int, default=200, help="разрешение скана")
+    corpus.add_argument("--rotate", type=float, default=1.5, help="наибольший поворот листа, градусы")
+    corpus.add_argument("--noise", type=float, default=6.0, help="СКО шума сканера")
+    corpus.add_argument("--jpeg", type=jpeg_range, default=(40, 90), help="качество JPEG, от:до")
+    corpus.add_argument("--font", default=next((f for f in FONTS if os.path.exists(f)), FONTS[-1]),
+                        help="TTF вместо Arial из Windows")
+    corpus.add_argument("--seed", type=int, default=0)
+
+    run = parser.add_argument_group("прогон")
+    run.add_argument("--mode", choices=("thread", "process"), default=WORKER_MODE, help="режим движка")
+    run.add_argument("--qr-workers", type=int, default=WORKER_QR_WORKERS, help="ширина полосы qr")
+    run.add_argument("--ocr-workers", type=int, default=WORKER_OCR_WORKERS, help="ширина полосы ocr")
+    run.add_argument("--warmup", type=int, default=3, help="файлов на прогрев (в замер не входят)")
+    run.add_argument("--s3-latency", type=float, default=0.0, help="задержка вызова S3, мс")
+    run.add_argument("--db-latency", type=float, default=0.0, help="задержка запроса БД, мс")
+    run.add_argument("--out", metavar="RESULT.json", help="записать результат")
+    run.add_argument("--compare", metavar="OLD.json", help="сравнить с прошлым результатом")
+    run.add_argument("-v", "--verbose", action="store_true", help="лог воркера уровня INFO")
+    args = parser.parse_args()
+    args.s3_latency /= 1000
+    args.db_latency /= 1000
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    items = load_corpus(args)
+
+    budget = ThreadBudget.plan(args.mode, THREADS_CORES, args.qr_workers, args.ocr_workers, THREADS_PIN)
+    engine = create_engine(args.mode, args.qr_workers, args.ocr_workers, budget=budget)
+    s3 = MemoryS3(args.s3_latency)
+    pipeline = Pipeline(args, engine, s3)
+    try:
+        if args.warmup:
+            run_corpus(pipeline, s3, args.corpus, items[:args.warmup])
+        pipeline.queries.clear()
+        runs, wall = run_corpus(pipeline, s3, args.corpus, items)
+    finally:
+        pipeline.shutdown()
+        engine.shutdown()
+
+    result = report(runs, wall, args, budget, pipeline.queries)
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+        print(f"\nРезультат: {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Микробенчмарк сегментации цифр и поиска наклона на зашумлённых страницах:
+прежний Python-цикл по контурам против компонент связности и масок NumPy.
+
+    python bench_segmentation.py [--pages 10] [--noise 0.03] [--repeat 5] [scan.pdf ...]
+
+Без PDF страницы синтезируются: цифры на трафарете + шум «соль/перец»
+и мелкие пятна (тысячи контуров). С PDF берётся первая страница каждого
+файла в масштабе PhoneOCR.ZOOM, поле телефона — по QR, как в воркере.
+Нужен settings.ini (как у воркера).
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from src.phone_ocr import PhoneOCR
+from src.qr_service import scan_pdf_qr
+from src.render import PageRenderCache
+
+
+# =========================================================
+# ПРЕЖНЯЯ РЕАЛИЗАЦИЯ (для сравнения)
+# =========================================================
+def legacy_skew_angle(gray):
+    edges = cv2.Canny(gray, 50, 150)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=150, minLineLength=100, maxLineGap=20)
+    if lines is None:
+        return 0
+
+    angles = []
+    for line in lines:
+        x1, y1, x2, y2 = line[0]
+        angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+        if -15 < angle < 15:
+            angles.append(angle)
+
+    return np.median(angles) if angles else 0
+
+
+def legacy_segment(ocr, roi, y_range=(0.0, 1.0)):
+    roi_h, roi_w = roi.shape
+
+    enhanced = cv2.createCLAHE(clipLimit=3.0).apply(roi)
+    thresh = cv2.adaptiveThreshold(enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, 21, 10)
+
+    contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        if w > 150 or cv2.contourArea(cnt) < 30 or h < 20:
+            cv2.drawContours(thresh, [cnt], -1, 0, -1)
+
+    proc = cv2.dilate(thresh, np.ones((2, 2), np.uint8), 1)
+
+    contours, _ = cv2.findContours(proc, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rects = []
+    for c in contours:
+        x, y, w, h = cv2.boundingRect(c)
+        if 40 < h < 180 and (roi_h * y_range[0] <= y < roi_h * y_range[1]):
+            rects.append((x, y, w, h))
+    rects = sorted(rects, key=lambda r: r[0])
+
+    batch = []
+    for (x, y, w, h) in rects:
+        pad = 8
+        digit = proc[max(0, y - pad):min(roi_h, y + h + pad), max(0, x - pad):min(roi_w, x + w + pad)]
+        inp = ocr._prepare_digit(digit)
+        if inp is not None:
+            batch.append(inp)
+    return batch
+
+
+# =========================================================
+# ДАННЫЕ
+# =========================================================
+def synthetic_page(rng, noise: float) -> tuple[np.ndarray, np.ndarray]:
+    """Страница в масштабе ZOOM (линовка, трафарет с цифрами, шум) и поле телефона на ней."""
+    h, w = 3368, 2381  # A4 при 4x
+    page = np.full((h, w), 255, np.uint8)
+
+    for y in range(900, h - 100, 68):  # линовка для письма
+        cv2.line(page, (100, y), (w - 100, y), 170, 2)
+
+    x0, y0 = 420, 500  # трафарет телефона
+    for i in range(11):
+        cv2.rectangle(page, (x0 + i * 92, y0), (x0 + i * 92 + 80, y0 + 150), 200, 2)
+        cv2.putText(page, str(rng.integers(10)), (x0 + i * 92 + 10, y0 + 125),
+                    cv2.FONT_HERSHEY_SIMPLEX, 3.6, 0, int(rng.integers(6, 10)))
+
+    # соль/перец + мелкие пятна
+    mask = rng.random((h, w)) < noise
+    page[mask] = rng.integers(0, 256, mask.sum(), dtype=np.uint8)
+    for _ in range(int(4000 * noise / 0.03)):
+        cx, cy = int(rng.integers(w)), int(rng.integers(h))
+        cv2.circle(page, (cx, cy), int(rng.integers(1, 5)), int(rng.integers(0, 120)), -1)
+
+    # лёгкий наклон, как у скана
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), float(rng.uniform(-2, 2)), 1.0)
+    page = cv2.warpAffine(page, M, (w, h), borderValue=255)
+    return page, page[y0 - 120:y0 + 280, x0 - 60:x0 + 1100].copy()
+
+
+def pdf_page(ocr: PhoneOCR, path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Первая страница PDF и поле телефона — по геометрии QR, как в воркере, или без неё."""
+    with open(path, "rb") as f, PageRenderCache(f.read(), zoom=PhoneOCR.ZOOM) as pages:
+        qr = next((r for r in scan_pdf_qr(pages) if r.page == 1 and r.polygon), None)
+        gray = pages.view(0, PhoneOCR.ZOOM).copy()
+        zoom = pages.page_zoom(0, PhoneOCR.ZOOM)
+    if qr:
+        return gray, ocr._anchored_roi(gray, qr.polygon, PhoneOCR.ZOOM / zoom)
+    return gray, ocr._legacy_roi(gray)
+
+
+# =========================================================
+# ЗАМЕР
+# =========================================================
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="*", help="сканы; без них — синтетические страницы")
+    parser.add_argument("--pages", type=int, default=10, help="число синтетических страниц")
+    parser.add_argument("--noise", type=float, default=0.03, help="доля зашумлённых пикселей")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ocr = PhoneOCR()
+    rng = np.random.default_rng(0)
+    pages = [pdf_page(ocr, p) for p in args.pdf] or [synthetic_page(rng, args.noise) for _ in range(args.pages)]
+
+    totals = {"skew": [0.0, 0.0], "segment": [0.0, 0.0]}
+    mismatches = 0
+    print(f"{'стр':>3} {'контуров':>9} {'наклон, мс':>17} {'сегментация, мс':>19} {'цифр':>7}")
+
+    for i, (gray, roi) in enumerate(pages):
+        y_range = (0.0, 1.0)
+
+        t_skew = (best_of(lambda: legacy_skew_angle(gray), args.repeat),
+                  best_of(lambda: ocr._get_skew_angle(gray), args.repeat))
+        t_seg = (best_of(lambda: legacy_segment(ocr, roi.copy(), y_range), args.repeat),
+                 best_of(lambda: ocr._segment_digits(roi.copy(), y_range), args.repeat))
+
+        old, new = legacy_segment(ocr, roi.copy(), y_range), ocr._segment_digits(roi.copy(), y_range)
+        if len(old) != len(new) or abs(legacy_skew_angle(gray) - ocr._get_skew_angle(gray)) > 1e-6:
+            mismatches += 1
+
+        thresh = cv2.adaptiveThreshold(cv2.createCLAHE(clipLimit=3.0).apply(roi), 255,
+                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 10)
+        n_contours = len(cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[0])
+
+        for key, (a, b) in (("skew", t_skew), ("segment", t_seg)):
+            totals[key][0] += a
+            totals[key][1] += b
+        print(f"{i + 1:>3} {n_contours:>9} {t_skew[0] * 1e3:>8.1f} → {t_skew[1] * 1e3:>6.1f} "
+              f"{t_seg[0] * 1e3:>9.1f} → {t_seg[1] * 1e3:>6.1f} {len(old):>3}/{len(new):<3}")
+
+    for key, (a, b) in totals.items():
+        print(f"{key:>8}: {a * 1e3:.1f} мс → {b * 1e3:.1f} мс (x{a / b:.1f})")
+    print(f"страниц с расхождением числа цифр или угла: {mismatches} из {len(pages)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Проверка совпадения бэкендов инференса с исходной Keras-моделью.
+
+    python check_backends.py [postal_model.h5] [--atol 1e-4]
+
+Прогоняет через keras, tflite и numpy один и тот же набор входов
+(нарисованные цифры и шум) и сравнивает вероятности и классы.
+Код возврата 1, если хоть один бэкенд расходится.
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from src.inference import create_backend
+
+
+def make_inputs(seed: int = 0) -> np.ndarray:
+    """Цифры 0–9 разными шрифтами/толщиной + случайный шум, (N, 32, 32, 1)."""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for digit in range(10):
+        for font in (cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX):
+            for thickness in (2, 3):
+                img = np.zeros((32, 32), np.uint8)
+                cv2.putText(img, str(digit), (6, 27), font, 1.0, 255, thickness)
+                samples.append(img.astype(np.float32) / 255.0)
+    samples.extend(rng.random((16, 32, 32), dtype=np.float32))
+    return np.stack(samples)[..., None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", nargs="?", default="postal_model.h5")
+    parser.add_argument("--atol", type=float, default=1e-4, help="допуск по вероятностям")
+    args = parser.parse_args()
+
+    batch = make_inputs()
+    reference = create_backend("keras", args.model).predict(batch)
+
+    failed = False
+    for name in ("tflite", "numpy"):
+        try:
+            preds = create_backend(name, args.model).predict(batch)
+        except Exception as e:
+            print(f"[SKIP] {name}: {e}")
+            continue
+        diff = float(np.abs(preds - reference).max())
+        same = float((preds.argmax(1) == reference.argmax(1)).mean())
+        ok = diff <= args.atol and same == 1.0
+        failed |= not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {name}: max |Δp| = {diff:.2e}, совпадение классов {same:.0%}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
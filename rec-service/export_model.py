@@ -0,0 +1,53 @@
+"""
+Экспорт модели цифр для бэкендов без TensorFlow.
+
+    python export_model.py [postal_model.h5]
+
+Рядом с .h5 создаются:
+  postal_model.npz    — веса для бэкенда numpy
+  postal_model.tflite — модель для бэкенда tflite
+
+Нужен TensorFlow — только здесь, не на воркерах.
+"""
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from src.inference import NumpyBackend, model_file
+
+
+def export_npz(model, path: str) -> None:
+    convs  = [l for l in model.layers if isinstance(l, tf.keras.layers.Conv2D)]
+    denses = [l for l in model.layers if isinstance(l, tf.keras.layers.Dense)]
+    layers = dict(zip(NumpyBackend.LAYERS, convs + denses))
+    if len(layers) != len(NumpyBackend.LAYERS) or len(convs) != 2:
+        raise SystemExit(f"Архитектура не совпадает с NumpyBackend: {[l.name for l in model.layers]}")
+
+    weights = {}
+    for name, layer in layers.items():
+        kernel, bias = layer.get_weights()
+        weights[f"{name}_w"], weights[f"{name}_b"] = kernel, bias
+    np.savez(path, **weights)
+    print(f"[OK] Веса сохранены: {path}")
+
+
+def export_tflite(model, path: str) -> None:
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    print(f"[OK] TFLite-модель сохранена: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", nargs="?", default="postal_model.h5")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    export_npz(model, model_file("numpy", args.model))
+    export_tflite(model, model_file("tflite", args.model))
+
+
+if __name__ == "__main__":
+    main()
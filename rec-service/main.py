@@ -1,40 +1,177 @@
-import logging.config
+import logging
 import select
 import time
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 import boto3
+from botocore.config import Config as BotoConfig
 import psycopg2
 import psycopg2.pool
 from psycopg2 import DatabaseError
 
-from src.config import DB_CONFIG, LOG_CONFIG, S3_CONFIG
+from src.config import (
+    DB_CONFIG, LOG_CONFIG, S3_CONFIG, MODEL_PATH,
+    WORKER_MODE, WORKER_ID, WORKER_LEASE_SEC, WORKER_MAX_PENDING, WORKER_RESERVED_SLOTS,
+    WORKER_QR_WORKERS, WORKER_OCR_WORKERS, WORKER_OCR_MAX_PENDING, WORKER_DEFER_SEC,
+    WORKER_RECOVERY_BATCH, THREADS_CORES, THREADS_PIN,
+    METRICS_PORT, METRICS_HOST,
+    CACHE_ENABLED, CACHE_MEMORY_ITEMS, CACHE_DB,
+    SCHED_MODE, SCHED_WEIGHTS, SCHED_DEFAULT_WEIGHT, SCHED_REFRESH_SEC,
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_SEC, RETRY_MAX_DELAY_SEC, RETRY_POLL_SEC,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SEC,
+    SWEEP_INTERVAL_SEC, SWEEP_MIN_AGE_SEC, SWEEP_MAX_ROWS,
+    BATCH_SPLIT, QR_SCAN_MODE,
+)
 import src.queries as queries
 import src.handlers as handlers
-from src.services import DocumentProcessor, StorageService
-from src.qr_service import scan_pdf_qr
-from src.phone_ocr import PhoneOCR
+from src import batch, metrics, retry
+from src.admission import AdmissionController, Lane
+from src.background import Periodic
+from src.circuit import CircuitBreaker
+from src.log_config import job_context, start_logging
+from src.recovery import LeaseKeeper, Recovery, Sweeper
+from src.engine import create_engine
+from src.result_cache import PgResultStore, ResultCache, model_version
+from src.scheduler import FairScheduler
+from src.services import StorageService
+from src.threads import ThreadBudget
 
 # =========================================================
 # 1. ЛОГИРОВАНИЕ
 # =========================================================
-logging.config.dictConfig(LOG_CONFIG)
 logger = logging.getLogger("worker")
 
 # =========================================================
 # 2. ИНИЦИАЛИЗАЦИЯ СЕРВИСОВ
 # =========================================================
-try:
-    db_pool = psycopg2.pool.ThreadedConnectionPool(1, 20, **DB_CONFIG)
-    logger.info("ThreadedConnectionPool успешно инициализирован.")
-except Exception as e:
-    logger.critical(f"Не удалось запустить пул соединений: {e}")
-    raise SystemExit(1) from e
+# Заполняются в init_services(): в режиме process модуль импортируется
+# заново в каждом дочернем процессе, и там эти объекты не нужны.
+db_pool   = None
+storage   = None
+engine    = None
+executor  = None
+admission = None
+ocr_lane  = None
+cache     = None
+scheduler = None  # только в режиме fair
+sweeper   = None
+leases    = None
+recovery  = None
+background: list[Periodic] = []
 
-storage   = StorageService(boto3.client("s3", **S3_CONFIG))
-processor = DocumentProcessor(ocr_engine=PhoneOCR(), qr_scanner=scan_pdf_qr)
-executor  = ThreadPoolExecutor(max_workers=4, thread_name_prefix="WorkerThread")
+# Предохранители: пока S3 или БД недоступны, новые задачи не захватываются
+s3_breaker = CircuitBreaker("S3", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SEC)
+db_breaker = CircuitBreaker("PostgreSQL", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SEC)
+
+STATS_INTERVAL = 60  # сек между записями статистики очереди в лог
+RECOVERY_POLL  = 0.05  # сек ожидания NOTIFY между шагами дообработки
+
+
+def init_services() -> None:
+    global db_pool, storage, engine, executor, admission, ocr_lane, cache, scheduler, sweeper, leases, recovery
+
+    start_logging(LOG_CONFIG)
+
+    try:
+        db_pool = psycopg2.pool.ThreadedConnectionPool(
+            1, max(20, WORKER_QR_WORKERS + WORKER_OCR_WORKERS + 2), **DB_CONFIG
+        )
+        logger.info("ThreadedConnectionPool успешно инициализирован.")
+    except Exception as e:
+        logger.critical(f"Не удалось запустить пул соединений: {e}")
+        raise SystemExit(1) from e
+
+    # Одна попытка на запрос: повторы — через отложенный ретрай, не в потоке воркера
+    storage  = StorageService(boto3.client("s3", config=BotoConfig(retries={"total_max_attempts": 1}),
+                                           **S3_CONFIG))
+    if CACHE_ENABLED:
+        cache = ResultCache(model_version(MODEL_PATH), CACHE_MEMORY_ITEMS,
+                            PgResultStore(get_db_session) if CACHE_DB else None)
+        logger.info(f"Кэш результатов включён, версия модели {cache.version}")
+    budget   = ThreadBudget.plan(WORKER_MODE, THREADS_CORES, WORKER_QR_WORKERS, WORKER_OCR_WORKERS, THREADS_PIN)
+    logger.info(budget.describe())
+    engine   = create_engine(WORKER_MODE, WORKER_QR_WORKERS, WORKER_OCR_WORKERS, cache, budget)
+    # Полоса qr: захват, S3, QR, ответы. Init-письма после QR уходят в полосу ocr.
+    executor = ThreadPoolExecutor(max_workers=WORKER_QR_WORKERS,
+                                  thread_name_prefix="WorkerThread")
+    admission = AdmissionController(executor, handle_task, WORKER_MAX_PENDING,
+                                    on_done=_on_future_done, gate=_intake_open,
+                                    reserved=WORKER_RESERVED_SLOTS)
+    ocr_lane = Lane("ocr", WORKER_OCR_WORKERS, WORKER_OCR_MAX_PENDING)
+    if SCHED_MODE == "fair":
+        scheduler = FairScheduler(SCHED_WEIGHTS, SCHED_DEFAULT_WEIGHT, SCHED_REFRESH_SEC)
+        logger.info(f"Справедливая очерёдность по бакетам, веса: {SCHED_WEIGHTS or 'равные'}")
+    logger.info(f"Режим распознавания: {WORKER_MODE}, полосы: qr {WORKER_QR_WORKERS}, "
+                f"ocr {WORKER_OCR_WORKERS} (очередь до {WORKER_OCR_MAX_PENDING}), "
+                f"ID воркера: {WORKER_ID}")
+    if BATCH_SPLIT and QR_SCAN_MODE == "first":
+        logger.warning("[batch] split включён, но [qr] mode = first: поиск QR останавливается "
+                       "на первом верном коде, пачки делиться не будут (нужен auto, all или parallel).")
+
+    background.append(Periodic("RetryPoller", RETRY_POLL_SEC, _poll_retries).start())
+    leases = LeaseKeeper(get_db_session, WORKER_ID, WORKER_LEASE_SEC)
+    background.append(Periodic("LeaseKeeper", leases.interval, leases.renew).start())
+    recovery = Recovery(get_db_session, admission, WORKER_RECOVERY_BATCH)
+    if SWEEP_INTERVAL_SEC > 0:
+        sweeper = Sweeper(get_db_session, admission, recovery, SWEEP_MIN_AGE_SEC, SWEEP_MAX_ROWS)
+        background.append(Periodic("Sweeper", SWEEP_INTERVAL_SEC, sweeper.sweep).start())
+
+    if METRICS_PORT:
+        _register_queue_metrics()
+        try:
+            metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+        except OSError as e:
+            # Порт занят (например, вторым воркером на хосте) — работаем без /metrics
+            logger.error(f"Метрики Prometheus не запущены на {METRICS_HOST}:{METRICS_PORT}: {e}")
+
+
+def _register_queue_metrics() -> None:
+    metrics.register_callback("rec_queue_depth", "Задачи, ожидающие свободного потока",
+                              lambda: admission.stats()["queued"])
+    metrics.register_callback("rec_jobs_running", "Задачи в работе",
+                              lambda: admission.stats()["running"])
+    metrics.register_callback("rec_queue_capacity", "Предел задач в работе и в очереди",
+                              lambda: admission.max_pending)
+    metrics.register_callback("rec_admission_rejected_total",
+                              "Задачи, отложенные в БД из-за заполненной очереди",
+                              lambda: admission.rejected, kind="counter")
+    metrics.register_callback("rec_admission_coalesced_total",
+                              "Повторные NOTIFY, схлопнутые с задачей в очереди",
+                              lambda: admission.coalesced, kind="counter")
+    metrics.register_callback("rec_ocr_queue_depth", "Init-письма, ожидающие OCR",
+                              lambda: ocr_lane.stats()["queued"])
+    metrics.register_callback("rec_ocr_jobs_running", "Init-письма в OCR",
+                              lambda: ocr_lane.stats()["running"])
+    metrics.register_callback("rec_ocr_deferred_total",
+                              "Init-письма, возвращённые в БД из-за заполненной очереди OCR",
+                              lambda: ocr_lane.rejected, kind="counter")
+    metrics.register_callback("rec_ocr_escalation_ratio",
+                              "Доля прогонов уровня OCR, ушедших на следующий уровень",
+                              metrics.escalation_ratio, label="tier")
+    metrics.register_callback("rec_circuit_open", "Предохранитель разомкнут: приём задач на паузе",
+                              lambda: {b.name: b.state == b.OPEN for b in (s3_breaker, db_breaker)},
+                              label="service")
+    metrics.register_callback("rec_lease_lost_total",
+                              "Задачи, аренду которых забрал другой узел (итог отброшен)",
+                              lambda: leases.lost, kind="counter")
+    if sweeper is not None:
+        metrics.register_callback("rec_sweeper_found_total",
+                                  "Задачи без обработки, найденные подметанием (потерянные NOTIFY)",
+                                  lambda: sweeper.found, kind="counter")
+    if scheduler is not None:
+        metrics.register_callback("rec_bucket_queue_depth", "Свободные задачи по бакетам (принтерам)",
+                                  scheduler.depths, label="bucket")
+        metrics.register_callback("rec_bucket_served_total", "Захваченные задачи по бакетам",
+                                  lambda: {b: s["served"] for b, s in scheduler.stats().items()},
+                                  kind="counter", label="bucket")
+    if cache is not None:
+        metrics.register_callback("rec_result_cache_hits_total",
+                                  "Документы, отданные из кэша результатов",
+                                  lambda: cache.hits, kind="counter")
+        metrics.register_callback("rec_result_cache_misses_total",
+                                  "Документы, распознанные заново",
+                                  lambda: cache.misses, kind="counter")
 
 
 # =========================================================
@@ -43,7 +180,11 @@ executor  = ThreadPoolExecutor(max_workers=4, thread_name_prefix="WorkerThread")
 @contextmanager
 def get_db_session():
     """Выдаёт курсор в рамках транзакции. Откатывает при любой ошибке."""
-    conn = db_pool.getconn()
+    try:
+        conn = db_pool.getconn()
+    except DatabaseError as e:
+        _record_db_failure(e)
+        raise
     try:
         if conn.closed != 0:
             db_pool.putconn(conn, close=True)
@@ -52,8 +193,14 @@ def get_db_session():
         cur = conn.cursor()
         yield cur
         conn.commit()
+        db_breaker.record_success()
+    except queries.LeaseLost:
+        conn.rollback()  # запись дописывает новый владелец аренды
+        raise
     except DatabaseError as e:
-        conn.rollback()
+        _record_db_failure(e)
+        if not conn.closed:
+            conn.rollback()
         logger.error(f"Ошибка БД: {e.pgcode} — {e.pgerror}")
         raise
     except Exception:
@@ -64,48 +211,281 @@ def get_db_session():
         db_pool.putconn(conn)
 
 
+def _record_db_failure(e: Exception) -> None:
+    if retry.db_unavailable(e):
+        db_breaker.record_failure()
+
+
+def _intake_open(start: bool = False) -> bool:
+    """
+    Приём задач открыт. start — задача начинает выполняться: после паузы
+    предохранителя она становится единственной пробной (CircuitBreaker.acquire).
+    """
+    breakers = (s3_breaker, db_breaker)
+    if not all(b.allow() for b in breakers):
+        return False
+    return not start or all(b.acquire() for b in breakers)
+
+
 # =========================================================
 # 4. ОБРАБОТКА ОДНОЙ ЗАДАЧИ
 # =========================================================
-def handle_notification(payload: str) -> None:
+def handle_task(record_id: int | None) -> bool:
+    """
+    NOTIFY — лишь подсказка, что в очереди есть работа. Задача захватывается
+    арендой (SKIP LOCKED): указанная запись, а если её уже забрал другой
+    воркер — любая свободная. Повторный NOTIFY не приводит к двойной обработке.
+    record_id = None — добор любой свободной записи.
+
+    Полоса qr: скачивание, QR и запись результата для ответов и ошибок.
+    Init-письма после QR переклассифицируются в полосу ocr.
+    Пока задача в работе (в т.ч. в полосе ocr), её аренду продлевает leases.
+    Возвращает True, если задача была захвачена.
+    """
+    task = _claim(record_id)
+    if task is None:
+        logger.debug(f"Подсказка {record_id}: свободных задач нет.")
+        return False
+
+    record_id, stor_url, bucket_name, waited = task
+    leases.hold(record_id)
+    handed_off = False
     try:
-        record_id = int(payload)
-    except ValueError:
-        logger.error(f"Некорректный payload в NOTIFY: {payload!r} — ожидается число.")
+        with job_context(record_id=record_id, bucket=bucket_name):
+            handed_off = _handle_claimed(record_id, stor_url, bucket_name, waited)
+    finally:
+        if not handed_off:  # иначе аренду отпустит полоса ocr
+            leases.release(record_id)
+    return True
+
+
+def _handle_claimed(record_id: int, stor_url: str, bucket_name: str, waited: float) -> bool | None:
+    start = time.perf_counter()
+
+    metrics.BUCKET_WAIT.observe(bucket_name or "unknown", waited)
+    logger.debug(f"Получена задача ID {record_id}, ждала {waited:.1f}с")
+
+    if not stor_url:
+        logger.warning(f"ID {record_id}: в записи нет s3_key.")
+        _try_save_error(record_id, "Unknown", "S3 key not found in DB")
+        metrics.OUTCOMES.inc("S3_KEY_NOT_FOUND")
         return
 
-    stor_url  = "Unknown"
-    start     = time.perf_counter()
+    if not bucket_name:
+        logger.error(f"ID {record_id}: не удалось определить бакет S3.")
+        _try_save_error(record_id, stor_url, "S3 Bucket not found in DB")
+        metrics.OUTCOMES.inc("S3_BUCKET_NOT_FOUND")
+        return
+
+    logger.info(f"==> Старт ID {record_id} (Bucket: {bucket_name}, Path: {stor_url})")
+    return _guarded(record_id, stor_url, _run_qr_stage, record_id, stor_url, bucket_name, start)
+
 
-    logger.debug(f"Получена задача ID {record_id}")
+def _run_qr_stage(record_id: int, stor_url: str, bucket_name: str, start: float) -> bool:
+    """Возвращает True, если задача передана в полосу ocr."""
+    # Скачивание и распознавание — вне транзакции: соединение не простаивает
+    pdf_bytes = _download(bucket_name, stor_url)
+    analysis  = engine.decode(pdf_bytes)
 
+    if not analysis.final:
+        # Страницы analysis закрываются на любом пути, кроме передачи в полосу ocr
+        # (там их закрывает engine.recognize) — в том числе при исключении
+        handed_off = False
+        try:
+            reason = _check_blank(analysis.doc)
+            if reason:
+                engine.skip(analysis, reason)
+            elif ocr_lane.try_submit(_guarded, record_id, stor_url, _run_ocr_stage,
+                                     record_id, stor_url, analysis, start):
+                handed_off = True
+                return True
+            else:
+                _defer(record_id)
+                return False
+        finally:
+            if not handed_off:
+                analysis.close()
+
+    doc = analysis.doc
+    if doc.get("type") == "batch":
+        doc = _upload_letters(bucket_name, stor_url, pdf_bytes, doc)
+    _save(record_id, stor_url, doc, start)
+    return False
+
+
+def _download(bucket_name: str, stor_url: str) -> bytes:
+    return _s3(storage.download, bucket_name, stor_url)
+
+
+def _s3(fn, *args):
+    """Вызов S3 с учётом в предохранителе."""
+    try:
+        result = fn(*args)
+    except Exception as e:
+        if retry.is_transient(e):
+            s3_breaker.record_failure()
+        raise
+    s3_breaker.record_success()
+    return result
+
+
+def _upload_letters(bucket_name: str, stor_url: str, pdf_bytes: bytes, doc: dict) -> dict:
+    """
+    Пачка писем: каждое письмо выгружается отдельным PDF рядом со сканом.
+    Записи proc_files создаёт _save — письма разбирают свободные потоки
+    (и другие узлы) параллельно. Ключи детерминированы: повтор перезаписывает файлы.
+    """
+    with metrics.stage("split"):
+        parts = batch.extract_pages(pdf_bytes, doc["pages"])
+    keys = [batch.part_key(stor_url, n) for n in range(1, len(parts) + 1)]
+    for key, data in zip(keys, parts):
+        _s3(storage.upload, bucket_name, key, data)
+    return {**doc, "keys": keys}
+
+
+def _run_ocr_stage(record_id: int, stor_url: str, analysis, start: float) -> None:
+    try:
+        _save(record_id, stor_url, engine.recognize(analysis), start)
+    finally:
+        leases.release(record_id)
+
+
+def _save(record_id: int, stor_url: str, doc: dict, start: float) -> None:
+    with metrics.stage("db_write"), get_db_session() as cur:
+        outcome = handlers.process_document(cur, record_id, stor_url, doc)
+
+    metrics.OUTCOMES.inc(outcome)
+    logger.info(f"<== ID {record_id} завершён за {time.perf_counter() - start:.2f}с")
+
+
+def _guarded(record_id: int, stor_url: str, fn, *args):
+    """
+    Выполняет этап задачи и возвращает его результат (None при сбое);
+    сбои учитываются и пишутся в БД, наружу не выходят.
+    """
+    try:
+        return fn(*args)
+    except Exception as e:
+        if isinstance(e, queries.LeaseLost):
+            # аренда истекла, запись обрабатывает другой узел — наш итог отброшен
+            logger.warning(f"ID {record_id}: {e}, результат отброшен.")
+            metrics.OUTCOMES.inc("LEASE_LOST")
+        elif retry.is_transient(e):
+            _schedule_retry(record_id, stor_url, e)
+        elif isinstance(e, DatabaseError):
+            # уже залогировано в get_db_session; запись вернётся в очередь по истечении аренды
+            metrics.OUTCOMES.inc("DB_ERROR")
+        else:
+            logger.error(f"Критический сбой ID {record_id}: {e}")
+            metrics.OUTCOMES.inc("CRITICAL")
+            _try_save_error(record_id, stor_url, str(e))
+
+
+def _schedule_retry(record_id: int, stor_url: str, e: Exception) -> None:
+    """
+    Временный сбой: запись откладывается до next_attempt_at, поток свободен
+    для других задач. Исчерпав попытки, запись уходит в ошибки.
+    """
+    error = f"{type(e).__name__}: {e}"[:500]
+    try:
+        with get_db_session() as cur:
+            attempt = queries.schedule_retry(cur, record_id, error, RETRY_MAX_ATTEMPTS,
+                                             RETRY_BASE_DELAY_SEC, RETRY_MAX_DELAY_SEC)
+    except queries.LeaseLost as lost:
+        logger.warning(f"ID {record_id}: повтор не отложен — {lost}.")
+        metrics.OUTCOMES.inc("LEASE_LOST")
+        return
+    except Exception:
+        # БД недоступна — запись вернётся в очередь по истечении аренды
+        logger.error(f"ID {record_id}: не удалось отложить повтор после сбоя: {error}")
+        metrics.OUTCOMES.inc("DB_ERROR")
+        return
+
+    if attempt is not None:
+        logger.warning(f"ID {record_id}: временный сбой ({error}), "
+                       f"попытка {attempt + 1} из {RETRY_MAX_ATTEMPTS} отложена.")
+        metrics.OUTCOMES.inc("RETRY_SCHEDULED")
+    else:
+        logger.error(f"ID {record_id}: попытки исчерпаны, последний сбой: {error}")
+        metrics.OUTCOMES.inc("RETRY_EXHAUSTED")
+        _try_save_error(record_id, stor_url, f"retries exhausted: {error}")
+
+
+def _poll_retries() -> None:
+    """
+    Фоновый опрос: отложенные задачи, срок которых наступил, ставятся в очередь.
+    Пока предохранитель разомкнут — ничего не делает; после паузы возобновляет
+    добор задач, не принятых за это время (в полуоткрытом состоянии — по одной).
+    """
+    if not _intake_open() or not admission.has_capacity(bulk=True):
+        return
+    probe = any(b.state == b.HALF_OPEN for b in (s3_breaker, db_breaker))
+    limit = 1 if probe else admission.free_slots(bulk=True)
     try:
         with get_db_session() as cur:
-            stor_url = queries.get_file_info(cur, record_id)
-            if not stor_url:
-                logger.warning(f"ID {record_id}: запись не найдена в БД.")
-                return
+            due = queries.get_due_retries(cur, limit)
+    except psycopg2.Error:
+        return
+    for pid in due:
+        if not admission.offer(pid, bulk=True) and not admission.has_capacity(bulk=True):
+            break
+    admission.resume(limit)
 
-            bucket_name = queries.get_bucket_name(cur, record_id)
 
-            if not bucket_name:
-                logger.error(f"ID {record_id}: не удалось определить бакет S3.")
-                _try_save_error(record_id, stor_url, "S3 Bucket not found in DB")
-                return
+def _defer(record_id: int) -> None:
+    """Очередь OCR полна: запись возвращается в proc_files и будет захвачена позже."""
+    logger.warning(f"ID {record_id}: очередь OCR заполнена, откладываем на {WORKER_DEFER_SEC}с.")
+    with get_db_session() as cur:
+        queries.defer_task(cur, record_id, WORKER_DEFER_SEC)
+    metrics.OUTCOMES.inc("DEFERRED_OCR")
 
-            logger.info(f"==> Старт ID {record_id} (Bucket: {bucket_name}, Path: {stor_url})")
 
-            pdf_bytes = storage.download(bucket_name, stor_url)
-            doc       = processor.get_document_info(pdf_bytes)
-            handlers.process_document(cur, record_id, stor_url, doc)
+def _check_blank(doc: dict) -> str | None:
+    """
+    Проверка между QR и OCR: если бланк уже использован (повторный скан,
+    дубль загрузки), OCR не запускается. Окончательно бланк резервируется
+    в create_init_letter под FOR UPDATE.
+    """
+    with get_db_session() as cur:
+        if not queries.is_blank_available(cur, doc["id"]):
+            return "BLANK_ALREADY_USED"
+    return None
 
-        logger.info(f"<== ID {record_id} завершён за {time.perf_counter() - start:.2f}с")
 
+def _claim(record_id: int | None) -> tuple[int, str, str, float] | None:
+    """Захватывает задачу в отдельной короткой транзакции."""
+    try:
+        with get_db_session() as cur:
+            if scheduler is not None:
+                return _claim_fair(cur)
+            task = queries.claim_task(cur, WORKER_ID, WORKER_LEASE_SEC, record_id)
+            if task is None and record_id is not None:
+                task = queries.claim_task(cur, WORKER_ID, WORKER_LEASE_SEC)
+            return task
     except DatabaseError:
-        pass  # уже залогировано в get_db_session
-    except Exception as e:
-        logger.error(f"Критический сбой ID {record_id}: {e}")
-        _try_save_error(record_id, stor_url, str(e))
+        return None
+
+
+def _claim_fair(cur) -> tuple[int, str, str, float] | None:
+    """
+    Режим fair: подсказка из NOTIFY игнорируется, бакет выбирает планировщик.
+    Если известные бакеты пусты (их разобрали другие узлы или снимок устарел),
+    берётся самая старая свободная задача — работа не теряется.
+    """
+    if scheduler.claim_refresh():
+        scheduler.update(queries.pending_by_bucket(cur))
+
+    while (bucket := scheduler.next()) is not None:
+        task = queries.claim_task(cur, WORKER_ID, WORKER_LEASE_SEC, bucket=bucket)
+        if task is not None:
+            scheduler.served_from(bucket)
+            return task
+        scheduler.exhausted(bucket)
+
+    task = queries.claim_task(cur, WORKER_ID, WORKER_LEASE_SEC)
+    if task is not None:
+        scheduler.served_from(task[2])
+    return task
 
 
 def _try_save_error(record_id: int, stor_url: str, reason: str) -> None:
@@ -114,6 +494,8 @@ def _try_save_error(record_id: int, stor_url: str, reason: str) -> None:
         with get_db_session() as cur:
             queries.mark_as_error(cur, record_id, stor_url,
                                   f"Critical: {reason[:50]}")
+    except queries.LeaseLost as lost:
+        logger.warning(f"ID {record_id}: ошибка не сохранена — {lost}.")
     except Exception:
         logger.critical(f"Не удалось сохранить ошибку ID {record_id} в БД!")
 
@@ -128,8 +510,45 @@ def _on_future_done(future):
         logger.error(f"Необработанное исключение в потоке: {exc}")
 
 
-def run_listen_loop() -> None:
-    """Слушает PostgreSQL NOTIFY с автоматическим переподключением."""
+def _parse_payload(payload: str) -> int | None:
+    try:
+        return int(payload)
+    except ValueError:
+        logger.error(f"Некорректный payload в NOTIFY: {payload!r} — ожидается число.")
+        return None
+
+
+_last_admitted = 0
+
+
+def _log_stats() -> None:
+    global _last_admitted
+    st = admission.stats()
+    if st["admitted"] == _last_admitted and not st["queued"]:
+        return  # простой — не засоряем лог
+    _last_admitted = st["admitted"]
+    ocr = ocr_lane.stats()
+    logger.info(
+        f"Очередь: в работе {st['running']}, ждут {st['queued']} из {st['capacity']}; "
+        f"принято {st['admitted']}, дублей {st['coalesced']}, отложено в БД {st['rejected']}; "
+        f"ожидание ср. {st['wait_avg']:.2f}с, макс. {st['wait_max']:.2f}с; "
+        f"OCR: в работе {ocr['running']}, ждут {ocr['queued']} из {ocr['capacity']}, "
+        f"отложено {ocr['rejected']}"
+    )
+    if scheduler is not None:
+        buckets = ", ".join(f"{b}: {s['depth']} ждут, {s['served']} взято"
+                            for b, s in scheduler.stats().items())
+        logger.info(f"Бакеты: {buckets or 'нет задач'}")
+
+
+def run_listen_loop(recovery: Recovery | None = None) -> None:
+    """
+    Слушает PostgreSQL NOTIFY с автоматическим переподключением.
+    Задачи проходят через AdmissionController: при заполненной очереди
+    они остаются в БД и добираются по мере освобождения воркеров.
+    Пока идёт дообработка (recovery), её порции ставятся между уведомлениями.
+    """
+    last_stats = time.monotonic()
     while True:
         try:
             conn = psycopg2.connect(**DB_CONFIG)
@@ -139,38 +558,59 @@ def run_listen_loop() -> None:
             logger.info("Воркер активен и слушает канал new_scan...")
 
             while True:
-                if select.select([conn], [], [], 5) == ([], [], []):
+                if time.monotonic() - last_stats >= STATS_INTERVAL:
+                    _log_stats()
+                    last_stats = time.monotonic()
+
+                recovering = recovery is not None and not recovery.done
+                if recovering:
+                    _recovery_step(recovery)
+
+                if select.select([conn], [], [], RECOVERY_POLL if recovering else 5) == ([], [], []):
                     continue
                 conn.poll()
                 while conn.notifies:
                     notify = conn.notifies.pop(0)
-                    future = executor.submit(handle_notification, notify.payload)
-                    future.add_done_callback(_on_future_done)
+                    record_id = _parse_payload(notify.payload)
+                    if record_id is not None:
+                        admission.offer(record_id)
 
-        except Exception:
+        except Exception as e:
+            _record_db_failure(e)
             logger.exception("Потеряно соединение с БД, переподключение через 5 сек.")
             time.sleep(5)
 
 
+def _recovery_step(recovery: Recovery) -> None:
+    try:
+        recovery.step()
+    except psycopg2.Error as e:
+        # не рвём LISTEN-соединение: шаг повторится на следующей итерации
+        logger.warning(f"Дообработка очереди: ошибка БД, повтор: {e}")
+
+
 # =========================================================
 # 6. ТОЧКА ВХОДА
 # =========================================================
 if __name__ == "__main__":
+    init_services()
     try:
-        # Дообработка задач, оставшихся с прошлого запуска
         with get_db_session() as main_cur:
-            pending = queries.get_pending_tasks(main_cur)
-            if pending:
-                logger.info(f"Дообработка очереди: {len(pending)} задач.")
-                for pid in pending:
-                    future = executor.submit(handle_notification, str(pid))
-                    future.add_done_callback(_on_future_done)
+            queries.ensure_schema(main_cur)
 
-        run_listen_loop()
+        # Дообработка задач, оставшихся с прошлого запуска (в т.ч. с истёкшей арендой),
+        # идёт порциями внутри LISTEN-цикла. Захват — через claim_task, миграция
+        # схемы — под advisory-локом (см. ensure_schema), поэтому узлы можно
+        # запускать одновременно.
+        run_listen_loop(recovery)
 
     except KeyboardInterrupt:
         logger.info("Воркер выключен вручную.")
     finally:
+        for task in background:
+            task.stop()
         executor.shutdown(wait=True)
+        ocr_lane.shutdown()
+        engine.shutdown()
         db_pool.closeall()
         logger.info("Работа завершена.")
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+Прогон конвейера распознавания на локальных PDF — без БД, S3 и LISTEN.
+
+    python profile_pdf.py scan.pdf [папка ...] [--repeat 3] [--json]
+                          [--profile out.prof] [--flamegraph out.folded] [--images out_dir]
+
+Путь тот же, что в воркере (режим thread): ThreadEngine → scan_pdf_qr +
+PhoneOCR на общем рендере страниц, с настройками из settings.ini (режим
+поиска QR, уровни каскада OCR, деление пачек); кэш результатов выключен.
+Для каждого файла — итог, время и сумма по этапам (metrics.stage).
+
+--profile     — cProfile всех прогонов (pstats, snakeviz);
+--flamegraph  — выборки стека раз в --interval мс в свёрнутом формате
+                (flamegraph.pl, speedscope, inferno);
+--images      — промежуточные изображения первой страницы: углы с QR,
+                страница, поле телефона, бинаризация, кропы цифр.
+Нужен settings.ini (как у воркера).
+"""
+import argparse
+import cProfile
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from src import metrics
+from src.engine import ThreadEngine
+from src.phone_ocr import PhoneOCR
+from src.qr_service import FAST_DPI, ROI_CLIPS, scan_pdf_qr
+from src.render import PageRenderCache
+
+
+def collect_pdfs(paths: list[str]) -> list[str]:
+    """Файлы как есть, папки — все *.pdf внутри (рекурсивно), по алфавиту."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names if n.lower().endswith(".pdf"))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+# =========================================================
+# ПРОГОН
+# =========================================================
+def run_file(engine: ThreadEngine, pdf_bytes: bytes, repeat: int) -> tuple[dict, float, dict[str, float]]:
+    """
+    Итог, медиана полного времени и медианы сумм по этапам за repeat прогонов.
+    Вложенные этапы — с путём родителя («ocr_full/segmentation», см. metrics.collect).
+    """
+    totals, per_stage = [], []
+    doc = None
+    for _ in range(repeat):
+        with metrics.collect(nested=True) as samples:
+            start = time.perf_counter()
+            doc = engine.analyze(pdf_bytes)
+            totals.append(time.perf_counter() - start)
+        stages: dict[str, float] = {}
+        for name, seconds in samples:
+            stages[name] = stages.get(name, 0.0) + seconds
+        per_stage.append(stages)
+
+    names = sorted({name for stages in per_stage for name in stages})
+    return doc, statistics.median(totals), {
+        name: statistics.median(stages.get(name, 0.0) for stages in per_stage) for name in names
+    }
+
+
+def print_stages(stages: dict[str, float], total: float, parent: str = "") -> None:
+    """
+    Этапы деревом: вложенные — с отступом под родителем, их доля — от родителя
+    (у верхнего уровня — от total). Складываются только строки одного уровня.
+    """
+    prefix = f"{parent}/" if parent else ""
+    level = [(name, value) for name, value in stages.items()
+             if name.startswith(prefix) and "/" not in name[len(prefix):]]
+    base = stages[parent] if parent else total
+    for name, value in sorted(level, key=lambda kv: -kv[1]):
+        depth = name.count("/") + 1
+        share = f" ({value / base:6.1%})" if base else ""
+        print(f"{'    ' * depth}{name[len(prefix):]:<{max(10, 26 - 4 * depth)}} {value * 1e3:8.1f} мс{share}")
+        print_stages(stages, total, name)
+
+
+def describe(doc: dict) -> str:
+    if doc["status"] == "error":
+        return f"ошибка {doc['reason']}"
+    if doc["type"] == "init":
+        probs = doc.get("digit_probs") or [0.0]
+        return (f"init {doc['id']}: {doc.get('phone')} (мин. уверенность {min(probs):.2f}, "
+                f"уровни {','.join(doc.get('ocr_tiers') or [])})")
+    if doc["type"] == "batch":
+        return f"пачка: {len(doc['pages'])} писем, страницы {doc['pages']}"
+    return f"{doc['type']} {doc['id']}"
+
+
+# =========================================================
+# ВЫБОРКИ СТЕКА (flamegraph)
+# =========================================================
+class StackSampler:
+    """
+    Простой семплирующий профайлер без зависимостей: раз в interval снимает
+    стеки всех потоков (sys._current_frames) и копит их в свёрнутом виде
+    «поток;модуль:функция;... N». В отличие от cProfile почти не замедляет код
+    и видит время в C-вызовах (OpenCV, MuPDF, модель) как время вызвавшей функции.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if len(stack) > 1:  # пустые потоки пула ждут на одном кадре — не нужны
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# =========================================================
+# ПРОМЕЖУТОЧНЫЕ ИЗОБРАЖЕНИЯ
+# =========================================================
+def save_images(ocr: PhoneOCR, pdf_bytes: bytes, out_dir: str) -> int:
+    """Виды первой страницы на этапах QR и полного OCR. Возвращает число файлов."""
+    os.makedirs(out_dir, exist_ok=True)
+    images = {}
+    with PageRenderCache(pdf_bytes, zoom=PhoneOCR.ZOOM) as pages:
+        for i, clip in enumerate(ROI_CLIPS):
+            images[f"qr_clip{i}"] = pages.view(0, FAST_DPI / 72, clip)
+        qr = next((r for r in scan_pdf_qr(pages, "first") if r.page == 1 and r.valid and r.polygon), None)
+        gray, zoom = pages.view(0, PhoneOCR.ZOOM), pages.page_zoom(0, PhoneOCR.ZOOM)
+        images["page"] = gray
+
+    roi, y_range = ocr._full_roi(gray, zoom, qr.polygon if qr else None)
+    images["phone_roi"] = roi
+    images["binary"] = ocr._binarize(roi)
+    batch = ocr._segment_digits(roi, y_range)
+    if batch:
+        images["digits"] = np.hstack([(d[..., 0] * 255).astype(np.uint8) for d in batch])
+
+    for name, img in images.items():
+        cv2.imwrite(os.path.join(out_dir, f"{name}.png"), img)
+    return len(images)
+
+
+# =========================================================
+# ТОЧКА ВХОДА
+# =========================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="PDF-файлы или папки с ними")
+    parser.add_argument("--repeat", type=int, default=1, help="прогонов на файл (время — медиана)")
+    parser.add_argument("--json", action="store_true", help="результат по файлу — JSON-строкой")
+    parser.add_argument("--profile", metavar="OUT.prof", help="записать cProfile")
+    parser.add_argument("--flamegraph", metavar="OUT.folded", help="записать свёрнутые стеки")
+    parser.add_argument("--interval", type=float, default=5.0, help="период выборок стека, мс")
+    parser.add_argument("--images", metavar="DIR", help="сохранить промежуточные изображения")
+    parser.add_argument("-v", "--verbose", action="store_true", help="лог воркера уровня DEBUG")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    files = collect_pdfs(args.paths)
+    if not files:
+        parser.error("PDF не найдены")
+
+    engine = ThreadEngine()  # модель грузится до замеров
+    profiler = cProfile.Profile() if args.profile else None
+    sampler = StackSampler(args.interval / 1000) if args.flamegraph else None
+
+    totals: dict[str, float] = {}
+    elapsed = 0.0
+    if sampler:
+        sampler.__enter__()
+    try:
+        for path in files:
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+            if profiler:
+                profiler.enable()
+            try:
+                doc, seconds, stages = run_file(engine, pdf_bytes, args.repeat)
+            except Exception as e:
+                print(f"{path}: сбой — {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            finally:
+                if profiler:
+                    profiler.disable()
+
+            elapsed += seconds
+            for name, value in stages.items():
+                totals[name] = totals.get(name, 0.0) + value
+
+            if args.json:
+                print(json.dumps({"file": path, "seconds": seconds, "stages": stages, "result": doc},
+                                 ensure_ascii=False, default=str))
+            else:
+                print(f"{path}: {describe(doc)} — {seconds * 1e3:.1f} мс")
+                print_stages(stages, seconds)
+
+            if args.images:
+                out_dir = os.path.join(args.images, os.path.splitext(os.path.basename(path))[0])
+                saved = save_images(engine.processor.ocr, pdf_bytes, out_dir)
+                if not args.json:
+                    print(f"    изображения: {saved} в {out_dir}")
+    finally:
+        if sampler:
+            sampler.__exit__(None, None, None)
+
+    if not args.json and len(files) > 1 and elapsed:
+        print(f"\nИтого {len(files)} файлов: {elapsed:.2f} с, {len(files) / elapsed:.1f} док/с")
+        print_stages(totals, elapsed)
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f"cProfile: {args.profile} (python -m pstats {args.profile})", file=sys.stderr)
+    if sampler:
+        sampler.save(args.flamegraph)
+        print(f"Стеки: {args.flamegraph} ({sum(sampler.stacks.values())} выборок; "
+              f"flamegraph.pl или speedscope)", file=sys.stderr)
+    engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
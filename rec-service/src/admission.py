@@ -0,0 +1,241 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import metrics
+
+logger = logging.getLogger("worker.admission")
+
+
+class AdmissionController:
+    """
+    Ограниченный допуск задач в executor.
+
+    Держит не больше max_pending задач (в работе + в очереди executor).
+    Повторные ID, уже стоящие в очереди, схлопываются. Лишние задачи
+    не принимаются — они остаются в proc_files, а когда место освобождается,
+    контроллер добирает работу из БД задачами «захватить любую свободную»
+    (record_id = None), пока они находят записи.
+
+    Фоновый добор (bulk: дообработка, подметание, повторы и задачи
+    «любую свободную») занимает не больше max_pending - reserved мест:
+    последние reserved мест — только для живых NOTIFY, чтобы новый скан
+    не ждал, пока разберётся накопившийся хвост.
+
+    job_fn(record_id) должна вернуть True, если задача была захвачена и обработана.
+    gate() == False ставит приём на паузу (например, S3 или БД недоступны):
+    задачи не принимаются и не захватываются, а остаются в БД до resume().
+    Перед запуском задачи вызывается gate(start=True) — так предохранитель
+    после паузы пропускает одну пробную задачу, а не весь приток.
+    """
+
+    def __init__(self, executor, job_fn, max_pending: int, on_done=None, gate=None, reserved: int = 0):
+        self.executor = executor
+        self.job_fn = job_fn
+        self.max_pending = max_pending
+        self.reserved = min(reserved, max_pending - 1)
+        self.on_done = on_done
+        self.gate = gate
+
+        self._lock = threading.Lock()
+        self._queued: dict[int | None, int] = {}  # ключ -> сколько раз стоит в очереди
+        self._running = 0
+        self._backlog = False  # в БД может оставаться работа, не попавшая в очередь
+
+        # Счётчики для мониторинга
+        self.admitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.paused = 0
+        self.started = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # -------------------------
+    # Допуск
+    # -------------------------
+    def offer(self, record_id: int | None, bulk: bool = False) -> bool:
+        """
+        Пытается поставить задачу в очередь. None — «захватить любую свободную».
+        bulk — фоновый добор (None — всегда он): резервные места ему не отдаются.
+        Возвращает False, если задача не принята (дубль или нет места).
+        """
+        with self._lock:
+            if record_id is not None and record_id in self._queued:
+                self.coalesced += 1
+                return False
+            if not self._open():
+                self.paused += 1
+                self._backlog = True
+                return False
+            if self._pending() >= self._limit(bulk or record_id is None):
+                self.rejected += 1
+                self._backlog = True
+                return False
+            self._queued[record_id] = self._queued.get(record_id, 0) + 1
+            self.admitted += 1
+
+        future = self.executor.submit(self._run, record_id, time.monotonic())
+        if self.on_done:
+            future.add_done_callback(self.on_done)
+        return True
+
+    def has_capacity(self, bulk: bool = False) -> bool:
+        with self._lock:
+            return self._open() and self._pending() < self._limit(bulk)
+
+    def free_slots(self, bulk: bool = False) -> int:
+        """Сколько задач можно принять прямо сейчас (0 — на паузе)."""
+        with self._lock:
+            return max(0, self._limit(bulk) - self._pending()) if self._open() else 0
+
+    def queued_ids(self) -> set[int]:
+        """ID задач, стоящих в очереди executor (ещё не захваченных в БД)."""
+        with self._lock:
+            return {record_id for record_id in self._queued if record_id is not None}
+
+    def resume(self, limit: int | None = None) -> None:
+        """Добирает из БД работу, не принятую за время паузы или переполнения."""
+        with self._lock:
+            refill = self._take_backlog()
+        if limit is not None:
+            refill = min(refill, limit)
+        for _ in range(refill):
+            self.offer(None)
+
+    # -------------------------
+    # Выполнение
+    # -------------------------
+    def _run(self, record_id: int | None, admitted_at: float) -> None:
+        waited = time.monotonic() - admitted_at
+        with self._lock:
+            self._release_key(record_id)
+            self._running += 1
+            self.started += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        metrics.observe_stage("queue_wait", waited)
+
+        found = False
+        try:
+            if self._open(start=True):
+                found = bool(self.job_fn(record_id))
+            else:
+                with self._lock:
+                    self._backlog = True  # приём на паузе — задача остаётся в БД
+        finally:
+            with self._lock:
+                self._running -= 1
+                if record_id is None and found:
+                    self._backlog = True  # добор нашёл запись — возможно, есть ещё
+                refill = self._take_backlog()
+            for _ in range(refill):
+                self.offer(None)
+
+    def _take_backlog(self) -> int:
+        """Сколько задач добора поставить после освобождения места. Под локом."""
+        if not self._backlog or not self._open():
+            return 0
+        free = self._limit(bulk=True) - self._pending()
+        if free <= 0:
+            return 0
+        self._backlog = False
+        return free
+
+    def _release_key(self, record_id) -> None:
+        left = self._queued.get(record_id, 0) - 1
+        if left > 0:
+            self._queued[record_id] = left
+        else:
+            self._queued.pop(record_id, None)
+
+    def _open(self, start: bool = False) -> bool:
+        return self.gate is None or (self.gate(start=True) if start else self.gate())
+
+    def _limit(self, bulk: bool) -> int:
+        return self.max_pending - self.reserved if bulk else self.max_pending
+
+    def _pending(self) -> int:
+        return self._running + sum(self._queued.values())
+
+    # -------------------------
+    # Мониторинг
+    # -------------------------
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued":    sum(self._queued.values()),
+                "running":   self._running,
+                "capacity":  self.max_pending,
+                "reserved":  self.reserved,
+                "admitted":  self.admitted,
+                "coalesced": self.coalesced,
+                "rejected":  self.rejected,
+                "paused":    self.paused,
+                "backlog":   self._backlog,
+                "wait_avg":  self.wait_total / self.started if self.started else 0.0,
+                "wait_max":  self.wait_max,
+            }
+
+
+class Lane:
+    """
+    Полоса исполнения со своим бюджетом потоков и пределом задач
+    (в работе + в очереди). Задача, не влезшая в предел, не ставится —
+    вызывающий сам решает, что с ней делать (например, вернуть в БД).
+    Задача выполняется в контексте (contextvars) вызывающего: контекст
+    лога задачи переходит в полосу вместе с ней.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix=f"{name.capitalize()}Thread")
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_submit(self, fn, *args) -> bool:
+        with self._lock:
+            if self._queued + self._running >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._queued += 1
+            self.admitted += 1
+        ctx = contextvars.copy_context()
+        self.executor.submit(ctx.run, self._run, fn, args, time.monotonic())
+        return True
+
+    def _run(self, fn, args, admitted_at: float) -> None:
+        metrics.observe_stage(f"queue_wait_{self.name}", time.monotonic() - admitted_at)
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Необработанное исключение в полосе {self.name}")
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued":   self._queued,
+                "running":  self._running,
+                "capacity": self.max_pending,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,34 @@
+import logging
+import threading
+
+logger = logging.getLogger("worker.background")
+
+
+class Periodic:
+    """
+    Фоновый поток, вызывающий fn каждые interval секунд до stop().
+    Исключения fn логируются и не останавливают поток.
+    """
+
+    def __init__(self, name: str, interval: float, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+
+    def start(self) -> "Periodic":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.fn()
+            except Exception:
+                logger.exception(f"Сбой фоновой задачи {self.name}")
@@ -0,0 +1,44 @@
+import os
+
+import fitz
+
+
+def letter_ranges(qr_results, page_count: int) -> list[tuple[int, int]]:
+    """
+    Делит пачку писем (один скан стопки) на письма по QR.
+
+    Письмо начинается со страницы с верным QR, текст которого отличается
+    от QR текущего письма. Страницы без QR (оборот, продолжение) относятся
+    к предыдущему письму, страницы до первого QR — к первому.
+    Возвращает [(первая, последняя + 1), ...], страницы с 0.
+    """
+    starts: list[int] = []
+    current = None
+    for r in qr_results:  # scan_pdf_qr отдаёт результаты по порядку страниц
+        if not r.valid or r.text == current:
+            continue
+        current = r.text
+        if not starts or starts[-1] != r.page - 1:  # второй QR той же страницы письма не начинает
+            starts.append(r.page - 1)
+
+    if len(starts) <= 1:
+        return [(0, page_count)]
+    bounds = [0, *starts[1:], page_count]
+    return list(zip(bounds, bounds[1:]))
+
+
+def extract_pages(pdf_bytes: bytes, ranges) -> list[bytes]:
+    """Отдельный PDF на каждый диапазон страниц. Страницы копируются без растеризации."""
+    parts = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as src:
+        for start, end in ranges:
+            with fitz.open() as part:
+                part.insert_pdf(src, from_page=start, to_page=end - 1)
+                parts.append(part.tobytes(garbage=3, deflate=True))
+    return parts
+
+
+def part_key(s3_key: str, n: int) -> str:
+    """Ключ письма n (с 1) рядом с исходным сканом: 2026/03/scan.pdf → 2026/03/scan.part02.pdf."""
+    root, ext = os.path.splitext(s3_key)
+    return f"{root}.part{n:02d}{ext or '.pdf'}"
@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("worker.circuit")
+
+
+class CircuitBreaker:
+    """
+    Предохранитель внешней зависимости (S3, Postgres).
+
+    closed    — всё работает, сбои считаются подряд;
+    open      — после failure_threshold сбоев подряд: приём новых задач
+                на паузе, пока не пройдёт reset_sec;
+    half_open — пауза истекла: пропускается одна пробная задача (acquire),
+                остальные ждут её исхода — первый успех замыкает цепь,
+                первый сбой снова размыкает. Проба, не давшая исхода
+                (например, не нашла работы), через reset_sec уступает место
+                следующей.
+
+    Считать нужно только сбои доступности (см. retry.is_transient),
+    а не ошибки конкретного файла.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_sec: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_at: float | None = None  # когда выдана пробная задача в half_open
+
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def allow(self) -> bool:
+        """Можно ли принять новую работу, зависящую от этого сервиса (ничего не занимает)."""
+        with self._lock:
+            state = self._state()
+            return state == self.CLOSED or (state == self.HALF_OPEN and not self._probing())
+
+    def acquire(self) -> bool:
+        """Работа начинается: в half_open занимает единственную пробу."""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.OPEN or self._probing():
+                return False
+            self._probe_at = time.monotonic()
+            logger.info(f"{self.name}: пробная задача после паузы.")
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name}: сервис снова доступен, приём задач возобновлён.")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._probe_at = None
+            self._failures += 1
+            state = self._state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                logger.error(f"{self.name}: {self._failures} сбоев подряд, приём задач "
+                             f"приостановлен на {self.reset_sec:.0f}с.")
+
+    def _probing(self) -> bool:
+        return self._probe_at is not None and time.monotonic() - self._probe_at < self.reset_sec
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_sec:
+            return self.OPEN
+        return self.HALF_OPEN
@@ -1,7 +1,9 @@
 import configparser
 import os
+import socket
 from typing import Union, Type
 from src.log_config import build_log_config
+from src.threads import available_cores
 
 config = configparser.ConfigParser()
 config_path = os.path.join(os.path.dirname(__file__), "settings.ini")
@@ -10,18 +12,26 @@ if not config.read(config_path):
     raise FileNotFoundError(f"Конфигурационный файл не найден: {config_path}")
 
 
-def _get(section: str, key: str, data_type: Type = str) -> Union[str, int, bool]:
+_REQUIRED = object()
+
+
+def _get(section: str, key: str, data_type: Type = str, fallback=_REQUIRED) -> Union[str, int, float, bool]:
     """
     Универсальный забор данных из конфига с приведением типов и обработкой ошибок.
+    Если задан fallback — параметр необязателен.
     """
     try:
-        if isinstance(data_type, int):
+        if data_type is int:
             return config.getint(section, key)
-        if isinstance(data_type, bool):
+        if data_type is float:
+            return config.getfloat(section, key)
+        if data_type is bool:
             return config.getboolean(section, key)
         return config.get(section, key)
 
     except (configparser.NoSectionError, configparser.NoOptionError):
+        if fallback is not _REQUIRED:
+            return fallback
         raise RuntimeError(f"Ошибка: В settings.ini отсутствует [{section}] -> {key}")
     except ValueError:
         raise RuntimeError(f"Ошибка типа: Параметр [{section}] -> {key} должен быть {data_type.__name__}")
@@ -63,5 +73,145 @@ PROC_NEW   = _get("proc_status", "new")
 PROC_DONE  = _get("proc_status", "done")
 PROC_ERROR = _get("proc_status", "error")
 
+# --- Бюджет CPU ---
+# cores — сколько ядер отдать воркеру (0 — все доступные); от него считаются
+# ширина полос (если [worker] concurrency не задан) и потоки OpenCV/TensorFlow.
+# pin — в режиме process закрепить процессы пулов за своими ядрами
+THREADS_CORES = _get("threads", "cores", int, fallback=0)
+THREADS_PIN   = _get("threads", "pin", bool, fallback=False)
+
+# --- Воркер ---
+# mode: thread — распознавание в потоках воркера,
+#       process — в пуле процессов (модель и детекторы грузятся в каждом процессе)
+# concurrency — сколько задач распознавания идёт одновременно на обе полосы
+# (по умолчанию — по числу ядер с учётом [threads] cores)
+_CORES = len(available_cores())
+if 0 < THREADS_CORES < _CORES:
+    _CORES = THREADS_CORES
+WORKER_MODE        = _get("worker", "mode", fallback="thread")
+WORKER_CONCURRENCY = _get("worker", "concurrency", int, fallback=_CORES)
+
+# Аренда задачи в proc_files: после истечения запись может забрать другой узел
+WORKER_ID        = _get("worker", "worker_id", fallback=f"{socket.gethostname()}:{os.getpid()}")
+WORKER_LEASE_SEC = _get("worker", "lease_sec", int, fallback=300)
+
+# Предел задач в работе + в очереди; остальное ждёт в proc_files
+WORKER_MAX_PENDING = _get("worker", "max_pending", int, fallback=WORKER_CONCURRENCY * 4)
+
+# Из них мест только для живых NOTIFY: дообработка, подметание, повторы и
+# добор «любой свободной» их не занимают — новый скан не ждёт разбора хвоста
+WORKER_RESERVED_SLOTS = _get("worker", "reserved_slots", int, fallback=WORKER_MAX_PENDING // 4)
+
+if not 0 <= WORKER_RESERVED_SLOTS < WORKER_MAX_PENDING:
+    raise RuntimeError("Ошибка: [worker] -> reserved_slots должен быть от 0 до max_pending - 1")
+
+# Дообработка накопившихся задач при старте: размер страницы (keyset по id)
+WORKER_RECOVERY_BATCH = _get("worker", "recovery_batch", int, fallback=500)
+
+# Полосы: qr — захват, скачивание, QR, ответы и проверки; ocr — распознавание
+# телефона init-писем. У каждой свой бюджет потоков (в режиме process — процессов),
+# поэтому поток init-писем не задерживает дешёвые ответы. По умолчанию
+# concurrency делится между полосами пополам (нечётный остаток — полосе qr).
+WORKER_QR_WORKERS      = _get("worker", "qr_workers", int, fallback=max(1, (WORKER_CONCURRENCY + 1) // 2))
+WORKER_OCR_WORKERS     = _get("worker", "ocr_workers", int, fallback=max(1, WORKER_CONCURRENCY // 2))
+WORKER_OCR_MAX_PENDING = _get("worker", "ocr_max_pending", int, fallback=WORKER_OCR_WORKERS * 4)
+
+# Если очередь OCR полна, init-письмо возвращается в proc_files на столько секунд
+WORKER_DEFER_SEC = _get("worker", "defer_sec", int, fallback=30)
+
+if WORKER_MODE not in ("thread", "process"):
+    raise RuntimeError(f"Ошибка: [worker] -> mode должен быть thread или process, а не {WORKER_MODE!r}")
+
+# --- Пачки писем ---
+# split: скан стопки писем (несколько разных QR) делится на письма — каждое
+# выгружается отдельным PDF рядом со сканом и получает свою запись proc_files.
+# Включено по умолчанию; нужен поиск QR по всем страницам ([qr] mode = auto,
+# all или parallel). Без деления все письма пачки, кроме первого, уходят в карантин
+BATCH_SPLIT = _get("batch", "split", bool, fallback=True)
+
+# --- Поиск QR ---
+# mode: first — страницы по порядку до первого верного QR (пачки не делятся —
+#       остальные страницы не сканируются);
+#       all — все страницы по порядку;
+#       parallel — страницы многостраничного скана параллельно, не больше
+#       page_workers потоков на процесс;
+#       auto (по умолчанию) — parallel, если пачки делятся, иначе first
+QR_SCAN_MODE    = _get("qr", "mode", fallback="auto")
+QR_PAGE_WORKERS = _get("qr", "page_workers", int, fallback=4)
+
+if QR_SCAN_MODE == "auto":
+    QR_SCAN_MODE = "parallel" if BATCH_SPLIT else "first"
+if QR_SCAN_MODE not in ("first", "all", "parallel"):
+    raise RuntimeError(f"Ошибка: [qr] -> mode должен быть auto, first, all или parallel, а не {QR_SCAN_MODE!r}")
+
+# --- Очерёдность задач ---
+# mode: fifo — по порядку поступления; fair — deficit round-robin по s3_bucket
+# (у каждого принтера свой бакет). Веса — в секции [scheduling.weights]:
+# <бакет> = <вес>, остальные бакеты получают default_weight.
+SCHED_MODE           = _get("scheduling", "mode", fallback="fifo")
+SCHED_DEFAULT_WEIGHT = _get("scheduling", "default_weight", float, fallback=1.0)
+SCHED_REFRESH_SEC    = _get("scheduling", "refresh_sec", float, fallback=2.0)
+SCHED_WEIGHTS        = {
+    bucket: _get("scheduling.weights", bucket, float)
+    for bucket in (config.options("scheduling.weights") if config.has_section("scheduling.weights") else ())
+}
+
+if SCHED_MODE not in ("fifo", "fair"):
+    raise RuntimeError(f"Ошибка: [scheduling] -> mode должен быть fifo или fair, а не {SCHED_MODE!r}")
+if min([SCHED_DEFAULT_WEIGHT, *SCHED_WEIGHTS.values()]) <= 0:
+    raise RuntimeError("Ошибка: веса [scheduling] должны быть положительными")
+
+# --- Повторы после временных сбоев S3/БД ---
+# Запись откладывается на base_delay_sec * 2^попытка (не больше max_delay_sec);
+# после max_attempts попыток — ошибка. Срок повторов проверяется раз в poll_sec.
+RETRY_MAX_ATTEMPTS   = _get("retry", "max_attempts", int, fallback=5)
+RETRY_BASE_DELAY_SEC = _get("retry", "base_delay_sec", float, fallback=10.0)
+RETRY_MAX_DELAY_SEC  = _get("retry", "max_delay_sec", float, fallback=600.0)
+RETRY_POLL_SEC       = _get("retry", "poll_sec", float, fallback=5.0)
+
+# --- Подметание потерянных NOTIFY ---
+# Раз в interval_sec (0 — отключено) не больше max_per_sweep записей,
+# необработанных дольше min_age_sec, ставятся в очередь
+SWEEP_INTERVAL_SEC = _get("sweeper", "interval_sec", float, fallback=30.0)
+SWEEP_MIN_AGE_SEC  = _get("sweeper", "min_age_sec", float, fallback=60.0)
+SWEEP_MAX_ROWS     = _get("sweeper", "max_per_sweep", int, fallback=100)
+
+# --- Предохранители S3 и БД ---
+# После failure_threshold сбоев подряд приём задач встаёт на reset_sec
+CIRCUIT_FAILURE_THRESHOLD = _get("circuit", "failure_threshold", int, fallback=5)
+CIRCUIT_RESET_SEC         = _get("circuit", "reset_sec", float, fallback=30.0)
+
+# --- Метрики Prometheus (port 0 — отключены, по умолчанию) ---
+# На одном хосте с несколькими воркерами у каждого должен быть свой порт;
+# host 0.0.0.0 — отдавать метрики наружу
+METRICS_PORT = _get("metrics", "port", int, fallback=0)
+METRICS_HOST = _get("metrics", "host", fallback="127.0.0.1")
+
+# --- Инференс цифр ---
+# backend: keras (TensorFlow), tflite или numpy; файлы .tflite/.npz
+# готовит export_model.py, по умолчанию ищутся рядом с model_path
+OCR_BACKEND    = _get("ocr", "backend", fallback="keras")
+OCR_MODEL_FILE = _get("ocr", "model_file", fallback=None)
+
+if OCR_BACKEND not in ("keras", "tflite", "numpy"):
+    raise RuntimeError(f"Ошибка: [ocr] -> backend должен быть keras, tflite или numpy, а не {OCR_BACKEND!r}")
+
+# Каскад: tiers — уровни по порядку (fast — дёшево по геометрии QR, full — полный
+# конвейер, heavy — перебор вариантов). Следующий уровень — только если номер
+# неправдоподобен (не 11 цифр с 7/8 в начале) или уверенность цифры ниже min_prob.
+# По умолчанию tiers = full — один проход, как раньше; каскад включается явно
+# (например, tiers = fast,full,heavy).
+OCR_TIERS    = tuple(t.strip() for t in _get("ocr", "tiers", fallback="full").split(",") if t.strip())
+OCR_MIN_PROB = _get("ocr", "min_prob", float, fallback=0.9)
+
+if not OCR_TIERS or not set(OCR_TIERS) <= {"fast", "full", "heavy"}:
+    raise RuntimeError(f"Ошибка: [ocr] -> tiers — список из fast, full, heavy, а не {OCR_TIERS!r}")
+
+# --- Кэш результатов по SHA-256 файла ---
+# db — общий кэш в таблице doc_results (переживает рестарт, виден всем узлам)
+CACHE_ENABLED      = _get("cache", "enabled", bool, fallback=True)
+CACHE_MEMORY_ITEMS = _get("cache", "memory_items", int, fallback=1024)
+CACHE_DB           = _get("cache", "db", bool, fallback=True)
+
 # --- Логирование ---
 LOG_CONFIG = build_log_config(config)
\ No newline at end of file
@@ -0,0 +1,272 @@
+import logging
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import partial
+
+from src import metrics
+from src.log_config import current_context, forward_logs, job_context, log_to_queue
+from src.render import PageRenderCache
+from src.services import DocumentProcessor
+
+logger = logging.getLogger("worker.engine")
+
+
+def build_processor(with_ocr: bool = True) -> DocumentProcessor:
+    """Создаёт DocumentProcessor с QR-сканером и (если нужно) моделью."""
+    # Тяжёлые импорты (модель) — только в том процессе, который распознаёт
+    from src.config import BATCH_SPLIT, QR_SCAN_MODE
+    from src.qr_service import scan_pdf_qr
+
+    ocr = None
+    if with_ocr:
+        from src.phone_ocr import PhoneOCR
+        ocr = PhoneOCR()
+    scanner = partial(scan_pdf_qr, mode=QR_SCAN_MODE)
+    return DocumentProcessor(ocr_engine=ocr, qr_scanner=scanner, split_batches=BATCH_SPLIT)
+
+
+@dataclass
+class Analysis:
+    """
+    Итог этапа QR. final — документ готов (ответ, ошибка, кэш);
+    иначе это init-письмо, ждущее OCR. pages — рендер, общий с OCR
+    (только в режиме thread), закрывается в recognize/skip; views — готовые
+    виды первой страницы из процесса QR (режим process), см. export_views.
+    """
+    doc: dict
+    pdf_bytes: bytes
+    digest: str | None = None
+    pages: PageRenderCache | None = None
+    final: bool = True
+    views: dict | None = None
+
+    def close(self) -> None:
+        self.views = None
+        if self.pages is not None:
+            self.pages.close()
+            self.pages = None
+
+
+# =========================================================
+# ПРОЦЕСС-ВОРКЕР
+# =========================================================
+_processor: DocumentProcessor | None = None
+
+
+def _init_process(ready, logs, with_ocr: bool = True, budget=None, slot=None, base: int = 0) -> None:
+    """Initializer пула: модель и детекторы грузятся один раз на процесс."""
+    global _processor
+    log_to_queue(logs)
+    if budget is not None:
+        # Номер процесса в пуле — для закрепления за ядрами; base — сдвиг пула
+        with slot.get_lock():
+            index = base + slot.value % ready.parties
+            slot.value += 1
+        from src.config import OCR_BACKEND
+        budget.apply(index, with_tf=with_ocr and OCR_BACKEND == "keras")
+        logger.info(f"Процесс {index} ({os.getpid()}): {budget.effective()}")
+    _processor = build_processor(with_ocr)
+    try:
+        ready.wait(timeout=120)  # ждём остальных — так prefork поднимает все процессы
+    except threading.BrokenBarrierError:
+        pass
+
+
+def _in_context(context: dict, fn, *args):
+    # Контекст лога задачи (record_id, bucket) из потока-родителя
+    with job_context(**context):
+        return fn(*args)
+
+
+def _decode(pdf_bytes: bytes) -> tuple[tuple[dict, dict | None], list]:
+    # Замеры этапов копятся локально и уезжают родителю вместе с результатом.
+    # Init-письму нужен OCR в другом процессе — с ним уезжают уже готовые виды
+    # первой страницы, чтобы не растеризовать и не декодировать её повторно.
+    with metrics.collect() as samples, PageRenderCache(pdf_bytes) as pages:
+        result = _processor.decode_qr(pages)
+        views = pages.export_views() if DocumentProcessor.needs_ocr(result) else None
+    return (result, views), samples
+
+
+def _recognize(pdf_bytes: bytes, doc: dict, views: dict | None = None) -> tuple[dict, list]:
+    with metrics.collect() as samples, PageRenderCache(pdf_bytes, views=views) as pages:
+        result = _processor.recognize_phone(pages, doc)
+    return result, samples
+
+
+# =========================================================
+# ДВИЖКИ
+# =========================================================
+class _Engine:
+    """
+    Общая схема: decode (QR, дёшево) → recognize (OCR, дорого) или skip.
+    Этапы можно выполнять в разных потоках — так main разводит ответы
+    и init-письма по разным полосам. Кэш результатов проверяется до QR.
+    """
+
+    result_cache = None
+
+    def decode(self, pdf_bytes: bytes) -> Analysis:
+        digest = None
+        if self.result_cache is not None:
+            digest = self.result_cache.key(pdf_bytes)
+            cached = self.result_cache.get(digest)
+            if cached is not None:
+                return Analysis(cached, pdf_bytes, digest)
+
+        analysis = self._decode(pdf_bytes)
+        analysis.digest = digest
+        if DocumentProcessor.needs_ocr(analysis.doc):
+            analysis.final = False
+        else:
+            analysis.close()
+            self._store(analysis)
+        return analysis
+
+    def recognize(self, analysis: Analysis) -> dict:
+        try:
+            analysis.doc = self._recognize(analysis)
+        finally:
+            analysis.close()
+        # Уровни каскада едут в результате — так они доходят и из процессов пула
+        metrics.observe_ocr_tiers(analysis.doc.get("ocr_tiers") or ())
+        analysis.final = True
+        self._store(analysis)
+        return analysis.doc
+
+    def skip(self, analysis: Analysis, reason: str) -> dict:
+        """Документ остановлен проверкой до OCR; такой итог не кэшируется."""
+        analysis.close()
+        analysis.final = True
+        analysis.doc = DocumentProcessor.skipped(analysis.doc, reason)
+        return analysis.doc
+
+    def analyze(self, pdf_bytes: bytes, precheck=None) -> dict:
+        """Оба этапа подряд в текущем потоке."""
+        analysis = self.decode(pdf_bytes)
+        if analysis.final:
+            return analysis.doc
+        try:
+            reason = precheck(analysis.doc) if precheck else None
+        except BaseException:
+            analysis.close()
+            raise
+        if reason:
+            return self.skip(analysis, reason)
+        return self.recognize(analysis)
+
+    def _store(self, analysis: Analysis) -> None:
+        """Кэширует итог, только если OCR действительно отработал (нет ocr_error)."""
+        if analysis.doc.get("ocr_error"):
+            return
+        if self.result_cache is not None and analysis.digest:
+            self.result_cache.put(analysis.digest, analysis.doc)
+
+    def shutdown(self) -> None:
+        pass
+
+
+class ThreadEngine(_Engine):
+    """Распознавание прямо в I/O-потоках воркера. Один DocumentProcessor на все потоки."""
+
+    def __init__(self, result_cache=None):
+        self.processor = build_processor()
+        self.result_cache = result_cache
+
+    def _decode(self, pdf_bytes: bytes) -> Analysis:
+        pages = PageRenderCache(pdf_bytes)
+        try:
+            doc = self.processor.decode_qr(pages)
+        except Exception:
+            pages.close()
+            raise
+        return Analysis(doc, pdf_bytes, pages=pages)
+
+    def _recognize(self, analysis: Analysis) -> dict:
+        if analysis.pages is None:
+            analysis.pages = PageRenderCache(analysis.pdf_bytes)
+        return self.processor.recognize_phone(analysis.pages, analysis.doc)
+
+
+class ProcessEngine(_Engine):
+    """
+    Распознавание в пулах процессов.
+
+    I/O (S3, Postgres) остаётся в потоках основного процесса, сюда уходят
+    только байты PDF, обратно — словарь результата (у init-письма ещё и
+    готовые виды первой страницы — их получает процесс OCR). Процессы стартуют
+    заранее (prefork), чтобы первая задача не ждала загрузку модели.
+    QR и OCR идут в разные пулы: очередь OCR не задерживает ответы.
+    В процессах QR-пула модель не загружается.
+    """
+
+    def __init__(self, qr_workers: int, ocr_workers: int, result_cache=None, budget=None):
+        self.sizes = {"qr": qr_workers, "ocr": ocr_workers}
+        self.result_cache = result_cache
+        self.budget = budget
+        if budget is not None:
+            # BLAS/OpenMP читают окружение при импорте — процессы получат его при spawn
+            os.environ.update(budget.environ())
+        self._lock = threading.Lock()
+        # Логи процессов пула пишет родитель — один файл, один поток записи
+        self._logs = mp.get_context("spawn").Queue()
+        self._log_listener = forward_logs(self._logs)
+        self.pools = {lane: self._start(lane) for lane in self.sizes}
+
+    def _start(self, lane: str) -> ProcessPoolExecutor:
+        workers = self.sizes[lane]
+        # spawn: fork после инициализации TensorFlow/OpenCV в родителе небезопасен
+        ctx = mp.get_context("spawn")
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_process,
+            initargs=(ctx.Barrier(workers), self._logs, lane == "ocr",
+                      self.budget, ctx.Value("i", 0), 0 if lane == "qr" else self.sizes["qr"]),
+        )
+        # Каждая пустая задача порождает процесс; барьер в initializer не даёт
+        # одному процессу забрать их все, пока остальные не загрузили модель.
+        for f in [pool.submit(os.getpid) for _ in range(workers)]:
+            f.result()
+        logger.info(f"Пул процессов {lane} запущен: {workers} процессов.")
+        return pool
+
+    def _decode(self, pdf_bytes: bytes) -> Analysis:
+        doc, views = self._call("qr", _decode, pdf_bytes)
+        return Analysis(doc, pdf_bytes, views=views)
+
+    def _recognize(self, analysis: Analysis) -> dict:
+        return self._call("ocr", _recognize, analysis.pdf_bytes, analysis.doc, analysis.views)
+
+    def _call(self, lane: str, fn, *args) -> dict:
+        pool = self.pools[lane]
+        try:
+            result, samples = pool.submit(_in_context, current_context(), fn, *args).result()
+            metrics.replay(samples)
+            return result
+        except BrokenProcessPool as e:
+            with self._lock:
+                if self.pools[lane] is pool:  # пересоздаёт только первый заметивший поток
+                    logger.critical(f"Процесс распознавания ({lane}) упал, пересоздаём пул.")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pools[lane] = self._start(lane)
+            raise RuntimeError("Процесс распознавания аварийно завершился") from e
+
+    def shutdown(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+        self._log_listener.stop()
+
+
+def create_engine(mode: str, qr_workers: int, ocr_workers: int, result_cache=None, budget=None):
+    if mode == "process":
+        return ProcessEngine(qr_workers, ocr_workers, result_cache, budget)
+    if budget is not None:
+        from src.config import OCR_BACKEND
+        budget.apply(with_tf=OCR_BACKEND == "keras")  # до загрузки модели
+        logger.info(f"Процесс воркера: {budget.effective()}")
+    return ThreadEngine(result_cache)
@@ -1,6 +1,6 @@
 import logging
 
-import src.queries
+import src.queries as queries
 
 logger = logging.getLogger("worker.handlers")
 
@@ -8,11 +8,18 @@ logger = logging.getLogger("worker.handlers")
 _SKIP_QUARANTINE = {"BLANK_ALREADY_USED"}
 
 
-def process_document(cur, record_id: int, stor_url: str, doc: dict) -> None:
+def process_document(cur, record_id: int, stor_url: str, doc: dict) -> str:
     """
     Точка входа для обработки одного документа.
-    Маршрутизирует по типу и статусу, не бросает исключений наружу.
+    Маршрутизирует по типу и статусу. Наружу выходят только сбои БД и
+    queries.LeaseLost — запись уже не арендована этим воркером, итог не пишется.
+    Возвращает итог обработки (причину ошибки или тип успеха) для метрик.
     """
+    if doc["status"] == "error" and doc["reason"] in _SKIP_QUARANTINE:
+        logger.warning(f"ID {record_id}: {doc['reason']} — OCR пропущен, в карантин не пишем.")
+        queries.update_proc_status(cur, record_id, queries.PROC_DONE)
+        return doc["reason"]
+
     if doc["status"] == "error":
         logger.error(f"ID {record_id}: ошибка анализа — {doc['reason']}")
         queries.mark_as_error(
@@ -20,11 +27,12 @@ def process_document(cur, record_id: int, stor_url: str, doc: dict) -> None:
             reason=doc["reason"],
             qr_text=doc.get("qr_text"),
         )
-        return
+        return doc["reason"]
 
     dispatch = {
         "answer": _handle_answer,
         "init":   _handle_init,
+        "batch":  _handle_batch,
     }
     handler = dispatch.get(doc["type"])
 
@@ -32,28 +40,29 @@ def process_document(cur, record_id: int, stor_url: str, doc: dict) -> None:
         logger.error(f"ID {record_id}: неизвестный тип документа — {doc['type']!r}")
         queries.mark_as_error(cur, record_id, stor_url, "UNKNOWN_DOC_TYPE",
                               qr_text=doc.get("qr_text"))
-        return
+        return "UNKNOWN_DOC_TYPE"
 
-    handler(cur, record_id, stor_url, doc)
+    return handler(cur, record_id, stor_url, doc)
 
 
 # =========================================================
 # ВНУТРЕННИЕ ОБРАБОТЧИКИ
 # =========================================================
 
-def _handle_answer(cur, record_id: int, stor_url: str, doc: dict) -> None:
+def _handle_answer(cur, record_id: int, stor_url: str, doc: dict) -> str:
     """Привязывает скан как ответ к существующему письму."""
     queries.update_as_answer(cur, record_id, doc["id"], stor_url)
     logger.info(f"ID {record_id}: привязан ответ к письму {doc['id']}.")
+    return "ANSWER_LINKED"
 
 
-def _handle_init(cur, record_id: int, stor_url: str, doc: dict) -> None:
+def _handle_init(cur, record_id: int, stor_url: str, doc: dict) -> str:
     """Создаёт инициативное письмо."""
     if not doc.get("phone"):
         logger.warning(f"ID {record_id}: телефон не распознан.")
         queries.mark_as_error(cur, record_id, stor_url,
                               "PHONE_NOT_FOUND", qr_text=doc.get("qr_text"))
-        return
+        return "PHONE_NOT_FOUND"
 
     success, res = queries.create_init_letter(
         cur, record_id, doc["id"], stor_url, doc["phone"]
@@ -66,5 +75,17 @@ def _handle_init(cur, record_id: int, stor_url: str, doc: dict) -> None:
             logger.error(f"ID {record_id}: не удалось создать письмо — {res}. Отправляем в карантин.")
             queries.mark_as_error(cur, record_id, stor_url, res,
                                   qr_text=doc.get("qr_text"))
-    else:
-        logger.info(f"ID {record_id}: создано письмо {res} с номером {doc['phone']}")
\ No newline at end of file
+        return res
+
+    probs = doc.get("digit_probs") or [0.0]
+    logger.info(f"ID {record_id}: создано письмо {res} с номером {doc['phone']} "
+                f"(мин. уверенность {min(probs):.2f})")
+    return "INIT_CREATED"
+
+
+def _handle_batch(cur, record_id: int, stor_url: str, doc: dict) -> str:
+    """Пачка писем: каждое письмо (файл уже в S3) становится отдельной задачей."""
+    ids = queries.split_task(cur, record_id, doc["keys"])
+    logger.info(f"ID {record_id}: пачка из {len(doc['keys'])} писем "
+                f"(страницы {doc['pages']}) разделена, новые записи: {ids}.")
+    return "BATCH_SPLIT"
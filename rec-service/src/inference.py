@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger("worker.inference")
+
+# Расширение файла модели для каждого бэкенда (рядом с .h5, см. export_model.py)
+MODEL_SUFFIX = {
+    "keras":  ".h5",
+    "tflite": ".tflite",
+    "numpy":  ".npz",
+}
+
+
+# =========================================================
+# БЭКЕНДЫ
+# =========================================================
+# Общий интерфейс: predict(batch) — batch (N, 32, 32, 1) float32 в [0, 1],
+# результат — вероятности классов (N, 10).
+
+class KerasBackend:
+    """Исходная модель через TensorFlow/Keras."""
+
+    name = "keras"
+
+    def __init__(self, path: str):
+        import tensorflow as tf  # тяжёлый импорт — только если выбран этот бэкенд
+
+        self.model = tf.keras.models.load_model(path)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    """
+    Конвертированная модель через интерпретатор TFLite.
+    Достаточно пакета ai-edge-litert (или tflite-runtime) — без TensorFlow.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path: str):
+        self.interpreter = _tflite_interpreter()(model_path=path, num_threads=1)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]["index"]
+        self._output = self.interpreter.get_output_details()[0]["index"]
+        self._batch = None
+        self._lock = threading.Lock()  # интерпретатор не потокобезопасен
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch:
+                self.interpreter.resize_tensor_input(self._input, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch = batch.shape[0]
+            self.interpreter.set_tensor(self._input, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+
+class NumpyBackend:
+    """
+    Та же сеть на чистом NumPy по весам из .npz:
+    Conv(3x3, relu) → MaxPool 2 → Conv(3x3, relu) → MaxPool 2 → Dense relu → Dense softmax.
+    Dropout на инференсе — тождественное преобразование.
+    """
+
+    name = "numpy"
+
+    LAYERS = ("conv1", "conv2", "dense1", "dense2")
+
+    def __init__(self, path: str):
+        with np.load(path) as data:
+            self.weights = {
+                key: data[key].astype(np.float32)
+                for layer in self.LAYERS for key in (f"{layer}_w", f"{layer}_b")
+            }
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        w = self.weights
+        x = np.asarray(batch, dtype=np.float32)
+        x = _max_pool2(_conv_relu(x, w["conv1_w"], w["conv1_b"]))
+        x = _max_pool2(_conv_relu(x, w["conv2_w"], w["conv2_b"]))
+        x = x.reshape(len(x), -1)  # порядок (h, w, c) совпадает с Flatten в Keras
+        x = np.maximum(x @ w["dense1_w"] + w["dense1_b"], 0)
+        return _softmax(x @ w["dense2_w"] + w["dense2_b"])
+
+
+def _conv_relu(x: np.ndarray, kernel: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    """Свёртка padding=valid, stride 1. x (N, H, W, C), kernel (kh, kw, C, F)."""
+    kh, kw = kernel.shape[:2]
+    windows = sliding_window_view(x, (kh, kw), axis=(1, 2))  # (N, H', W', C, kh, kw)
+    out = np.tensordot(windows, kernel.transpose(2, 0, 1, 3), axes=([3, 4, 5], [0, 1, 2]))
+    out += bias
+    return np.maximum(out, 0, out=out)
+
+
+def _max_pool2(x: np.ndarray) -> np.ndarray:
+    n, h, w, c = x.shape
+    h2, w2 = h // 2, w // 2
+    return x[:, :h2 * 2, :w2 * 2].reshape(n, h2, 2, w2, 2, c).max(axis=(2, 4))
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def _tflite_interpreter():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+# =========================================================
+# ВЫБОР
+# =========================================================
+BACKENDS = {cls.name: cls for cls in (KerasBackend, TFLiteBackend, NumpyBackend)}
+
+
+def model_file(backend: str, model_path: str) -> str:
+    """Путь к файлу модели для бэкенда: postal_model.h5 → postal_model.npz и т.п."""
+    return os.path.splitext(model_path)[0] + MODEL_SUFFIX[backend]
+
+
+def create_backend(backend: str, model_path: str, path: str | None = None):
+    """
+    Создаёт бэкенд инференса. model_path — исходная .h5-модель,
+    path — явный путь к файлу бэкенда (по умолчанию рядом с .h5).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд инференса: {backend!r}, доступны {sorted(BACKENDS)}")
+    path = path or model_file(backend, model_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Файл модели для бэкенда {backend} не найден: {path}")
+    return BACKENDS[backend](path)
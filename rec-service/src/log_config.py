@@ -1,25 +1,47 @@
+import atexit
 import configparser
+import contextvars
+import copy
+import json
+import logging.config
 import logging.handlers
+import queue
+from contextlib import contextmanager
+
+# Контекст задачи (record_id, bucket, stage) — contextvars: дёшево читается
+# в фильтре и не путается между потоками воркера
+_job: contextvars.ContextVar[dict] = contextvars.ContextVar("job", default={})
+
+CONTEXT_FIELDS = ("record_id", "bucket", "stage")
 
 
 def build_log_config(config: configparser.ConfigParser) -> dict:
     log_file = config.get("logging", "file", fallback="worker.log")
+    # format: text — как раньше, json — одна JSON-строка на запись (для сборщиков логов)
+    structured = config.get("logging", "format", fallback="text") == "json"
     return {
         "version": 1,
         "disable_existing_loggers": False,
+        # queue: обработчики корня работают в одном фоновом потоке (см. start_logging)
+        "queue": config.getboolean("logging", "queue", fallback=True),
+        "filters": {
+            "job": {"()": JobContextFilter},
+        },
         "formatters": {
             "standard": {
-                "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+                "format": "%(asctime)s [%(levelname)s] %(name)s%(job)s: %(message)s"
             },
             "detailed": {
-                "format": "%(asctime)s [%(threadName)s] %(levelname)s %(module)s: %(message)s"
+                "format": "%(asctime)s [%(threadName)s] %(levelname)s %(module)s%(job)s: %(message)s"
             },
+            "json": {"()": JsonFormatter},
         },
         "handlers": {
             "console": {
                 "class": "logging.StreamHandler",
                 "level": "INFO",
-                "formatter": "standard",
+                "formatter": "json" if structured else "standard",
+                "filters": ["job"],
             },
             "file": {
                 "class": "logging.handlers.RotatingFileHandler",
@@ -27,7 +49,8 @@ def build_log_config(config: configparser.ConfigParser) -> dict:
                 "maxBytes": 10 * 1024 * 1024,  # 10 MB
                 "backupCount": 5,
                 "level": "DEBUG",
-                "formatter": "detailed",
+                "formatter": "json" if structured else "detailed",
+                "filters": ["job"],
                 "encoding": "utf-8",
             },
         },
@@ -38,4 +61,132 @@ def build_log_config(config: configparser.ConfigParser) -> dict:
                 "propagate": True,
             }
         },
-    }
\ No newline at end of file
+    }
+
+
+def start_logging(log_config: dict) -> logging.handlers.QueueListener | None:
+    """
+    Применяет конфиг и переносит обработчики корня за очередь: потоки воркера
+    только кладут запись в очередь, запись в файл и консоль — в одном потоке
+    QueueListener. Контекст задачи снимается ещё в потоке-источнике.
+    """
+    log_config = dict(log_config)
+    use_queue = log_config.pop("queue", True)
+    logging.config.dictConfig(log_config)
+    if not use_queue:
+        return None
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(JobContextFilter())
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # дописать хвост очереди при выходе
+    return listener
+
+
+def log_to_queue(records) -> None:
+    """В дочернем процессе: все записи уходят в очередь родителя (см. forward_logs)."""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = _QueueHandler(records)
+    handler.addFilter(JobContextFilter())
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+def forward_logs(records) -> logging.handlers.QueueListener:
+    """В родителе: записи дочерних процессов проходят через его логгеры и обработчики."""
+    listener = logging.handlers.QueueListener(records, _Forward())
+    listener.start()
+    return listener
+
+
+class _Forward(logging.Handler):
+    def handle(self, record: logging.LogRecord) -> bool:
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Как QueueHandler, но трассировка остаётся в exc_text, а не вклеивается
+    в сообщение, — JsonFormatter выводит её отдельным полем.
+    """
+
+    _formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self._formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# =========================================================
+# КОНТЕКСТ ЗАДАЧИ
+# =========================================================
+@contextmanager
+def job_context(**fields):
+    """Добавляет поля (record_id, bucket, stage) ко всем записям лога внутри блока."""
+    token = _job.set({**_job.get(), **fields})
+    try:
+        yield
+    finally:
+        _job.reset(token)
+
+
+def current_context() -> dict:
+    """Снимок контекста задачи — для передачи в процесс пула."""
+    return _job.get()
+
+
+class JobContextFilter(logging.Filter):
+    """
+    Переносит контекст задачи в атрибуты записи. Повторный вызов (уже в потоке
+    QueueListener, где контекста нет) сохраняет то, что записано источником.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "job"):
+            ctx = _job.get()
+            for key in CONTEXT_FIELDS:
+                setattr(record, key, ctx.get(key))
+            record.job = "".join(f" {key}={ctx[key]}" for key in CONTEXT_FIELDS if key in ctx)
+            if record.job:
+                record.job = f" [{record.job[1:]}]"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка: время, уровень, логгер, поток, контекст задачи."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts":     self.formatTime(record),
+            "level":  record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg":    record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
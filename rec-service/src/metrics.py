@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.log_config import job_context
+
+logger = logging.getLogger("worker.metrics")
+
+# Границы бакетов гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Ожидание в очереди proc_files: от секунд до часов
+WAIT_BUCKETS = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 21600.0)
+
+
+# =========================================================
+# ТИПЫ МЕТРИК
+# =========================================================
+class Counter:
+    """Счётчик с одной меткой."""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name, self.help, self.label = name, help_text, label
+        self._values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0.0) + amount
+
+    def values(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for value, count in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {count}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с одной меткой (например, stage)."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label = name, help_text, label
+        self.buckets = tuple(buckets)
+        self._series: dict[str, list] = {}  # label -> [counts по бакетам, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for value, (counts, total, n) in sorted(self._series.items()):
+                lbl = f'{self.label}="{_escape(value)}"'
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{lbl},le="{bound}"}} {c}')
+                lines.append(f'{self.name}_bucket{{{lbl},le="+Inf"}} {n}')
+                lines.append(f"{self.name}_sum{{{lbl}}} {total}")
+                lines.append(f"{self.name}_count{{{lbl}}} {n}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Метрика, значение которой читается в момент запроса (глубина очереди и т.п.).
+    С label функция возвращает словарь {значение метки: значение}.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, fn, label: str | None = None):
+        self.name, self.help, self.kind, self.fn, self.label = name, help_text, kind, fn, label
+
+    def render(self) -> list[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Метрика {self.name} недоступна: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.label is None:
+            lines.append(f"{self.name} {float(value)}")
+        else:
+            for key, v in sorted(value.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(key)}"}} {float(v)}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# =========================================================
+# РЕЕСТР
+# =========================================================
+_registry: list = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def register_callback(name: str, help_text: str, fn, kind: str = "gauge", label: str | None = None) -> None:
+    register(CallbackMetric(name, help_text, kind, fn, label))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "rec_stage_seconds", "Длительность этапов обработки документа", "stage",
+))
+OUTCOMES = register(Counter(
+    "rec_outcomes_total", "Итоги обработки документов по причинам", "reason",
+))
+OCR_TIER_RUNS = register(Counter(
+    "rec_ocr_tier_runs_total", "Прогоны уровней каскада OCR", "tier",
+))
+OCR_TIER_ESCALATIONS = register(Counter(
+    "rec_ocr_tier_escalations_total", "Прогоны уровня OCR без уверенного номера — переход на следующий", "tier",
+))
+BUCKET_WAIT = register(Histogram(
+    "rec_bucket_wait_seconds", "Ожидание задачи в proc_files до захвата, по бакетам (принтерам)",
+    "bucket", WAIT_BUCKETS,
+))
+
+
+# =========================================================
+# ЗАМЕР ЭТАПОВ
+# =========================================================
+_local = threading.local()
+
+
+def _stack() -> list[str]:
+    """Открытые этапы текущего потока, от внешнего к внутреннему."""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет длительность блока как этап name; записи лога внутри помечаются stage=name."""
+    start = time.perf_counter()
+    stack = _stack()
+    stack.append(name)
+    try:
+        with job_context(stage=name):
+            yield
+    finally:
+        stack.pop()
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    sink = getattr(_local, "sink", None)
+    if sink is not None:
+        if getattr(_local, "nested", False):
+            name = "/".join([*_stack(), name])
+        sink.append((name, seconds))
+    else:
+        STAGE_SECONDS.observe(name, seconds)
+
+
+@contextmanager
+def collect(nested: bool = False):
+    """
+    Собирает замеры этапов текущего потока в список вместо гистограмм.
+    Нужен в процессах пула: замеры возвращаются родителю вместе с результатом.
+    nested — имя этапа с путём объемлющих («ocr_full/segmentation»): время
+    вложенного этапа уже входит в родителя, складывать их нельзя.
+    """
+    samples: list[tuple[str, float]] = []
+    _local.sink = samples
+    _local.nested = nested
+    try:
+        yield samples
+    finally:
+        _local.sink = None
+        _local.nested = False
+
+
+def observe_ocr_tiers(tiers) -> None:
+    """Учитывает прогоны каскада OCR одного документа: все уровни, кроме последнего, — эскалации."""
+    for i, tier in enumerate(tiers):
+        OCR_TIER_RUNS.inc(tier)
+        if i < len(tiers) - 1:
+            OCR_TIER_ESCALATIONS.inc(tier)
+
+
+def escalation_ratio() -> dict[str, float]:
+    """Доля прогонов каждого уровня, ушедших на следующий."""
+    runs = OCR_TIER_RUNS.values()
+    escalated = OCR_TIER_ESCALATIONS.values()
+    return {tier: escalated.get(tier, 0.0) / n for tier, n in runs.items() if n}
+
+
+def replay(samples) -> None:
+    """Учитывает замеры, полученные из дочернего процесса (внутри collect — в его список)."""
+    for name, seconds in samples:
+        observe_stage(name, seconds)
+
+
+# =========================================================
+# HTTP-ЭНДПОИНТ
+# =========================================================
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # скрейпы Prometheus не пишем в лог
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Запускает /metrics в фоновом потоке."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsHTTP", daemon=True).start()
+    logger.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+    return server
@@ -1,24 +1,79 @@
+import logging
+import re
+
 import cv2
 import numpy as np
-import tensorflow as tf
-import fitz
-import os
-from src.config import MODEL_PATH
+from dataclasses import dataclass, field
+from src import metrics
+from src.config import MODEL_PATH, OCR_BACKEND, OCR_MIN_PROB, OCR_MODEL_FILE, OCR_TIERS
+from src.inference import create_backend
+from src.render import PageRenderCache
+
+logger = logging.getLogger("worker.ocr")
+
+
+@dataclass
+class PhoneResult:
+    """Результат распознавания: строка цифр и уверенность модели по каждой цифре."""
+    phone: str | None
+    probs: list[float] = field(default_factory=list)
+    tiers: list[str] = field(default_factory=list)  # уровни каскада, которые были запущены
+    error: str | None = None  # OCR не отработал (нет модели, PDF не читается, нет цифр) — не кэшировать
+
+    PHONE_RE = re.compile(r"[78]\d{10}")
+
+    @property
+    def min_prob(self) -> float:
+        return min(self.probs) if self.probs else 0.0
+
+    @property
+    def plausible(self) -> bool:
+        """Похоже на номер: 11 цифр, первая — 7 или 8."""
+        return bool(self.phone) and self.PHONE_RE.fullmatch(self.phone) is not None
+
+    def score(self) -> tuple[bool, float]:
+        return self.plausible, self.min_prob
 
 
 class PhoneOCR:
-    def __init__(self):
+    """
+    Распознавание телефона каскадом уровней (см. [ocr] tiers; по умолчанию — только full):
+      fast  — поле по геометрии QR в FAST_ZOOM, порог Оцу, один проход компонент;
+      full  — исходный конвейер: ZOOM, CLAHE, адаптивный порог, чистка мусора;
+      heavy — то же поле, что у full, с другими параметрами адаптивного порога.
+    Следующий уровень запускается, только если номер неправдоподобен или
+    уверенность какой-то цифры ниже min_prob; итог — лучший из прогонов.
+    """
+
+    ZOOM = 4.0  # масштаб рендера страницы для распознавания цифр
+    FAST_ZOOM = 2.0
+
+    # heavy: другие (blockSize, C) адаптивного порога — full уже пробовал (21, 10)
+    HEAVY_THRESHOLDS = ((15, 6), (31, 14), (41, 18))
+
+    # Больше компонент после порога — скан зашумлён: чистка мусора по маскам
+    # компонент вместо цикла по контурам (см. _segment_digits)
+    NOISY_COMPONENTS = 1000
+
+    # Поле телефона в сторонах QR от его левого верхнего угла (u0, v0, u1, v1).
+    # По generate-pdf/init.py: QR 25 мм в (9, 24) мм, трафарет 90×16 мм
+    # в (37, 44) мм → u 1.12–4.72, v 0.8–1.44; здесь — с запасом. Слева в
+    # трафарете напечатан «+» (u ≈ 1.2–1.3), клетки цифр — с u ≈ 1.45: левая
+    # граница между ними, иначе «+» читается лишней двенадцатой цифрой.
+    PHONE_ROI_QR = (1.36, 0.62, 4.8, 1.6)
+    QR_MASK_MARGIN = 0.04  # тихая зона вокруг QR, которую тоже закрашиваем
+
+    def __init__(self, backend: str = OCR_BACKEND, model_file: str | None = OCR_MODEL_FILE,
+                 tiers=OCR_TIERS, min_prob: float = OCR_MIN_PROB):
         self.model = None
+        self.tiers = tuple(tiers)
+        self.min_prob = min_prob
 
-        if os.path.exists(MODEL_PATH):
-            try:
-                self.model = tf.keras.models.load_model(MODEL_PATH)
-                print(f"[OK] Модель загружена: {MODEL_PATH}")
-                print(f"[INFO] Input shape: {self.model.input_shape}")
-            except Exception as e:
-                print(f"[ERROR] Ошибка загрузки модели: {e}")
-        else:
-            print(f"[ERROR] Модель не найдена: {MODEL_PATH}")
+        try:
+            self.model = create_backend(backend, MODEL_PATH, model_file)
+            logger.info(f"Модель загружена: бэкенд {backend}")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки модели ({backend}): {e}")
 
     # -------------------------
     # Угол наклона
@@ -38,32 +93,11 @@ class PhoneOCR:
         if lines is None:
             return 0
 
-        angles = []
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
-
-            if -15 < angle < 15:
-                angles.append(angle)
+        x1, y1, x2, y2 = lines[:, 0].T.astype(np.float64)
+        angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+        angles = angles[(angles > -15) & (angles < 15)]
 
-        return np.median(angles) if angles else 0
-
-    # -------------------------
-    # Pixmap → OpenCV
-    # -------------------------
-    def _pix_to_cv(self, pix):
-        n_channels = pix.n
-        img = np.frombuffer(pix.samples, dtype=np.uint8)
-        img = img.reshape(pix.h, pix.w, n_channels)
-
-        if n_channels == 4:
-            img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-        elif n_channels == 3:
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-        elif n_channels == 1:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-
-        return img
+        return float(np.median(angles)) if angles.size else 0
 
     # -------------------------
     # Удаление QR
@@ -134,33 +168,14 @@ class PhoneOCR:
         final[dy:dy + nh, dx:dx + nw] = resized
 
         final = final.astype("float32") / 255.0
-        final = final.reshape(1, 32, 32, 1)
+        final = final.reshape(32, 32, 1)
 
         return final
 
     # -------------------------
-    # Основной метод
+    # Выравнивание
     # -------------------------
-    def extract_phone(self, pdf_bytes):
-        if self.model is None:
-            print("[ERROR] Модель не загружена")
-            return None
-
-        try:
-            with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-                page = doc[0]
-
-                pix = page.get_pixmap(matrix=fitz.Matrix(4, 4))
-                img = self._pix_to_cv(pix)
-
-        except Exception as e:
-            print(f"[ERROR] PDF обработка: {e}")
-            return None
-
-        # grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # deskew
+    def _deskew(self, gray):
         angle = self._get_skew_angle(gray)
         h, w = gray.shape
 
@@ -173,30 +188,100 @@ class PhoneOCR:
             borderMode=cv2.BORDER_REPLICATE
         )
 
-        # ROI
-        y1, y2 = int(h * 0.05), int(h * 0.35)
-        x1, x2 = 0, int(w * 0.55)
-
-        roi = gray[y1:y2, x1:x2].copy()
-        roi_h, roi_w = roi.shape
-
-        # remove QR
-        roi = self._remove_qr(roi)
+        return gray
 
-        # enhance
-        clahe = cv2.createCLAHE(clipLimit=3.0)
-        enhanced = clahe.apply(roi)
+    # -------------------------
+    # ROI по геометрии QR
+    # -------------------------
+    @staticmethod
+    def _qr_frame(polygon, shape):
+        """
+        Система координат QR на странице: левый верхний угол (в ориентации
+        бланка), орты u (вправо по бланку), v (вниз по бланку), сторона в px.
+        Наклон — по рёбрам QR, поворот на 90/180/270° — по углу страницы,
+        в котором найден QR (на бланке он всегда в левом верхнем).
+        """
+        h, w = shape
+        pts = np.asarray(polygon, dtype=np.float64) * (w, h)
+        edges = np.roll(pts, -1, axis=0) - pts
+        side = float(np.linalg.norm(edges, axis=1).mean())
+
+        # Средний угол рёбер по модулю 90°
+        angles = np.arctan2(edges[:, 1], edges[:, 0])
+        theta = np.angle(np.exp(4j * angles).mean()) / 4
+        e_u = np.array([np.cos(theta), np.sin(theta)])
+        e_v = np.array([-np.sin(theta), np.cos(theta)])
+
+        center = pts.mean(axis=0)
+        right, bottom = center[0] >= w / 2, center[1] >= h / 2
+        turns = {(False, False): 0, (True, False): 1, (True, True): 2, (False, True): 3}[(right, bottom)]
+        for _ in range(turns):  # поворот на 90° по часовой (ось y вниз)
+            e_u, e_v = np.array([-e_u[1], e_u[0]]), np.array([-e_v[1], e_v[0]])
+
+        origin = center - side / 2 * (e_u + e_v)
+        return origin, e_u, e_v, side
+
+    def _anchored_roi(self, gray, polygon, scale=1.0):
+        """
+        Одна warpAffine: выравнивание, разворот и вырезка поля телефона
+        в координатах QR. Сам QR (если попал в ROI) закрашивается белым.
+        scale — во сколько раз ROI крупнее исходника (приведение к ZOOM).
+        """
+        origin, e_u, e_v, side = self._qr_frame(polygon, gray.shape)
+        u0, v0, u1, v1 = self.PHONE_ROI_QR
+
+        # Матрица ROI → страница (WARP_INVERSE_MAP)
+        M = np.empty((2, 3))
+        M[:, 0], M[:, 1] = e_u / scale, e_v / scale
+        M[:, 2] = origin + side * (u0 * e_u + v0 * e_v)
+        side *= scale
+
+        roi = cv2.warpAffine(
+            gray,
+            M,
+            (round((u1 - u0) * side), round((v1 - v0) * side)),
+            flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=255
+        )
 
-        thresh = cv2.adaptiveThreshold(
-            enhanced,
+        m = self.QR_MASK_MARGIN
+        cv2.rectangle(
+            roi,
+            (round((-m - u0) * side), round((-m - v0) * side)),
+            (round((1 + m - u0) * side), round((1 + m - v0) * side)),
             255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY_INV,
-            21,
-            10
+            -1
         )
+        return roi
+
+    # -------------------------
+    # ROI без геометрии QR (по всей странице)
+    # -------------------------
+    def _legacy_roi(self, gray):
+        h, w = gray.shape
 
-        # очистка мусора
+        y1, y2 = int(h * 0.05), int(h * 0.35)
+        x1, x2 = 0, int(w * 0.55)
+
+        roi = gray[y1:y2, x1:x2].copy()
+        return self._remove_qr(roi)
+
+    # -------------------------
+    # Сегментация: бинаризация ROI → кропы цифр
+    # -------------------------
+    @staticmethod
+    def _fill_holes(binary):
+        """
+        Маска «объект вместе с дырами»: всё, до чего нельзя дойти по фону
+        от края (фон — 4-связный, как у контуров findContours).
+        """
+        flood = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        cv2.floodFill(flood, None, (0, 0), 128, flags=4)
+        return flood[1:-1, 1:-1] != 128
+
+    def _digit_rects_contours(self, thresh, roi_h, y_range):
+        """Прежняя сегментация: чистка и поиск цифр циклом по контурам."""
         contours, _ = cv2.findContours(
             thresh,
             cv2.RETR_TREE,
@@ -223,12 +308,81 @@ class PhoneOCR:
         for c in contours:
             x, y, w, h = cv2.boundingRect(c)
 
-            if 40 < h < 180 and (roi_h * 0.2 < y < roi_h * 0.95):
+            if 40 < h < 180 and (roi_h * y_range[0] <= y < roi_h * y_range[1]):
                 rects.append((x, y, w, h))
 
-        rects = sorted(rects, key=lambda r: r[0])
+        return proc, sorted(rects, key=lambda r: r[0])
+
+    def _digit_rects_components(self, thresh, roi_h, y_range):
+        """
+        Сегментация зашумлённого скана без цикла по тысячам контуров.
+        Отличие от прежней: площадь — число пикселей, а не площадь контура.
+        """
+        # (Grana/BBDT — вдвое быстрее алгоритма по умолчанию при подсчёте статистики)
+        _, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+            thresh, 8, cv2.CV_32S, cv2.CCL_GRANA
+        )
+        w, h, area = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT], stats[:, cv2.CC_STAT_AREA]
+
+        rejected = (w > 150) | (area < 30) | (h < 20)
+        rejected[0] = False  # фон
+        if rejected.any():
+            # как drawContours с заливкой: стирается компонента вместе с тем, что внутри неё
+            mask = np.take(np.where(rejected, 255, 0).astype(np.uint8), labels)
+            thresh[self._fill_holes(mask)] = 0
+
+        # утолщение
+        proc = cv2.dilate(thresh, np.ones((2, 2), np.uint8), 1)
+
+        # поиск цифр: внешние области (как RETR_EXTERNAL — вложенное входит в объемлющее)
+        outer = self._fill_holes(proc).view(np.uint8)
+        _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+            outer, 8, cv2.CV_32S, cv2.CCL_GRANA
+        )
+        stats = stats[1:]
+        y, h = stats[:, cv2.CC_STAT_TOP], stats[:, cv2.CC_STAT_HEIGHT]
+
+        selected = (
+            (h > 40) & (h < 180)
+            & (y >= roi_h * y_range[0]) & (y < roi_h * y_range[1])
+        )
+        rects = stats[selected][:, :4]
+        return proc, rects[np.argsort(rects[:, 0], kind="stable")]
+
+    def _binarize(self, roi, block=21, c=10):
+        """Бинаризация поля телефона: CLAHE и адаптивный порог (цифры — белые)."""
+        # enhance
+        clahe = cv2.createCLAHE(clipLimit=3.0)
+        enhanced = clahe.apply(roi)
+
+        return cv2.adaptiveThreshold(
+            enhanced,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            block,
+            c
+        )
+
+    def _segment_digits(self, roi, y_range=(0.0, 1.0), block=21, c=10):
+        """
+        y_range — допустимое положение верха цифры в долях высоты ROI;
+        block, c — параметры адаптивного порога.
+        """
+        roi_h, roi_w = roi.shape
+        thresh = self._binarize(roi, block, c)
+
+        # очистка мусора и поиск цифр: на чистом скане — прежний цикл по
+        # контурам (он дешевле разметки и даёт эталонный результат), на
+        # зашумлённом — компоненты связности и маски NumPy. Число компонент
+        # без статистики — дешёвая (доли мс) оценка числа контуров.
+        n_components, _ = cv2.connectedComponentsWithAlgorithm(thresh, 8, cv2.CV_32S, cv2.CCL_GRANA)
+        if n_components <= self.NOISY_COMPONENTS:
+            proc, rects = self._digit_rects_contours(thresh, roi_h, y_range)
+        else:
+            proc, rects = self._digit_rects_components(thresh, roi_h, y_range)
 
-        result = ""
+        batch = []
 
         for (x, y, w, h) in rects:
             pad = 8
@@ -244,12 +398,163 @@ class PhoneOCR:
             if inp is None:
                 continue
 
-            pred = self.model.predict(inp, verbose=0)
-            digit_class = int(np.argmax(pred))
+            batch.append(inp)
+
+        return batch
+
+    def _segment_fast(self, roi, k):
+        """
+        Дешёвая сегментация уровня fast: глобальный порог Оцу вместо CLAHE
+        и адаптивного, один проход компонент связности без чистки мусора.
+        k — масштаб ROI относительно ZOOM (под него подогнаны пороги размеров).
+        """
+        _, thresh = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+            thresh, 8, cv2.CV_32S, cv2.CCL_GRANA
+        )
+        stats = stats[1:]
+        w, h, area = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT], stats[:, cv2.CC_STAT_AREA]
+
+        selected = (h > 40 * k) & (h < 180 * k) & (w < 150 * k) & (area >= 30 * k * k)
+        rects = stats[selected][:, :4]
+        rects = rects[np.argsort(rects[:, 0], kind="stable")]
+
+        roi_h, roi_w = roi.shape
+        pad = max(1, round(8 * k))
+        batch = []
+        for (x, y, w, h) in rects:
+            digit = thresh[max(0, y - pad):min(roi_h, y + h + pad), max(0, x - pad):min(roi_w, x + w + pad)]
+            inp = self._prepare_digit(digit)
+            if inp is not None:
+                batch.append(inp)
+        return batch
 
-            result += str(digit_class)
+    # -------------------------
+    # Уровни каскада
+    # -------------------------
+    def _view(self, pages, zoom):
+        """Первая страница и её фактический масштаб; None — PDF не читается."""
+        try:
+            return pages.view(0, zoom), pages.page_zoom(0, zoom)
+        except Exception as e:
+            logger.error(f"PDF обработка: {e}")
+            return None, None
+
+    def _full_roi(self, gray, zoom, qr_polygon):
+        """
+        Поле телефона в масштабе ZOOM и допустимое положение цифр.
+        Скан декодируется в родном разрешении (уменьшается, только если он
+        намного крупнее ZOOM), а фильтры сегментации рассчитаны на ZOOM —
+        масштаб приводится в той же warpAffine.
+        """
+        scale = self.ZOOM / zoom
+
+        if qr_polygon:
+            with metrics.stage("deskew"):
+                return self._anchored_roi(gray, qr_polygon, scale), (0.0, 1.0)
+
+        with metrics.stage("deskew"):
+            if abs(scale - 1.0) > 0.01:
+                gray = cv2.resize(
+                    gray,
+                    None,
+                    fx=scale,
+                    fy=scale,
+                    interpolation=cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA
+                )
+            gray = self._deskew(gray)
+            return self._legacy_roi(gray), (0.2, 0.95)
+
+    def _tier_fast(self, pages, qr_polygon) -> PhoneResult | None:
+        if not qr_polygon:
+            return None  # без геометрии QR дешёвого пути нет
+        gray, zoom = self._view(pages, self.FAST_ZOOM)
+        if gray is None:
+            return PhoneResult(None, error="RENDER_FAILED")
+        with metrics.stage("deskew"):
+            roi = self._anchored_roi(gray, qr_polygon, self.FAST_ZOOM / zoom)
+        with metrics.stage("segmentation"):
+            batch = self._segment_fast(roi, self.FAST_ZOOM / self.ZOOM)
+        return self._read(batch)
+
+    def _tier_full(self, pages, qr_polygon) -> PhoneResult:
+        gray, zoom = self._view(pages, self.ZOOM)
+        if gray is None:
+            return PhoneResult(None, error="RENDER_FAILED")
+        roi, y_range = self._full_roi(gray, zoom, qr_polygon)
+        with metrics.stage("segmentation"):
+            batch = self._segment_digits(roi, y_range)
+        return self._read(batch)
+
+    def _tier_heavy(self, pages, qr_polygon) -> PhoneResult:
+        gray, zoom = self._view(pages, self.ZOOM)
+        if gray is None:
+            return PhoneResult(None, error="RENDER_FAILED")
+        roi, y_range = self._full_roi(gray, zoom, qr_polygon)
+
+        best = None
+        for block, c in self.HEAVY_THRESHOLDS:
+            with metrics.stage("segmentation"):
+                batch = self._segment_digits(roi, y_range, block, c)
+            result = self._read(batch)
+            if best is None or result.score() > best.score():
+                best = result
+        return best
+
+    def _read(self, batch) -> PhoneResult:
+        """Все цифры — одним прогоном модели (N, 32, 32, 1)."""
+        if not batch:
+            return PhoneResult(None, error="NO_DIGITS")
+        with metrics.stage("digit_inference"):
+            preds = self.model.predict(np.stack(batch))
+        classes = preds.argmax(axis=1)
+
+        return PhoneResult(
+            phone="".join(str(int(c)) for c in classes),
+            probs=[float(p) for p in preds[np.arange(len(classes)), classes]],
+        )
 
-        if not result:
-            print("[WARN] Цифры не найдены")
+    def accepts(self, result: PhoneResult) -> bool:
+        """Результат уровня окончательный: номер правдоподобен и все цифры уверенные."""
+        return result.plausible and result.min_prob >= self.min_prob
 
-        return result if result else None
\ No newline at end of file
+    # -------------------------
+    # Основной метод
+    # -------------------------
+    def extract_phone(self, source, qr_polygon=None):
+        """
+        Распознаёт телефон на первой странице.
+        source — байты PDF или PageRenderCache, общий с QR-сканером.
+        qr_polygon — углы QR этой страницы в долях (из scan_pdf_qr): с ними
+        наклон, ориентация и поле телефона берутся из геометрии QR; без них —
+        поиск наклона по всей странице (Hough) и повторная детекция QR
+        (уровень fast в этом случае пропускается).
+        """
+        if self.model is None:
+            logger.error("Модель не загружена")
+            return PhoneResult(None, error="MODEL_NOT_LOADED")
+
+        if not isinstance(source, PageRenderCache):
+            with PageRenderCache(source, zoom=self.ZOOM) as pages:
+                return self.extract_phone(pages, qr_polygon)
+
+        best, tried, error = PhoneResult(None), [], None
+        for tier in self.tiers:
+            with metrics.stage(f"ocr_{tier}"):
+                result = getattr(self, f"_tier_{tier}")(source, qr_polygon)
+            if result is None:
+                continue
+            tried.append(tier)
+            error = error or result.error
+            if result.score() > best.score():
+                best = result
+            if self.accepts(result):
+                break
+
+        best.tiers = tried
+        if not best.phone:
+            best.error = best.error or error
+            logger.warning("Цифры не найдены")
+        elif len(tried) > 1:
+            logger.debug(f"OCR: уровни {tried}, итог {best.phone} (мин. уверенность {best.min_prob:.2f})")
+        return best
@@ -1,10 +1,17 @@
-import fitz
+import contextvars
 import hashlib
-import numpy as np
+import logging
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
 import cv2
-from PIL import Image
 from pyzbar.pyzbar import decode
-from src.config import QR_SECRET
+from src import metrics
+from src.config import QR_PAGE_WORKERS, QR_SECRET
+from src.render import PageRenderCache
+
+logger = logging.getLogger("worker.qr")
 
 
 def verify_md5(full_text, secret=QR_SECRET):
@@ -15,58 +22,149 @@ def verify_md5(full_text, secret=QR_SECRET):
     return expected == parts[1]
 
 
-def scan_pdf_qr(pdf_bytes):
-    # Открываем из памяти
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    detector = cv2.QRCodeDetector()
+class QRResult(NamedTuple):
+    """
+    Найденный QR. polygon — 4 угла в долях страницы (x, y) или None;
+    по нему OCR определяет наклон, ориентацию страницы и область телефона.
+    """
+    page: int      # номер страницы с 1
+    text: str
+    valid: bool    # подпись верна
+    polygon: list[tuple[float, float]] | None = None
+
+
+# Твои рабочие коэффициенты
+ROI_RATIO = 0.4
+FAST_DPI = 220
+FALLBACK_ZOOM = 3.5
+
+# Где искать QR: левый верхний угол, затем правый нижний (скан вверх ногами).
+# Перевёрнутый угол пробуется только на первой странице — иначе каждая
+# страница продолжения без QR стоила бы вдвое больше проходов
+ROI_CLIPS = (
+    (0.0, 0.0, ROI_RATIO, ROI_RATIO),
+    (1.0 - ROI_RATIO, 1.0 - ROI_RATIO, 1.0, 1.0),
+)
+
+
+def scan_pdf_qr(source, mode: str = "all"):
+    """
+    Ищет QR-коды в левом верхнем углу каждой страницы, на первой — и в правом
+    нижнем (скан вверх ногами), см. ROI_CLIPS.
+    source — байты PDF или уже открытый PageRenderCache (рендер общий с OCR).
+    mode: first — страницы по порядку до первой с верным QR (остальные не
+          рендерятся); all — все страницы по порядку; parallel — все страницы
+          многостраничного скана параллельно в общем пуле (см. _page_pool).
+    Возвращает список QRResult по порядку страниц (это кортежи: номер_страницы,
+    текст, подпись_верна, углы).
+    """
+    pages = source if isinstance(source, PageRenderCache) else PageRenderCache(source)
     all_results = []
 
-    # Твои рабочие коэффициенты
-    ROI_RATIO = 0.4
-    FAST_DPI = 220
-    FALLBACK_ZOOM = 3.5
-
-    for idx, page in enumerate(doc, start=1):
-        rect = page.rect
-
-        clip = fitz.Rect(
-            rect.x0,
-            rect.y0,
-            rect.x0 + rect.width * ROI_RATIO,
-            rect.y0 + rect.height * ROI_RATIO,
-        )
-
-        # --- ШАГ 1: FAST PASS (PyZbar) ---
-        pix = page.get_pixmap(dpi=FAST_DPI, clip=clip)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        decoded = decode(img)
-
-        found_on_page = False
-        if decoded:
-            for obj in decoded:
-                text = obj.data.decode("utf-8")
-                all_results.append((idx, text, verify_md5(text)))
-                found_on_page = True
-
-        if found_on_page:
-            continue  # Нашли — идем к следующей странице
-
-        # --- ШАГ 2: FALLBACK (OpenCV) ---
-        print(f"Fallback на странице {idx}")
-        mat = fitz.Matrix(FALLBACK_ZOOM, FALLBACK_ZOOM)
-        pix = page.get_pixmap(matrix=mat, clip=clip)
-
-        # Конвертация в BGR для OpenCV
-        img_np = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
-        if pix.n == 4:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_RGBA2BGR)
-        elif pix.n == 3:
-            img_np = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-
-        ok, infos, _, _ = detector.detectAndDecodeMulti(img_np)
+    try:
+        if mode == "parallel" and len(pages) > 1:
+            for found in _scan_parallel(pages):
+                all_results.extend(found)
+        else:
+            for idx in range(len(pages)):
+                found = _scan_page(pages, idx)
+                all_results.extend(found)
+                if mode == "first" and any(r.valid for r in found):
+                    break
+    finally:
+        if pages is not source:
+            pages.close()
+
+    return all_results
+
+
+def _scan_page(pages: PageRenderCache, idx: int) -> list[QRResult]:
+    clips = ROI_CLIPS if idx == 0 else ROI_CLIPS[:1]
+
+    # --- ШАГ 1: FAST PASS (PyZbar) ---
+    found = []
+    for clip in clips:
+        img = pages.view(idx, FAST_DPI / 72, clip)
+        with metrics.stage("qr_fast"):
+            decoded = decode(img)
+        for obj in decoded:
+            text = obj.data.decode("utf-8")
+            polygon = _to_page([(p.x, p.y) for p in obj.polygon], img.shape, clip)
+            found.append(QRResult(idx + 1, text, verify_md5(text), polygon))
+        if found:
+            return found
+
+    # --- ШАГ 2: FALLBACK (OpenCV) ---
+    logger.debug(f"Fallback на странице {idx + 1}")
+    detector = cv2.QRCodeDetector()
+    for clip in clips:
+        img = pages.view(idx, FALLBACK_ZOOM, clip)
+        with metrics.stage("qr_fallback"):
+            ok, infos, points, _ = detector.detectAndDecodeMulti(img)
         if ok:
-            for data in infos:
+            for data, pts in zip(infos, points):
                 if data:
-                    all_results.append((idx, data, verify_md5(data)))
+                    polygon = _to_page(pts.tolist(), img.shape, clip)
+                    found.append(QRResult(idx + 1, data, verify_md5(data), polygon))
+        if found:
+            break
+    return found
+
+
+# =========================================================
+# ПАРАЛЛЕЛЬНЫЙ РЕЖИМ
+# =========================================================
+# Один пул на процесс: сколько бы задач ни сканировалось разом, страниц
+# параллельно — не больше [qr] page_workers. pyzbar и OpenCV отпускают GIL;
+# растеризация MuPDF по-прежнему идёт по одной (лок документа).
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _page_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=QR_PAGE_WORKERS, thread_name_prefix="QRPage")
+        return _pool
+
+
+def _scan_parallel(pages: PageRenderCache) -> list[list[QRResult]]:
+    # Контекст лога задачи и замеры этапов — как если бы страницы сканировал вызывающий поток
+    futures = [
+        _page_pool().submit(contextvars.copy_context().run, _scan_collected, pages, idx)
+        for idx in range(len(pages))
+    ]
+    # Документ закрывает вызывающий, как только мы вернёмся или бросим
+    # исключение, — ни один поток пула не должен к тому времени читать страницы.
+    # При ошибке страницы ещё не начатые отменяются, начатые дожидаются.
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = next((future for future in done if future.exception() is not None), None)
+    if failed is not None:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise failed.exception()
+
+    per_page = []
+    for future in futures:
+        found, samples = future.result()
+        for name, seconds in samples:
+            metrics.observe_stage(name, seconds)
+        per_page.append(found)
+    return per_page
+
+
+def _scan_collected(pages: PageRenderCache, idx: int) -> tuple[list[QRResult], list]:
+    with metrics.collect() as samples:
+        found = _scan_page(pages, idx)
+    return found, samples
+
 
-    return all_results
\ No newline at end of file
+def _to_page(points, shape, clip) -> list[tuple[float, float]] | None:
+    """Пиксели вида (обрезанного по clip) → доли страницы."""
+    if len(points) != 4:
+        return None  # zbar иногда отдаёт лишние точки контура — геометрия ненадёжна
+    h, w = shape
+    x0, y0, x1, y1 = clip
+    return [(x0 + x / w * (x1 - x0), y0 + y / h * (y1 - y0)) for x, y in points]
@@ -1,72 +1,506 @@
+import hashlib
+
 import psycopg2
-from src.config import PROC_DONE, PROC_ERROR, TYPE_INIT, PROC_NEW
+from psycopg2.extras import Json
+from src.config import PROC_DONE, PROC_ERROR, TYPE_INIT, PROC_NEW, WORKER_ID
+
+
+class LeaseLost(Exception):
+    """
+    Запись больше не арендована этим воркером: аренда истекла и запись
+    захватил другой узел (или она уже обработана). Результат отбрасывается —
+    транзакция откатывается, запись дописывает её нынешний владелец.
+    """
+
+    def __init__(self, record_id: int):
+        super().__init__(f"аренда записи {record_id} потеряна")
+        self.record_id = record_id
+
+
+# =========================================================
+# СХЕМА
+# =========================================================
+
+# Аренда задач: воркер, захвативший запись, держит её до leased_until и
+# продлевает, пока задача в работе (LeaseKeeper). Истёкшая аренда (воркер упал)
+# позволяет другому воркеру забрать запись снова; итог пишет только владелец.
+_MIGRATE_LEASES = f"""
+ALTER TABLE proc_files
+    ADD COLUMN IF NOT EXISTS leased_until timestamptz,
+    ADD COLUMN IF NOT EXISTS leased_by    text;
+
+CREATE INDEX IF NOT EXISTS proc_files_pending_idx
+    ON proc_files (id) WHERE processed = {int(PROC_NEW)};
+"""
+
+
+# Справедливая выборка по принтерам: created_at — время регистрации файла
+# (ожидание в очереди по бакетам), индекс — захват самой старой задачи бакета.
+# Уже существующие строки получают время миграции.
+_MIGRATE_FAIR = f"""
+ALTER TABLE proc_files
+    ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS proc_files_pending_bucket_idx
+    ON proc_files (s3_bucket, id) WHERE processed = {int(PROC_NEW)};
+"""
+
+
+# Отложенные повторы после временных сбоев (S3, БД): запись остаётся новой,
+# но не захватывается до next_attempt_at.
+_MIGRATE_RETRIES = f"""
+ALTER TABLE proc_files
+    ADD COLUMN IF NOT EXISTS attempts        integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz,
+    ADD COLUMN IF NOT EXISTS last_error      text;
+
+CREATE INDEX IF NOT EXISTS proc_files_retry_idx
+    ON proc_files (next_attempt_at)
+    WHERE processed = {int(PROC_NEW)} AND next_attempt_at IS NOT NULL;
+"""
+
+# Подметание потерянных NOTIFY: самые старые необработанные записи
+_MIGRATE_SWEEP = f"""
+CREATE INDEX IF NOT EXISTS proc_files_pending_created_idx
+    ON proc_files (created_at) WHERE processed = {int(PROC_NEW)};
+"""
+
+# Пачки писем: письма из одного скана ссылаются на исходную запись
+# (одно письмо пачки — одна запись, даже если разбор пачки повторился)
+_MIGRATE_SPLIT = """
+ALTER TABLE proc_files
+    ADD COLUMN IF NOT EXISTS parent_id bigint;
+
+CREATE UNIQUE INDEX IF NOT EXISTS proc_files_parent_key_idx
+    ON proc_files (parent_id, s3_key) WHERE parent_id IS NOT NULL;
+"""
+
+# Запись свободна для захвата: не арендована и срок повтора наступил
+_FREE = """
+           AND (leased_until IS NULL OR leased_until < now())
+           AND (next_attempt_at IS NULL OR next_attempt_at <= now())"""
+
+
+# Пути записи результата — серверные функции: один вызов (один round trip)
+# на задачу вместо 4–5 отдельных запросов. Статусы передаются параметрами,
+# чтобы значения оставались в settings.ini.
+#
+# Итог пишет только владелец аренды: запись ещё новая и leased_by — этот
+# воркер. Проверка идёт первой, до писем и карантина; аренда снимается вместе
+# со статусом. Если запись уже не наша, функция ничего не меняет и сообщает
+# об этом (owned = false), а вызывающий откатывает транзакцию (LeaseLost).
+_CREATE_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION rec_create_init_letter(
+    p_record_id proc_files.id%TYPE,
+    p_blank_id  init_blanks.id%TYPE,
+    p_stor_url  letters.stor_url%TYPE,
+    p_phone     users.phone%TYPE,
+    p_type_init letters.letter_type_id%TYPE,
+    p_new       proc_files.processed%TYPE,
+    p_done      proc_files.processed%TYPE,
+    p_worker    proc_files.leased_by%TYPE,
+    OUT o_owned     boolean,
+    OUT o_letter_id letters.id%TYPE
+)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_user_id users.id%TYPE;
+BEGIN
+    -- Запись блокируется до конца транзакции: захватить её заново никто не сможет
+    PERFORM 1 FROM proc_files
+      WHERE id = p_record_id AND processed = p_new AND leased_by = p_worker
+        FOR UPDATE;
+    o_owned := FOUND;
+    IF NOT o_owned THEN
+        RETURN;
+    END IF;
+
+    -- Атомарный резерв: строка блокируется до конца транзакции
+    UPDATE init_blanks SET used = 1
+     WHERE id = p_blank_id AND used IS DISTINCT FROM 1;
+    IF NOT FOUND THEN
+        RETURN;  -- бланк занят или не существует: o_letter_id = NULL
+    END IF;
+
+    INSERT INTO users (phone) VALUES (p_phone)
+    ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
+    RETURNING id INTO v_user_id;
+
+    INSERT INTO letters (stor_url, letter_type_id, user_id)
+    VALUES (p_stor_url, p_type_init, v_user_id)
+    RETURNING id INTO o_letter_id;
+
+    UPDATE proc_files SET processed = p_done, leased_until = NULL, leased_by = NULL
+     WHERE id = p_record_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION rec_save_answer(
+    p_record_id proc_files.id%TYPE,
+    p_letter_id letters.id%TYPE,
+    p_stor_url  letters.answer_stor_url%TYPE,
+    p_new       proc_files.processed%TYPE,
+    p_done      proc_files.processed%TYPE,
+    p_worker    proc_files.leased_by%TYPE
+) RETURNS boolean
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE proc_files SET processed = p_done, leased_until = NULL, leased_by = NULL
+     WHERE id = p_record_id AND processed = p_new AND leased_by = p_worker;
+    IF NOT FOUND THEN
+        RETURN false;
+    END IF;
+    UPDATE letters SET answer_stor_url = p_stor_url WHERE id = p_letter_id;
+    RETURN true;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION rec_save_error(
+    p_record_id proc_files.id%TYPE,
+    p_stor_url  unknown_letters.stor_url%TYPE,
+    p_qr_text   unknown_letters.raw_qr_text%TYPE,
+    p_reason    unknown_letters.error_message%TYPE,
+    p_new       proc_files.processed%TYPE,
+    p_error     proc_files.processed%TYPE,
+    p_worker    proc_files.leased_by%TYPE
+) RETURNS boolean
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE proc_files SET processed = p_error, leased_until = NULL, leased_by = NULL
+     WHERE id = p_record_id AND processed = p_new AND leased_by = p_worker;
+    IF NOT FOUND THEN
+        RETURN false;
+    END IF;
+    INSERT INTO unknown_letters (stor_url, raw_qr_text, error_message)
+    VALUES (p_stor_url, p_qr_text, p_reason);
+    RETURN true;
+END;
+$$;
+"""
+
+
+# Кэш результатов распознавания по содержимому файла. model_version меняется
+# вместе с моделью/конвейером — старые записи просто перестают находиться.
+_CREATE_RESULT_CACHE = """
+CREATE TABLE IF NOT EXISTS doc_results (
+    sha256        text        NOT NULL,
+    model_version text        NOT NULL,
+    result        jsonb       NOT NULL,
+    created_at    timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (sha256, model_version)
+);
+"""
+
+
+_MIGRATIONS = (
+    _MIGRATE_LEASES, _MIGRATE_FAIR, _MIGRATE_RETRIES, _MIGRATE_SWEEP,
+    _MIGRATE_SPLIT, _CREATE_FUNCTIONS, _CREATE_RESULT_CACHE,
+)
+
+# Версия схемы — хэш текста миграций: меняется вместе с любой из них
+SCHEMA_VERSION = hashlib.sha256("".join(_MIGRATIONS).encode()).hexdigest()[:16]
+
+# Ключ pg_advisory_xact_lock: узлы, стартующие разом, мигрируют по очереди
+_SCHEMA_LOCK = 0x7265635F736368  # "rec_sch"
+
+
+def ensure_schema(cur) -> None:
+    """
+    Идемпотентная миграция колонок, индексов и серверных функций, нужных воркеру.
+    Идёт под advisory-локом (CREATE OR REPLACE FUNCTION при одновременном
+    старте узлов падает с «tuple concurrently updated») и пропускается, если
+    схема уже этой версии, — ALTER TABLE не берёт ACCESS EXCLUSIVE на
+    proc_files при каждом старте. Вызывать в транзакции: лок снимает COMMIT.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (_SCHEMA_LOCK,))
+    cur.execute("SELECT to_regclass('rec_schema') IS NOT NULL")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT version FROM rec_schema")
+        row = cur.fetchone()
+        if row and row[0] == SCHEMA_VERSION:
+            return
+    else:
+        cur.execute("CREATE TABLE rec_schema (version text NOT NULL)")
+
+    for ddl in _MIGRATIONS:
+        cur.execute(ddl)
+    cur.execute("DELETE FROM rec_schema")
+    cur.execute("INSERT INTO rec_schema (version) VALUES (%s)", (SCHEMA_VERSION,))
+
+
+# =========================================================
+# ОЧЕРЕДЬ
+# =========================================================
+
+_CLAIM_SQL = """
+UPDATE proc_files
+   SET leased_until = now() + make_interval(secs => %(lease)s),
+       leased_by    = %(worker)s
+ WHERE id = (
+        SELECT id FROM proc_files
+         WHERE processed = %(new)s""" + _FREE + """
+           {filter}
+         ORDER BY id
+         LIMIT 1
+           FOR UPDATE SKIP LOCKED
+       )
+RETURNING id, s3_key, s3_bucket,
+          extract(epoch FROM now() - created_at)::float8
+"""
+
+
+def claim_task(cur, worker_id: str, lease_sec: int, record_id: int | None = None,
+               bucket: str | None = None) -> tuple[int, str, str, float] | None:
+    """
+    Захватывает задачу под аренду и возвращает (id, s3_key, s3_bucket, ждала_сек) или None.
+
+    record_id — подсказка из NOTIFY; bucket — взять самую старую задачу этого бакета;
+    без них берётся самая старая свободная запись.
+    Строки, заблокированные или арендованные другими воркерами, пропускаются,
+    поэтому очередь безопасно делят несколько узлов. Вызывать в отдельной
+    транзакции: аренда должна стать видна остальным сразу после COMMIT.
+    """
+    params = {"lease": lease_sec, "worker": worker_id, "new": PROC_NEW, "id": record_id, "bucket": bucket}
+    sql_filter = ""
+    if record_id is not None:
+        sql_filter += "AND id = %(id)s"
+    if bucket is not None:
+        sql_filter += " AND s3_bucket = %(bucket)s"
+    cur.execute(_CLAIM_SQL.format(filter=sql_filter), params)
+    return cur.fetchone()
+
+
+def pending_by_bucket(cur) -> dict[str, int]:
+    """Число свободных задач по бакетам (принтерам)."""
+    cur.execute(
+        """
+        SELECT s3_bucket, count(*) FROM proc_files
+         WHERE processed = %s""" + _FREE + """
+         GROUP BY s3_bucket
+        """,
+        (PROC_NEW,),
+    )
+    return {bucket: n for bucket, n in cur.fetchall() if bucket}
+
+
+def renew_leases(cur, worker_id: str, record_ids: list[int], lease_sec: int) -> list[int]:
+    """
+    Продлевает аренду задач, которые этот воркер ещё обрабатывает.
+    Возвращает ID, аренда которых продлена; остальные уже не наши.
+    """
+    cur.execute(
+        """
+        UPDATE proc_files
+           SET leased_until = now() + make_interval(secs => %(lease)s)
+         WHERE id = ANY(%(ids)s) AND processed = %(new)s AND leased_by = %(worker)s
+        RETURNING id
+        """,
+        {"ids": list(record_ids), "lease": lease_sec, "new": PROC_NEW, "worker": worker_id},
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def defer_task(cur, record_id: int, delay_sec: int) -> None:
+    """Возвращает задачу в очередь: свободна для захвата через delay_sec."""
+    cur.execute(
+        """
+        UPDATE proc_files
+           SET leased_until = now() + make_interval(secs => %s),
+               leased_by    = NULL
+         WHERE id = %s AND processed = %s AND leased_by = %s
+        """,
+        (delay_sec, record_id, PROC_NEW, WORKER_ID),
+    )
+    if cur.rowcount == 0:
+        raise LeaseLost(record_id)
+
+
+def schedule_retry(cur, record_id: int, error: str, max_attempts: int,
+                   base_delay_sec: float, max_delay_sec: float) -> int | None:
+    """
+    Откладывает задачу после временного сбоя: аренда снимается, повтор —
+    не раньше next_attempt_at (экспоненциально, с разбросом ±20%).
+    Возвращает номер попытки или None, если попытки исчерпаны.
+    """
+    cur.execute(
+        """
+        UPDATE proc_files
+           SET attempts        = attempts + 1,
+               next_attempt_at = now() + make_interval(secs =>
+                   least(%(base)s * power(2, attempts), %(cap)s) * (0.8 + random() * 0.4)),
+               last_error      = %(error)s,
+               leased_until    = NULL,
+               leased_by       = NULL
+         WHERE id = %(id)s AND attempts + 1 < %(max)s
+           AND processed = %(new)s AND leased_by = %(worker)s
+        RETURNING attempts
+        """,
+        {"id": record_id, "error": error, "max": max_attempts,
+         "base": base_delay_sec, "cap": max_delay_sec, "new": PROC_NEW, "worker": WORKER_ID},
+    )
+    row = cur.fetchone()
+    if row is None:
+        _check_lease(cur, record_id)  # попытки исчерпаны или запись уже не наша
+        return None
+    return row[0]
+
+
+def split_task(cur, record_id: int, s3_keys: list[str]) -> list[int]:
+    """
+    Пачка писем: на каждый файл письма — новая запись proc_files в бакете
+    исходной и NOTIFY (уходит после COMMIT), исходная запись — обработана,
+    аренда снята. Пишет только владелец аренды: исходная запись блокируется
+    и должна быть ещё новой, иначе LeaseLost. Повтор после сбоя не плодит
+    дублей — письма уникальны по (parent_id, s3_key).
+    Возвращает ID новых записей.
+    """
+    cur.execute(
+        "SELECT 1 FROM proc_files WHERE id = %s AND processed = %s AND leased_by = %s FOR UPDATE",
+        (record_id, PROC_NEW, WORKER_ID),
+    )
+    if cur.fetchone() is None:
+        raise LeaseLost(record_id)
+
+    cur.execute(
+        """
+        WITH parts AS (
+            INSERT INTO proc_files (processed, s3_key, s3_bucket, parent_id)
+            SELECT %(new)s, part.key, p.s3_bucket, p.id
+              FROM proc_files p, unnest(%(keys)s::text[]) WITH ORDINALITY AS part(key, n)
+             WHERE p.id = %(id)s
+             ORDER BY part.n
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        ), parent AS (
+            UPDATE proc_files SET processed = %(done)s, leased_until = NULL, leased_by = NULL
+             WHERE id = %(id)s AND processed = %(new)s AND leased_by = %(worker)s
+        )
+        SELECT id, pg_notify('new_scan', id::text) FROM parts ORDER BY id
+        """,
+        {"id": record_id, "keys": s3_keys, "new": PROC_NEW, "done": PROC_DONE, "worker": WORKER_ID},
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def get_due_retries(cur, limit: int) -> list[int]:
+    """ID отложенных задач, срок повтора которых наступил."""
+    cur.execute(
+        """
+        SELECT id FROM proc_files
+         WHERE processed = %s
+           AND next_attempt_at IS NOT NULL""" + _FREE + """
+         ORDER BY next_attempt_at
+         LIMIT %s
+        """,
+        (PROC_NEW, limit),
+    )
+    return [row[0] for row in cur.fetchall()]
 
 
 # =========================================================
 # ВСПОМОГАТЕЛЬНЫЕ
 # =========================================================
 
+def _check_lease(cur, record_id: int) -> None:
+    """Бросает LeaseLost, если запись уже не арендована этим воркером."""
+    cur.execute(
+        "SELECT 1 FROM proc_files WHERE id = %s AND processed = %s AND leased_by = %s",
+        (record_id, PROC_NEW, WORKER_ID),
+    )
+    if cur.fetchone() is None:
+        raise LeaseLost(record_id)
+
+
 def update_proc_status(cur, record_id: int, status: int) -> None:
-    """Обновляет статус обработки файла."""
+    """Проставляет итоговый статус файла и снимает аренду (только владельцем аренды)."""
     try:
         cur.execute(
-            "UPDATE proc_files SET processed = %s WHERE id = %s",
-            (status, record_id),
+            """
+            UPDATE proc_files SET processed = %s, leased_until = NULL, leased_by = NULL
+             WHERE id = %s AND processed = %s AND leased_by = %s
+            """,
+            (status, record_id, PROC_NEW, WORKER_ID),
         )
     except psycopg2.Error as e:
         raise RuntimeError(f"SQL Status Update Error: {e.pgcode}") from e
+    if cur.rowcount == 0:
+        raise LeaseLost(record_id)
 
-def get_bucket_name(cur, record_id: int) -> str | None:
-    """Возвращает stor_url по ID записи, или None если не найдена."""
-    cur.execute("SELECT s3_bucket FROM proc_files WHERE id = %s", (record_id,))
-    row = cur.fetchone()
-    return row[0] if row else None
 
-def get_file_info(cur, record_id: int) -> str | None:
-    """Возвращает stor_url по ID записи, или None если не найдена."""
-    cur.execute("SELECT s3_key FROM proc_files WHERE id = %s", (record_id,))
-    row = cur.fetchone()
-    return row[0] if row else None
+def iter_pending_tasks(cur, after_id: int, limit: int, itersize: int = 100):
+    """
+    ID свободных необработанных записей после after_id (keyset, по индексу
+    proc_files_pending_idx), не больше limit. Строки читаются серверным курсором
+    порциями по itersize: прерванный перебор не тянет остаток страницы.
+    Итерировать внутри транзакции cur.
+    """
+    with cur.connection.cursor(name="rec_pending_scan") as scan:
+        scan.itersize = itersize
+        scan.execute(
+            """
+            SELECT id FROM proc_files
+             WHERE processed = %s AND id > %s""" + _FREE + """
+             ORDER BY id
+             LIMIT %s
+            """,
+            (PROC_NEW, after_id, limit),
+        )
+        for row in scan:
+            yield row[0]
 
 
-def get_pending_tasks(cur) -> list[int]:
-    """Возвращает ID записей, которые ещё не обработаны."""
-    cur.execute("SELECT id FROM proc_files WHERE processed = %s", (PROC_NEW,))
+def get_stale_tasks(cur, min_age_sec: float, limit: int, exclude=()) -> list[int]:
+    """
+    ID свободных необработанных записей старше min_age_sec, самые старые первыми.
+    exclude — ID, уже стоящие в очереди воркера (они ещё не захвачены и выглядят свободными).
+    """
+    cur.execute(
+        """
+        SELECT id FROM proc_files
+         WHERE processed = %s
+           AND created_at < now() - make_interval(secs => %s)
+           AND id <> ALL(%s::bigint[])""" + _FREE + """
+         ORDER BY created_at
+         LIMIT %s
+        """,
+        (PROC_NEW, min_age_sec, list(exclude), limit),
+    )
     return [row[0] for row in cur.fetchall()]
 
 
 # =========================================================
-# ПОЛЬЗОВАТЕЛИ
+# КЭШ РЕЗУЛЬТАТОВ
 # =========================================================
 
-def get_or_create_user(cur, phone: str) -> int:
-    """UPSERT пользователя по номеру телефона, возвращает его ID."""
+def get_cached_result(cur, sha256: str, model_version: str) -> dict | None:
+    cur.execute(
+        "SELECT result FROM doc_results WHERE sha256 = %s AND model_version = %s",
+        (sha256, model_version),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_cached_result(cur, sha256: str, model_version: str, result: dict) -> None:
     cur.execute(
         """
-        INSERT INTO users (phone) VALUES (%s)
-        ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
-        RETURNING id
+        INSERT INTO doc_results (sha256, model_version, result)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (sha256, model_version) DO NOTHING
         """,
-        (phone,),
+        (sha256, model_version, Json(result)),
     )
-    return cur.fetchone()[0]
 
 
 # =========================================================
 # БЛАНКИ
 # =========================================================
 
-def reserve_blank(cur, blank_id: int) -> bool:
-    """Атомарно резервирует бланк через SELECT FOR UPDATE. Возвращает False если занят."""
-    cur.execute(
-        "SELECT used FROM init_blanks WHERE id = %s FOR UPDATE",
-        (blank_id,),
-    )
+def is_blank_available(cur, blank_id: int) -> bool:
+    """Дешёвая проверка без блокировки: бланк существует и ещё не использован."""
+    cur.execute("SELECT used FROM init_blanks WHERE id = %s", (blank_id,))
     row = cur.fetchone()
-    if not row or row[0] == 1:
-        return False
-    cur.execute("UPDATE init_blanks SET used = 1 WHERE id = %s", (blank_id,))
-    return True
+    return bool(row) and row[0] != 1
 
 
 # =========================================================
@@ -75,43 +509,37 @@ def reserve_blank(cur, blank_id: int) -> bool:
 
 def create_init_letter(cur, record_id: int, blank_id: int, stor_url: str, phone: str) -> tuple[bool, str | int]:
     """
-    Создаёт инициативное письмо.
+    Создаёт инициативное письмо одним вызовом rec_create_init_letter
+    (проверка аренды, резерв бланка, UPSERT пользователя, письмо, статус файла).
     Возвращает (True, new_letter_id) или (False, причина_ошибки).
     """
-    if not reserve_blank(cur, blank_id):
-        return False, "BLANK_ALREADY_USED"
-
-    user_id = get_or_create_user(cur, phone)
-
     cur.execute(
-        """
-        INSERT INTO letters (stor_url, letter_type_id, user_id)
-        VALUES (%s, %s, %s)
-        RETURNING id
-        """,
-        (stor_url, TYPE_INIT, user_id),
+        "SELECT * FROM rec_create_init_letter(%s, %s, %s, %s, %s, %s, %s, %s)",
+        (record_id, blank_id, stor_url, phone, TYPE_INIT, PROC_NEW, PROC_DONE, WORKER_ID),
     )
-    new_id = cur.fetchone()[0]
-    update_proc_status(cur, record_id, PROC_DONE)
+    owned, new_id = cur.fetchone()
+    if not owned:
+        raise LeaseLost(record_id)
+    if new_id is None:
+        return False, "BLANK_ALREADY_USED"
     return True, new_id
 
 
 def update_as_answer(cur, record_id: int, letter_id: int, stor_url: str) -> None:
     """Привязывает скан как ответ к существующему письму."""
     cur.execute(
-        "UPDATE letters SET answer_stor_url = %s WHERE id = %s",
-        (stor_url, letter_id),
+        "SELECT rec_save_answer(%s, %s, %s, %s, %s, %s)",
+        (record_id, letter_id, stor_url, PROC_NEW, PROC_DONE, WORKER_ID),
     )
-    update_proc_status(cur, record_id, PROC_DONE)
+    if not cur.fetchone()[0]:
+        raise LeaseLost(record_id)
 
 
 def mark_as_error(cur, record_id: int, stor_url: str, reason: str, qr_text: str | None = None) -> None:
     """Помещает файл в карантин и проставляет статус ошибки."""
     cur.execute(
-        """
-        INSERT INTO unknown_letters (stor_url, raw_qr_text, error_message)
-        VALUES (%s, %s, %s)
-        """,
-        (stor_url, qr_text, reason),
+        "SELECT rec_save_error(%s, %s, %s, %s, %s, %s, %s)",
+        (record_id, stor_url, qr_text, reason, PROC_NEW, PROC_ERROR, WORKER_ID),
     )
-    update_proc_status(cur, record_id, PROC_ERROR)
\ No newline at end of file
+    if not cur.fetchone()[0]:
+        raise LeaseLost(record_id)
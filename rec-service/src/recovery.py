@@ -0,0 +1,134 @@
+import logging
+import threading
+from contextlib import closing
+
+import src.queries as queries
+
+logger = logging.getLogger("worker.recovery")
+
+
+class Recovery:
+    """
+    Дообработка задач, накопившихся до старта воркера, — постранично
+    (keyset по id) и только в свободные места очереди. Шаги вызываются
+    из LISTEN-цикла между уведомлениями, поэтому новые сканы не ждут,
+    пока разберётся весь хвост.
+    """
+
+    def __init__(self, session_factory, admission, batch: int = 500):
+        self.session = session_factory  # контекстный менеджер, выдающий курсор
+        self.admission = admission
+        self.batch = batch
+
+        self.last_id = 0
+        self.offered = 0
+        self.done = False
+
+    def step(self) -> None:
+        """Ставит в очередь следующую порцию, если в ней есть место."""
+        if self.done or not self.admission.has_capacity(bulk=True):
+            return
+
+        seen = 0
+        with self.session() as cur, \
+                closing(queries.iter_pending_tasks(cur, self.last_id, self.batch)) as pending:
+            for record_id in pending:
+                seen += 1
+                if not self.admission.offer(record_id, bulk=True) and not self.admission.has_capacity(bulk=True):
+                    return  # места нет — продолжим с этой записи на следующем шаге
+                self.last_id = record_id
+                self.offered += 1
+
+        if seen < self.batch:
+            self.done = True
+            logger.info(f"Дообработка очереди завершена: поставлено {self.offered} задач.")
+
+
+class Sweeper:
+    """
+    Подметание записей, о которых воркер не узнал: NOTIFY потерян, пока
+    LISTEN-соединение переподключалось. Раз в интервал берёт не больше
+    max_per_sweep свободных записей старше min_age_sec (и не больше свободных
+    мест очереди). Худшая задержка скана — min_age_sec + интервал подметания.
+    Пока идёт дообработка (recovery), подметание не запускается: хвост до
+    старта и так разбирается постранично, а записи, уже стоящие в очереди,
+    из выборки исключаются.
+    """
+
+    def __init__(self, session_factory, admission, recovery=None,
+                 min_age_sec: float = 60.0, max_per_sweep: int = 100):
+        self.session = session_factory
+        self.admission = admission
+        self.recovery = recovery
+        self.min_age_sec = min_age_sec
+        self.max_per_sweep = max_per_sweep
+
+        self.found = 0
+
+    def sweep(self) -> None:
+        if self.recovery is not None and not self.recovery.done:
+            return
+        limit = min(self.max_per_sweep, self.admission.free_slots(bulk=True))
+        if limit <= 0:
+            return  # очередь полна или приём на паузе — добор и так идёт из БД
+        with self.session() as cur:
+            stale = queries.get_stale_tasks(cur, self.min_age_sec, limit, self.admission.queued_ids())
+        if not stale:
+            return
+
+        offered = 0
+        for record_id in stale:
+            if self.admission.offer(record_id, bulk=True):
+                offered += 1
+            elif not self.admission.has_capacity(bulk=True):
+                break
+        if not offered:
+            return
+
+        self.found += offered
+        logger.warning(f"Подметание: {offered} задач старше {self.min_age_sec:.0f}с "
+                       f"без обработки (с ID {stale[0]}), поставлены в очередь.")
+
+
+class LeaseKeeper:
+    """
+    Продление аренды задач, которые ещё в работе: задача может ждать в
+    очереди полосы OCR и проходить весь каскад дольше lease_sec. Пока воркер
+    жив, раз в interval (треть аренды) leased_until сдвигается вперёд; упал —
+    аренда истекает, и запись забирает другой узел.
+    """
+
+    def __init__(self, session_factory, worker_id: str, lease_sec: int):
+        self.session = session_factory
+        self.worker_id = worker_id
+        self.lease_sec = lease_sec
+        self.interval = max(1.0, lease_sec / 3)
+
+        self._held: set[int] = set()
+        self._lock = threading.Lock()
+        self.lost = 0
+
+    def hold(self, record_id: int) -> None:
+        with self._lock:
+            self._held.add(record_id)
+
+    def release(self, record_id: int) -> None:
+        with self._lock:
+            self._held.discard(record_id)
+
+    def renew(self) -> None:
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
+        with self.session() as cur:
+            renewed = set(queries.renew_leases(cur, self.worker_id, held, self.lease_sec))
+
+        with self._lock:  # завершённые за это время задачи потерянными не считаются
+            lost = [record_id for record_id in held if record_id not in renewed and record_id in self._held]
+            self._held.difference_update(lost)
+            self.lost += len(lost)
+        if lost:
+            # Результат таких задач отбросит проверка аренды при записи
+            logger.warning(f"Аренда потеряна ({len(lost)} задач, ID {lost[:10]}): "
+                           f"запись уже не наша, итог будет отброшен.")
@@ -0,0 +1,332 @@
+import re
+import threading
+
+import cv2
+import fitz
+import numpy as np
+
+from src import metrics
+
+
+# Максимальный масштаб, который нужен этапам обработки (OCR телефона — 4x)
+MAX_ZOOM = 4.0
+
+FULL_PAGE = (0.0, 0.0, 1.0, 1.0)
+
+
+# Уменьшенное декодирование JPEG (libjpeg масштабирует DCT — почти даром).
+# EXIF-ориентацию не применяем: PDF (и fitz) рисуют пиксели как есть, иначе
+# снимок с телефона повернётся относительно геометрии страницы и рамок.
+_REDUCED_FLAGS = {
+    factor: flag | cv2.IMREAD_IGNORE_ORIENTATION
+    for factor, flag in {
+        1: cv2.IMREAD_GRAYSCALE,
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }.items()
+}
+
+# Для страниц-изображений запрошенный zoom — ориентир: берётся самое дешёвое
+# уменьшение, дающее не меньше этой доли от него (QR читается и так)
+REDUCED_TOLERANCE = 0.65
+
+# Допуск совпадения рамки изображения с рамкой страницы, пункты
+_BBOX_TOLERANCE = 1.0
+
+# Content stream страницы-скана: «q a b c d e f cm /Im Do Q», без других операторов
+_NUM = rb"[-+]?(?:\d+\.?\d*|\.\d+)"
+_SINGLE_IMAGE_RE = re.compile(
+    rb"\s*(?:q\s+)*(?P<cm>(?:" + _NUM + rb"\s+){6})cm\s*/(?P<name>[^\s/]+)\s*Do\s*(?:Q\s*)*"
+)
+
+
+class PageRenderCache:
+    """
+    Кэш растеризации одного документа.
+
+    PDF открывается один раз. Каждый вид рендерится в grayscale в том масштабе,
+    который запросил этап: углы для QR — в своём (220 DPI), а не в масштабе OCR.
+    Целиком страница растеризуется, только когда её просят целиком (OCR), и
+    только для keep_pages — такой рендер кэшируется, и следующие виды этой
+    страницы (уровни каскада OCR) вырезаются и уменьшаются из него. Остальные
+    страницы (многостраничные пакеты, где нужен лишь QR) держат в памяти
+    только последний отрендеренный фрагмент (свой у каждого потока).
+
+    Страницы, целиком состоящие из одного скана (JPEG, CCITT и т.п. на всю
+    страницу), не растеризуются: встроенное изображение декодируется
+    напрямую, для QR — с уменьшением, для OCR — в родном разрешении.
+
+    Готовые виды keep_pages можно передать в другой процесс: export_views()
+    там, где они получены, и views= при открытии того же PDF.
+    """
+
+    def __init__(self, pdf_bytes: bytes, zoom: float = MAX_ZOOM, keep_pages=(0,), use_images: bool = True,
+                 views: dict | None = None):
+        self.doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        self.zoom = zoom
+        self.keep_pages = set(keep_pages)
+        self.use_images = use_images
+
+        self._pages: dict[int, dict[float, np.ndarray]] = {}  # страница → {масштаб: полный рендер}
+        # Последний фрагмент — свой у каждого потока: страницы сканируются параллельно
+        self._last_region: dict[int, tuple[tuple, np.ndarray]] = {}
+        self._images: dict[int, _PageImage | None] = {}
+        self._lock = threading.Lock()  # MuPDF-документ не потокобезопасен
+
+        views = views or {}
+        for idx, renders in views.get("pages", {}).items():
+            self._pages[idx] = dict(renders)
+        self._seeded_images: dict[int, dict] = dict(views.get("images", {}))
+
+    def __len__(self) -> int:
+        return self.doc.page_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._pages.clear()
+        self._last_region.clear()
+        self._images.clear()
+        self.doc.close()
+
+    # -------------------------
+    # Публичный API
+    # -------------------------
+    def view(self, idx: int, zoom: float | None = None, clip: tuple = FULL_PAGE) -> np.ndarray:
+        """
+        Возвращает grayscale-вид страницы idx (с 0).
+
+        zoom — масштаб относительно 72 DPI (не больше self.zoom),
+        clip — область в долях страницы (x0, y0, x1, y1).
+        Для страниц-изображений масштаб может оказаться ниже zoom: уменьшенное
+        декодирование берётся, только пока оно не ниже REDUCED_TOLERANCE от zoom,
+        но скан с родным разрешением ниже этого отдаётся как есть, без увеличения.
+        zoom=None — родное разрешение скана; фактический масштаб всегда
+        page_zoom(idx, zoom).
+        Результат нельзя изменять на месте — это может быть кэш.
+        """
+        image = self._image(idx)
+        if image is not None:
+            img = image.view(zoom, clip, keep=idx in self.keep_pages)
+            if img is not None:
+                return _downscale(img, image.zoom / image.factor(zoom), zoom)
+            with self._lock:
+                self._images[idx] = None  # OpenCV не декодирует поток — растеризуем
+
+        zoom = self.zoom if zoom is None else min(zoom, self.zoom)
+
+        cached = self._cached_page(idx, zoom)
+        if cached is not None:
+            have, img = cached
+            return _downscale(_crop(img, clip), have, zoom)
+        if idx in self.keep_pages and tuple(clip) == FULL_PAGE:
+            return self._page(idx, zoom)
+        return self._region(idx, clip, zoom)
+
+    def export_views(self) -> dict:
+        """
+        Полные виды keep_pages, которые уже отрендерены или декодированы, —
+        чтобы этап в другом процессе (OCR в режиме process) не делал их заново.
+        """
+        with self._lock:
+            images = {idx: image.decoded() for idx, image in self._images.items()
+                      if image is not None and idx in self.keep_pages}
+            return {
+                "pages": {idx: dict(renders) for idx, renders in self._pages.items()},
+                "images": {idx: decoded for idx, decoded in images.items() if decoded},
+            }
+
+    def page_zoom(self, idx: int, zoom: float | None = None) -> float:
+        """Фактический масштаб, который вернёт view(idx, zoom)."""
+        image = self._image(idx)
+        if image is not None:
+            decoded = image.zoom / image.factor(zoom)
+            return decoded if zoom is None else min(zoom, decoded)
+        return self.zoom if zoom is None else min(zoom, self.zoom)
+
+    # -------------------------
+    # Встроенные изображения
+    # -------------------------
+    def _image(self, idx: int) -> "_PageImage | None":
+        if not self.use_images:
+            return None
+        with self._lock:
+            if idx not in self._images:
+                image = _PageImage.detect(self.doc, idx)
+                if image is not None and idx in self._seeded_images:
+                    image.seed(self._seeded_images.pop(idx))
+                self._images[idx] = image
+            return self._images[idx]
+
+    # -------------------------
+    # Растеризация
+    # -------------------------
+    def _cached_page(self, idx: int, zoom: float) -> tuple[float, np.ndarray] | None:
+        """Самый мелкий из полных рендеров страницы, из которого получается вид масштаба zoom."""
+        with self._lock:
+            renders = self._pages.get(idx, {})
+            have = min((z for z in renders if z >= zoom), default=None)
+            return None if have is None else (have, renders[have])
+
+    def _page(self, idx: int, zoom: float) -> np.ndarray:
+        with self._lock:
+            img = self._pages.get(idx, {}).get(zoom)
+            if img is None:
+                img = self._render(idx, FULL_PAGE, zoom)
+                self._pages.setdefault(idx, {})[zoom] = img
+            return img
+
+    def _region(self, idx: int, clip: tuple, zoom: float) -> np.ndarray:
+        key, thread = (idx, tuple(clip), zoom), threading.get_ident()
+        with self._lock:
+            last = self._last_region.get(thread)
+            if last and last[0] == key:
+                return last[1]
+            img = self._render(idx, clip, zoom)
+            self._last_region[thread] = (key, img)
+            return img
+
+    def _render(self, idx: int, clip: tuple, zoom: float) -> np.ndarray:
+        page = self.doc[idx]
+        rect = page.rect
+        x0, y0, x1, y1 = clip
+        area = fitz.Rect(
+            rect.x0 + rect.width * x0,
+            rect.y0 + rect.height * y0,
+            rect.x0 + rect.width * x1,
+            rect.y0 + rect.height * y1,
+        )
+        with metrics.stage("render"):
+            pix = page.get_pixmap(
+                matrix=fitz.Matrix(zoom, zoom),
+                clip=area,
+                colorspace=fitz.csGRAY,
+                alpha=False,
+            )
+        return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w).copy()
+
+
+def _downscale(img: np.ndarray, have: float, want: float | None) -> np.ndarray:
+    """Уменьшает вид масштаба have до want (увеличение не делается)."""
+    if want is None or want >= have:
+        return img
+    scale = want / have
+    h, w = img.shape
+    return cv2.resize(
+        img,
+        (max(1, round(w * scale)), max(1, round(h * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+def _crop(img: np.ndarray, clip: tuple) -> np.ndarray:
+    if tuple(clip) == FULL_PAGE:
+        return img
+    h, w = img.shape
+    x0, y0, x1, y1 = clip
+    return img[int(h * y0):int(h * y1), int(w * x0):int(w * x1)]
+
+
+class _PageImage:
+    """
+    Встроенный скан страницы: поток изображения и его декодированные виды.
+    Создаётся только для страниц, которые целиком равны одной картинке
+    без поворота, текста, векторной графики и маски прозрачности.
+    """
+
+    def __init__(self, data: bytes, width: int, height: int, zoom: float):
+        self.data = np.frombuffer(data, dtype=np.uint8)
+        self.width, self.height = width, height
+        self.zoom = zoom  # родной масштаб относительно 72 DPI
+
+        self._decoded: dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def detect(cls, doc, idx: int) -> "_PageImage | None":
+        """
+        Вызывается под локом документа. None — страницу надо растеризовать.
+
+        Геометрия берётся разбором content stream, а не get_image_info():
+        тот прогоняет страницу через устройство MuPDF и декодирует картинку.
+        """
+        page = doc[idx]
+        if page.rotation or page.cropbox != page.mediabox:
+            return None
+
+        match = _SINGLE_IMAGE_RE.fullmatch(page.read_contents())
+        if not match:
+            return None  # есть текст, векторная графика или несколько объектов
+        a, b, c, d, e, f = (float(v) for v in match.group("cm").split())
+        name = match.group("name").decode("latin-1")
+
+        # Картинка без поворота и отражения на всю страницу
+        box = page.mediabox
+        if abs(b) > 1e-3 or abs(c) > 1e-3 or a <= 0 or d <= 0:
+            return None
+        if any(abs(x - y) > _BBOX_TOLERANCE for x, y in
+               ((e, box.x0), (f, box.y0), (a, box.width), (d, box.height))):
+            return None
+
+        entry = next((img for img in page.get_images(full=True) if img[7] == name), None)
+        if entry is None or entry[1]:  # не XObject-изображение или есть маска прозрачности
+            return None
+
+        extracted = doc.extract_image(entry[0])
+        if not extracted or extracted.get("colorspace") not in (1, 3):
+            return None
+
+        width, height = extracted["width"], extracted["height"]
+        zoom_x, zoom_y = width / box.width, height / box.height
+        if abs(zoom_x - zoom_y) > 0.02 * zoom_x:
+            return None  # неквадратные пиксели — пусть масштабирует MuPDF
+
+        return cls(extracted["image"], width, height, zoom_x)
+
+    def factor(self, zoom: float | None) -> int:
+        """Самое сильное уменьшение, при котором масштаб не ниже допустимого."""
+        if zoom is not None:
+            for f in (8, 4, 2):
+                if self.zoom / f >= zoom * REDUCED_TOLERANCE:
+                    return f
+        return 1
+
+    def decoded(self) -> dict[int, np.ndarray]:
+        """Декодированные виды {уменьшение: изображение}."""
+        with self._lock:
+            return dict(self._decoded)
+
+    def seed(self, decoded: dict[int, np.ndarray]) -> None:
+        """Виды, декодированные в другом процессе из того же потока."""
+        with self._lock:
+            self._decoded.update(decoded)
+
+    def view(self, zoom: float | None, clip: tuple, keep: bool) -> np.ndarray | None:
+        factor = self.factor(zoom)
+        with self._lock:
+            img = self._decoded.get(factor)
+            if img is None:
+                img = self._decode(factor)
+                if img is None:
+                    return None
+                if not keep:
+                    self._decoded.clear()  # как _last_region: держим только последний вид
+                self._decoded[factor] = img
+        return _crop(img, clip)
+
+    def _decode(self, factor: int) -> np.ndarray | None:
+        with metrics.stage("decode_image"):
+            img = cv2.imdecode(self.data, _REDUCED_FLAGS[factor])
+        if img is None:
+            return None  # формат, который OpenCV не читает (JBIG2, JPX...)
+
+        # Не-JPEG форматы OpenCV декодирует целиком — доводим до нужного размера
+        h, w = (self.height + factor - 1) // factor, (self.width + factor - 1) // factor
+        if img.shape != (h, w):
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        return img
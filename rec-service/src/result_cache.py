@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import src.queries as queries
+from src.config import (BATCH_SPLIT, OCR_BACKEND, OCR_MIN_PROB, OCR_MODEL_FILE, OCR_TIERS,
+                        QR_SCAN_MODE, QR_SECRET)
+from src.inference import model_file as backend_model_file
+
+logger = logging.getLogger("worker.cache")
+
+# Версия конвейера распознавания: увеличивать при изменениях QR/OCR,
+# меняющих результат, — старые записи кэша перестанут совпадать.
+PIPELINE_VERSION = 8
+
+
+def model_version(model_path: str, backend: str = OCR_BACKEND, model_file: str | None = OCR_MODEL_FILE) -> str:
+    """
+    Версия результата: хэш файла, который реально загружает бэкенд
+    (.h5, .npz или .tflite), отпечаток настроек, от которых зависит итог
+    (секрет QR, разбор пачек, режим скана QR, каскад OCR), и версия конвейера.
+    """
+    path = model_file or backend_model_file(backend, model_path)
+    digest = hashlib.sha256()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+    settings = repr((backend, QR_SECRET, BATCH_SPLIT, QR_SCAN_MODE, tuple(OCR_TIERS), OCR_MIN_PROB))
+    fingerprint = hashlib.sha256(settings.encode()).hexdigest()[:8]
+    return f"{digest.hexdigest()[:16]}-{fingerprint}-p{PIPELINE_VERSION}"
+
+
+class PgResultStore:
+    """Таблица doc_results: кэш, общий для всех процессов и узлов."""
+
+    def __init__(self, session_factory):
+        self.session = session_factory  # контекстный менеджер, выдающий курсор
+
+    def load(self, digest: str, version: str) -> dict | None:
+        with self.session() as cur:
+            return queries.get_cached_result(cur, digest, version)
+
+    def save(self, digest: str, version: str, result: dict) -> None:
+        with self.session() as cur:
+            queries.save_cached_result(cur, digest, version, result)
+
+
+class ResultCache:
+    """
+    Кэш итогов распознавания (движок, см. engine) по SHA-256 байтов PDF и версии результата.
+
+    Сначала смотрит LRU в памяти процесса, затем (если задан store) Postgres.
+    Ошибки store не ломают обработку — считаются промахом.
+    """
+
+    def __init__(self, version: str, maxsize: int = 1024, store: PgResultStore | None = None):
+        self.version = version
+        self.maxsize = maxsize
+        self.store = store
+        self._items: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(pdf_bytes: bytes) -> str:
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    def get(self, digest: str) -> dict | None:
+        with self._lock:
+            result = self._items.get(digest)
+            if result is not None:
+                self._items.move_to_end(digest)
+                self.hits += 1
+                return dict(result)
+
+        if self.store is not None:
+            try:
+                result = self.store.load(digest, self.version)
+            except Exception as e:
+                logger.warning(f"Кэш результатов в БД недоступен: {e}")
+                result = None
+            if result is not None:
+                self._remember(digest, result)
+                with self._lock:
+                    self.hits += 1
+                return dict(result)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest: str, result: dict) -> None:
+        self._remember(digest, result)
+        if self.store is not None:
+            try:
+                self.store.save(digest, self.version, result)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить результат в кэш БД: {e}")
+
+    def _remember(self, digest: str, result: dict) -> None:
+        with self._lock:
+            self._items[digest] = dict(result)
+            self._items.move_to_end(digest)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
@@ -0,0 +1,60 @@
+import socket
+
+import psycopg2
+from botocore.exceptions import ClientError, HTTPClientError, IncompleteReadError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from psycopg2 import errorcodes
+
+# Коды S3, означающие перегрузку или недоступность, а не проблему с файлом
+_S3_TRANSIENT_CODES = {
+    "RequestTimeout", "RequestTimeTooSkewed", "SlowDown", "ServiceUnavailable",
+    "InternalError", "Throttling", "ThrottlingException", "500", "502", "503", "504",
+}
+
+# Postgres недоступен целиком (для предохранителя)
+_PG_DOWN_CODES = {
+    errorcodes.ADMIN_SHUTDOWN,
+    errorcodes.CRASH_SHUTDOWN,
+    errorcodes.CANNOT_CONNECT_NOW,
+    errorcodes.TOO_MANY_CONNECTIONS,
+}
+
+# Ошибки Postgres, после которых повтор той же транзакции имеет смысл
+_PG_TRANSIENT_CODES = _PG_DOWN_CODES | {
+    errorcodes.SERIALIZATION_FAILURE,
+    errorcodes.DEADLOCK_DETECTED,
+    errorcodes.LOCK_NOT_AVAILABLE,
+}
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Временный ли сбой: таймауты и обрывы S3, потеря соединения с БД,
+    конфликты сериализации. Просматривает цепочку __cause__/__context__.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if _transient(exc):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def db_unavailable(exc: BaseException) -> bool:
+    """Потеряно соединение с Postgres или сервер не принимает подключения."""
+    return isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError)) \
+        and (exc.pgcode is None or exc.pgcode in _PG_DOWN_CODES)
+
+
+def _transient(exc: BaseException) -> bool:
+    if isinstance(exc, psycopg2.Error):
+        if exc.pgcode in _PG_TRANSIENT_CODES:
+            return True
+        # Без pgcode — соединение оборвалось до ответа сервера
+        return exc.pgcode is None and isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    if isinstance(exc, ClientError):
+        return str(exc.response.get("Error", {}).get("Code")) in _S3_TRANSIENT_CODES
+    # Обрывы и таймауты соединения с S3, недочитанное тело ответа
+    return isinstance(exc, (BotoConnectionError, HTTPClientError, IncompleteReadError,
+                            ConnectionError, TimeoutError, socket.timeout))
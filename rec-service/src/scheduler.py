@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("worker.scheduler")
+
+
+class FairScheduler:
+    """
+    Справедливый выбор бакета (принтера) для следующего захвата задачи:
+    deficit round-robin со стоимостью задачи 1.
+
+    Активные бакеты стоят в кольце. Бакет в голове кольца получает квант,
+    равный своему весу, и обслуживается, пока дефицит не меньше 1; затем
+    уходит в конец кольца. Опустевший бакет покидает кольцо и теряет
+    накопленный дефицит. Так 5000 сканов одного принтера занимают
+    не больше своей доли захватов, пока у других есть работа.
+
+    Глубины очередей берутся из снимка БД (update), между снимками
+    уменьшаются на каждый захват. Потокобезопасен.
+    """
+
+    IDLE_REFRESH_SEC = 0.2
+
+    def __init__(self, weights: dict[str, float] | None = None, default_weight: float = 1.0,
+                 refresh_sec: float = 2.0):
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self.refresh_sec = refresh_sec
+
+        self._lock = threading.Lock()
+        self._ring: deque[str] = deque()
+        self._deficit: dict[str, float] = {}
+        self._depth: dict[str, int] = {}
+        self._refreshed = float("-inf")
+
+        self.served: dict[str, int] = {}
+
+    def weight(self, bucket: str) -> float:
+        return self.weights.get(bucket, self.default_weight)
+
+    # -------------------------
+    # Снимок очередей
+    # -------------------------
+    def claim_refresh(self) -> bool:
+        """True, если снимок устарел (или очередь пуста) и обновить его должен вызывающий."""
+        now = time.monotonic()
+        with self._lock:
+            # Пустое кольцо обновляем чаще, но не на каждый захват
+            interval = self.refresh_sec if self._ring else min(self.refresh_sec, self.IDLE_REFRESH_SEC)
+            if now - self._refreshed < interval:
+                return False
+            self._refreshed = now
+            return True
+
+    def update(self, depths: dict[str, int]) -> None:
+        """Принимает свежий снимок {бакет: свободных задач}."""
+        with self._lock:
+            self._depth = {b: n for b, n in depths.items() if n > 0}
+            for bucket in [b for b in self._ring if b not in self._depth]:
+                self._drop(bucket)
+            for bucket in sorted(self._depth):
+                if bucket not in self._deficit:
+                    self._join(bucket)
+
+    # -------------------------
+    # Выбор
+    # -------------------------
+    def next(self) -> str | None:
+        """Бакет для следующего захвата или None, если известных задач нет."""
+        with self._lock:
+            while self._ring:
+                bucket = self._ring[0]
+                if self._deficit[bucket] >= 1:
+                    self._deficit[bucket] -= 1
+                    return bucket
+                self._ring.rotate(-1)
+                self._deficit[self._ring[0]] += self.weight(self._ring[0])
+            return None
+
+    def served_from(self, bucket: str) -> None:
+        """Задача из bucket захвачена."""
+        with self._lock:
+            self.served[bucket] = self.served.get(bucket, 0) + 1
+            left = self._depth.get(bucket, 0) - 1
+            if left > 0:
+                self._depth[bucket] = left
+            elif bucket in self._deficit:
+                self._depth.pop(bucket, None)
+                self._drop(bucket)
+
+    def exhausted(self, bucket: str) -> None:
+        """Захват из bucket ничего не нашёл (разобрали другие узлы) — бакет пуст."""
+        with self._lock:
+            self._depth.pop(bucket, None)
+            if bucket in self._deficit:
+                self._drop(bucket)
+
+    def _join(self, bucket: str) -> None:
+        # Пустое кольцо — бакет сразу в голове и сразу получает квант
+        self._deficit[bucket] = 0.0 if self._ring else self.weight(bucket)
+        self._ring.append(bucket)
+
+    def _drop(self, bucket: str) -> None:
+        head = self._ring and self._ring[0] == bucket
+        self._ring.remove(bucket)
+        del self._deficit[bucket]
+        if head and self._ring:
+            self._deficit[self._ring[0]] += self.weight(self._ring[0])
+
+    # -------------------------
+    # Мониторинг
+    # -------------------------
+    def depths(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._depth)
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            buckets = set(self._depth) | set(self.served)
+            return {
+                b: {"depth": self._depth.get(b, 0), "served": self.served.get(b, 0), "weight": self.weight(b)}
+                for b in sorted(buckets)
+            }
@@ -1,6 +1,9 @@
 import logging
 import re
-import time
+
+from src import metrics
+from src.batch import letter_ranges
+from src.render import PageRenderCache
 
 
 logger = logging.getLogger("worker.services")
@@ -12,27 +15,60 @@ class DocumentProcessor:
     RE_WSNA = re.compile(r"wsna-(\d+)")
     RE_ANSW = re.compile(r"answ-(\d+)")
 
-    def __init__(self, ocr_engine, qr_scanner):
+    def __init__(self, ocr_engine, qr_scanner, split_batches: bool = True):
         self.ocr = ocr_engine
         self.scan_qr = qr_scanner
+        self.split_batches = split_batches  # пачку писем — на отдельные письма (см. batch)
 
-    def get_document_info(self, pdf_bytes: bytes) -> dict:
+    def get_document_info(self, pdf_bytes: bytes, precheck=None) -> dict:
         """
         Анализирует PDF и возвращает словарь с результатом.
+        Документ открывается и растеризуется один раз — рендер общий для QR и OCR.
+
+        precheck(doc) -> str | None — дешёвая проверка между QR и OCR
+        (например, занят ли бланк в БД). Если она вернула причину, OCR
+        не запускается и документ возвращается как ошибка с этой причиной.
 
         Возможные статусы:
           {"status": "error",   "reason": str, "qr_text": str | None}
           {"status": "success", "type": "answer", "id": int}
-          {"status": "success", "type": "init",   "id": int, "phone": str | None, "qr_text": str}
+          {"status": "success", "type": "init",   "id": int, "phone": str | None,
+           "digit_probs": list[float], "ocr_tiers": list[str], "qr_text": str,
+           "ocr_error": str}  # ocr_error — только если OCR не отработал (такой итог не кэшируется)
+          {"status": "success", "type": "batch",  "pages": [[первая, последняя + 1], ...]}
+        """
+        with PageRenderCache(pdf_bytes) as pages:
+            doc = self.decode_qr(pages)
+            if not self.needs_ocr(doc):
+                return doc
+
+            reason = precheck(doc) if precheck else None
+            if reason:
+                return self.skipped(doc, reason)
+
+            return self.recognize_phone(pages, doc)
+
+    # -------------------------
+    # Этапы
+    # -------------------------
+    def decode_qr(self, pages) -> dict:
+        """
+        Этап 1: QR → тип и ID документа. Для init телефон ещё не распознан.
+        Скан с несколькими письмами (разные QR) — batch: письма разбираются отдельно.
         """
-        qr_results = self.scan_qr(pdf_bytes)
-        valid_qr = next((r for r in qr_results if r[2]), None)
+        qr_results = self.scan_qr(pages)
+        if self.split_batches:
+            ranges = letter_ranges(qr_results, len(pages))
+            if len(ranges) > 1:
+                return {"status": "success", "type": "batch", "pages": [list(r) for r in ranges]}
+
+        valid_qr = next((r for r in qr_results if r.valid), None)
 
         if not valid_qr:
-            raw = qr_results[0][1] if qr_results else None
+            raw = qr_results[0].text if qr_results else None
             return {"status": "error", "reason": "QR_NOT_FOUND", "qr_text": raw}
 
-        qr_text = valid_qr[1]
+        qr_text = valid_qr.text
 
         if "rpismo-wsna-" in qr_text:
             match = self.RE_WSNA.search(qr_text)
@@ -44,17 +80,35 @@ class DocumentProcessor:
             match = self.RE_ANSW.search(qr_text)
             if not match:
                 return {"status": "error", "reason": "QR_PARSE_FAILED", "qr_text": qr_text}
-            phone = self.ocr.extract_phone(pdf_bytes)
-            return {
+            doc = {
                 "status": "success",
                 "type": "init",
                 "id": int(match.group(1)),
-                "phone": phone,
                 "qr_text": qr_text,
             }
+            if valid_qr.page == 1 and valid_qr.polygon:
+                doc["qr_polygon"] = valid_qr.polygon  # для OCR; в результат не попадает
+            return doc
 
         return {"status": "error", "reason": "UNKNOWN_QR_TYPE", "qr_text": qr_text}
 
+    def recognize_phone(self, pages, doc: dict) -> dict:
+        """Этап 2: OCR телефона для init-письма."""
+        doc = dict(doc)
+        ocr = self.ocr.extract_phone(pages, doc.pop("qr_polygon", None))
+        doc = {**doc, "phone": ocr.phone, "digit_probs": ocr.probs, "ocr_tiers": ocr.tiers}
+        if ocr.error:
+            doc["ocr_error"] = ocr.error
+        return doc
+
+    @staticmethod
+    def needs_ocr(doc: dict) -> bool:
+        return doc["status"] == "success" and doc["type"] == "init"
+
+    @staticmethod
+    def skipped(doc: dict, reason: str) -> dict:
+        return {"status": "error", "reason": reason, "qr_text": doc.get("qr_text")}
+
 
 class StorageService:
     """Отвечает только за доставку байтов из S3/MinIO."""
@@ -62,16 +116,16 @@ class StorageService:
     def __init__(self, s3_client):
         self.s3 = s3_client
 
-    def download(self, bucket_name: str, key: str, retries: int = 3) -> bytes:
-        """Скачивает файл из S3 с экспоненциальными повторами."""
-        for attempt in range(retries):
-            try:
-                obj = self.s3.get_object(Bucket=bucket_name, Key=key)
-                return obj["Body"].read()
-            except Exception as e:
-                logger.warning(f"S3 попытка {attempt + 1}/{retries} для '{key}': {e}")
-                if attempt == retries - 1:
-                    raise RuntimeError(
-                        f"Не удалось скачать '{key}' после {retries} попыток"
-                    ) from e
-                time.sleep(2 ** attempt)  # 1с → 2с → 4с
\ No newline at end of file
+    def download(self, bucket_name: str, key: str) -> bytes:
+        """
+        Скачивает файл из S3 одной попыткой. Повторы не ждут в потоке воркера:
+        временный сбой откладывает задачу в proc_files (см. retry, schedule_retry).
+        """
+        with metrics.stage("s3_download"):
+            obj = self.s3.get_object(Bucket=bucket_name, Key=key)
+            return obj["Body"].read()
+
+    def upload(self, bucket_name: str, key: str, data: bytes) -> None:
+        """Кладёт файл в S3 одной попыткой (повторы — как у download)."""
+        with metrics.stage("s3_upload"):
+            self.s3.put_object(Bucket=bucket_name, Key=key, Body=data, ContentType="application/pdf")
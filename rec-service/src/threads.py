@@ -0,0 +1,139 @@
+import logging
+import os
+from dataclasses import dataclass
+
+import cv2
+
+logger = logging.getLogger("worker.threads")
+
+# Пулы BLAS/OpenMP читают эти переменные при импорте — в дочерние процессы
+# они попадают через окружение (spawn)
+_THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def available_cores() -> list[int]:
+    """Ядра, на которых процессу разрешено работать (учитывает taskset/cgroup cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+@dataclass(frozen=True)
+class ThreadBudget:
+    """
+    Бюджет ядер воркера и производная от него настройка потоков.
+
+    Каждая задача распознавания сама по себе тянет потоки: OpenCV — свой пул
+    на вызов, TensorFlow — intra/inter-op пулы по числу ядер. При нескольких
+    задачах сразу это переподписка CPU. Бюджет делит ядра между одновременно
+    работающими задачами: cv2 и TF получают cores // workers потоков (не меньше 1).
+    MuPDF рендерит в потоке вызова — его ограничивает ширина executor.
+
+    В режиме process процессы пулов можно закрепить за непересекающимися
+    наборами ядер (pin).
+    """
+
+    mode: str
+    cores: tuple[int, ...]
+    qr_workers: int
+    ocr_workers: int
+    pin: bool = False
+
+    @classmethod
+    def plan(cls, mode: str, cores: int, qr_workers: int, ocr_workers: int, pin: bool = False) -> "ThreadBudget":
+        """cores — сколько ядер отдать воркеру (0 — все доступные)."""
+        allowed = available_cores()
+        if 0 < cores < len(allowed):
+            allowed = allowed[:cores]
+        return cls(mode, tuple(allowed), qr_workers, ocr_workers, pin and mode == "process")
+
+    @property
+    def workers(self) -> int:
+        """Сколько задач распознавания может выполняться одновременно."""
+        return self.qr_workers + self.ocr_workers
+
+    @property
+    def lib_threads(self) -> int:
+        """Потоков OpenCV/BLAS на задачу."""
+        return max(1, len(self.cores) // self.workers)
+
+    @property
+    def tf_intra(self) -> int:
+        # В режиме thread модель общая на все потоки OCR — делим ядра между ними
+        if self.mode == "thread":
+            return max(1, len(self.cores) // self.ocr_workers)
+        return self.lib_threads
+
+    tf_inter = 1  # граф модели последовательный — параллелить нечего
+
+    def core_set(self, index: int) -> set[int]:
+        """Ядра процесса пула с порядковым номером index."""
+        n = len(self.cores)
+        if self.workers >= n:
+            return {self.cores[index % n]}
+        i = index % self.workers  # остаток ядер раздаётся по одному, а не простаивает
+        return set(self.cores[i * n // self.workers:(i + 1) * n // self.workers])
+
+    def environ(self) -> dict[str, str]:
+        """Переменные окружения для процессов, которые ещё не импортировали библиотеки."""
+        env = {key: str(self.lib_threads) for key in _THREAD_ENV}
+        env["TF_NUM_INTRAOP_THREADS"] = str(self.tf_intra)
+        env["TF_NUM_INTEROP_THREADS"] = str(self.tf_inter)
+        return env
+
+    def apply(self, index: int | None = None, with_tf: bool = False) -> None:
+        """
+        Применяет бюджет к текущему процессу: закрепление за ядрами (процесс
+        пула с номером index), потоки cv2 и — до первой операции — TF.
+        """
+        if self.pin and index is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.core_set(index))
+        cv2.setNumThreads(self.lib_threads)
+        os.environ.update(self.environ())
+
+        if with_tf:
+            import tensorflow as tf  # тяжёлый импорт — только для бэкенда keras
+
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(self.tf_intra)
+                tf.config.threading.set_inter_op_parallelism_threads(self.tf_inter)
+            except RuntimeError as e:  # контекст TF уже создан
+                logger.warning(f"Потоки TensorFlow не изменены: {e}")
+
+    def effective(self) -> str:
+        """Фактическая настройка текущего процесса — для лога."""
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else "все"
+        return f"ядра {_ranges(cores)}, cv2 {cv2.getNumThreads()} потоков"
+
+    def describe(self) -> str:
+        lines = [
+            f"Бюджет CPU: {len(self.cores)} ядер ({_ranges(self.cores)}), режим {self.mode}, "
+            f"задач одновременно {self.workers} (qr {self.qr_workers}, ocr {self.ocr_workers})",
+            f"на задачу: OpenCV/BLAS {self.lib_threads}, TF intra {self.tf_intra} / inter {self.tf_inter}",
+        ]
+        if self.pin:
+            lines.append("закрепление: " + "; ".join(
+                f"процесс {i}: {_ranges(sorted(self.core_set(i)))}" for i in range(self.workers)
+            ))
+        if len(self.cores) < self.workers:
+            lines.append(f"задач больше, чем ядер ({self.workers} > {len(self.cores)}) — "
+                         f"часть задач делит ядро")
+        return "; ".join(lines)
+
+
+def _ranges(cores) -> str:
+    """[0, 1, 2, 5] → '0-2,5'."""
+    if isinstance(cores, str):
+        return cores
+    parts, start, prev = [], None, None
+    for c in cores:
+        if start is None:
+            start = prev = c
+        elif c == prev + 1:
+            prev = c
+        else:
+            parts.append(f"{start}-{prev}" if prev != start else f"{start}")
+            start = prev = c
+    if start is not None:
+        parts.append(f"{start}-{prev}" if prev != start else f"{start}")
+    return ",".join(parts)